@@ -13,11 +13,15 @@
 #include "config.h"
 
 
+#define RX_QUEUE_DEPTH 32  // Received packets the main loop hasn't applied yet
+
 extern uint8_t rx_array[64];
-extern uint8_t rx_flag;
+extern volatile uint8_t rx_flag;  // Set when packets are queued
 extern uint8_t send_flag;
 
 
 void USB_DataReceived(uint8_t* Buf, uint32_t Len);
+void USB_EchoFlush(void);
+uint8_t USB_PacketPop(uint8_t* packet);
 
 #endif /* INC_ISRCALLBACKS_H_ */
@@ -6,32 +6,78 @@
  */
 
 #include "ISRcallbacks.h"
+#include <string.h>
+#include "usbd_cdc_if.h"
 uint8_t rx_array[64];
-uint8_t rx_flag = 0;
+volatile uint8_t rx_flag = 0;
+
+// Complete packets waiting for the main loop, oldest at rx_tail
+static uint8_t rx_queue[RX_QUEUE_DEPTH][sizeof(rx_array)];
+static uint8_t rx_lengths[RX_QUEUE_DEPTH];
+static volatile uint32_t rx_head = 0;  // Written by the USB interrupt only
+static volatile uint32_t rx_tail = 0;  // Written by the main loop only
+
+// Echoes are collected in one buffer while the other is being transmitted
+static uint8_t echo_array[2][APP_TX_DATA_SIZE];
+static uint32_t echo_len[2] = {0, 0};
+static uint8_t echo_fill = 0;
+
 //ISR usb intterupt rutine ting
 void USB_DataReceived(uint8_t* Buf, uint32_t Len) {
     static uint8_t i = 0;
     GPIOB->BSRR = GPIO_PIN_2;
 
-    // Copy ALL bytes from this USB packet
+    // The host may pipeline several packets into one USB transfer, so frame
+    // each packet by its length byte instead of by transfer boundaries
     for (uint32_t j = 0; j < Len; j++) {
         rx_array[i] = Buf[j];  // Buf[j], not Buf[i]
     	//CDC_Transmit_FS(&rx_array[i], 1);
         i++;
-    }
-
 
+        //rx_array[1] corresponds to the length of the packet
+        if (i >= 2 && (i == rx_array[1] || i == sizeof(rx_array))) {
+            // finished, queue the packet and then its echo. A packet that
+            // doesn't fit is dropped without an echo, so the host resends it
+            uint32_t next = (rx_head + 1) % RX_QUEUE_DEPTH;
+            if (next != rx_tail && echo_len[echo_fill] + i <= APP_TX_DATA_SIZE) {
+                memcpy(rx_queue[rx_head], rx_array, i);
+                rx_lengths[rx_head] = i;
+                __DMB();  // The packet is stored before the main loop can see it
+                rx_head = next;
+                rx_flag = 1;
 
-    //rx_array[1] corresponds to the length of the packet
-    if (i == rx_array[1]) {
-        // finished
-    	//CDC_Transmit_FS(rx_array, i);
-    	rx_flag = 1;
-    	CDC_Transmit_HS(rx_array, i);
-        i = 0;
+                memcpy(&echo_array[echo_fill][echo_len[echo_fill]], rx_array, i);
+                echo_len[echo_fill] += i;
+            }
+            i = 0;
+        }
     }
 
+    USB_EchoFlush();
+}
 
+// Transmit the collected echoes unless a transmit is still in progress;
+// called again from the transmit complete callback, so BUSY only delays them
+void USB_EchoFlush(void) {
+    if (echo_len[echo_fill] == 0) {
+        return;
+    }
+    if (CDC_Transmit_HS(echo_array[echo_fill], echo_len[echo_fill]) != USBD_OK) {
+        return;  // Still sending the other buffer, retried when it completes
+    }
+    echo_fill ^= 1;
+    echo_len[echo_fill] = 0;
+}
 
-
+// Copy the oldest received packet to packet; returns its length, 0 if none.
+// Clear rx_flag before popping until this returns 0, so no packet is missed
+uint8_t USB_PacketPop(uint8_t* packet) {
+    if (rx_tail == rx_head) {
+        return 0;
+    }
+    __DMB();  // Read the packet only after seeing it published
+    uint8_t len = rx_lengths[rx_tail];
+    memcpy(packet, rx_queue[rx_tail], len);
+    rx_tail = (rx_tail + 1) % RX_QUEUE_DEPTH;
+    return len;
 }
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+Benchmark - Host stack performance against a simulated board
+
+Measures:
+  - frame decoder and voltage conversion throughput (frames/s, MB/s)
+  - wall-clock time of a full 24-channel configuration upload
+  - frame arrival to update_display latency at increasing telemetry rates
+  - local server fan-out to several subscribers, one of them stalled
+  - streaming statistics and alarm evaluation throughput (rows/s)
+  - Welch ripple analysis throughput and report time
+  - closed-loop regulation latency against a board with a gain error
+  - cold import time of the GUI and Start to first frame drawn
+
+Results are printed as JSON so runs can be compared between commits:
+
+    python benchmark.py --output results.json
+
+The decoder and upload benchmarks are headless. The display benchmarks need
+PyQt6 and pyqtgraph and are skipped if they can't be imported; set
+QT_QPA_PLATFORM=offscreen to run them without a display.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from pcc import protocol
+from pcc.convert import FrameConverter
+from pcc.decoder import FrameDecoder
+from pcc.simulator import PCCSimulator
+from pcc.transport import SerialTransport
+from pcc.uploader import PipelinedUploader
+
+DISPLAY_RATES = [1000, 5000, 20000, 50000]  # Telemetry frames per second
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Summarise latencies in milliseconds"""
+    if not values:
+        return {}
+    data = np.asarray(values) * 1000
+    return {
+        "count": len(data),
+        "p50_ms": float(np.percentile(data, 50)),
+        "p90_ms": float(np.percentile(data, 90)),
+        "p99_ms": float(np.percentile(data, 99)),
+        "max_ms": float(data.max()),
+    }
+
+
+def make_stream(frame_count: int, corrupt_rate: float = 0.001,
+                frame_format: int = protocol.FRAME_LEGACY) -> bytes:
+    """Synthetic telemetry stream with a few corrupted frames"""
+    simulator = PCCSimulator(drop_rate=corrupt_rate, seed=0)
+    simulator.frame_format = frame_format
+    simulator.start_codes[:] = np.linspace(0, protocol.DAC_FULL_SCALE, protocol.NUM_CHANNELS)
+    return simulator.make_frames(np.arange(frame_count) / 1000.0)
+
+
+def bench_decoder(frame_count: int, chunk_size: int,
+                  frame_format: int = protocol.FRAME_LEGACY) -> dict:
+    """Throughput of FrameDecoder.feed on fixed-size chunks"""
+    stream = make_stream(frame_count, frame_format=frame_format)
+    decoder = FrameDecoder(frame_format)
+    start = time.perf_counter()
+    decoded = 0
+    for offset in range(0, len(stream), chunk_size):
+        decoded += len(decoder.feed(stream[offset:offset + chunk_size]))
+    elapsed = time.perf_counter() - start
+    return {
+        "chunk_size": chunk_size,
+        "frame_format": frame_format,
+        "frames": decoded,
+        "frames_dropped": decoder.frames_dropped,
+        "crc_failures": decoder.crc_failures,
+        "frames_per_s": decoded / elapsed,
+        "mb_per_s": len(stream) / elapsed / 1e6,
+    }
+
+
+def bench_convert(frame_count: int, batch_size: int) -> dict:
+    """Throughput of the vectorized FrameConverter"""
+    frames = FrameDecoder().feed(make_stream(frame_count, corrupt_rate=0.0))
+    batches = [frames[i:i + batch_size] for i in range(0, len(frames), batch_size)]
+    converter = FrameConverter()
+    start = time.perf_counter()
+    for batch in batches:
+        converter.convert(batch)
+    elapsed = time.perf_counter() - start
+    return {
+        "batch_size": batch_size,
+        "frames_per_s": len(frames) / elapsed,
+        "mb_per_s": len(frames) * protocol.FRAME_SIZE / elapsed / 1e6,
+    }
+
+
+def bench_stats(frame_count: int, batch_size: int) -> dict:
+    """ChannelStats.update plus AlarmEngine.evaluate with every limit set"""
+    from pcc.stats import AlarmEngine, ChannelStats
+
+    rng = np.random.default_rng(0)
+    volts = (5 + 0.01 * rng.standard_normal((frame_count, protocol.NUM_CHANNELS))).astype(np.float32)
+    stats = ChannelStats()
+    alarms = AlarmEngine()
+    for channel in range(protocol.NUM_CHANNELS):
+        alarms.set_limits(channel, high=20.0, low=1.0, ripple=1.0)
+
+    start = time.perf_counter()
+    for i in range(0, frame_count, batch_size):
+        block = volts[i:i + batch_size]
+        stats.update(block)
+        alarms.evaluate(block, stats=stats)
+    elapsed = time.perf_counter() - start
+    return {
+        "batch_size": batch_size,
+        "rows_per_s": frame_count / elapsed,
+        "us_per_batch": elapsed / -(-frame_count // batch_size) * 1e6,
+    }
+
+
+def bench_ripple(frame_count: int, batch_size: int, segment: int) -> dict:
+    """RippleAnalyzer.update over a stream, then one report"""
+    from pcc.spectrum import RippleAnalyzer
+
+    rng = np.random.default_rng(0)
+    volts = (5 + 0.01 * rng.standard_normal((frame_count, protocol.NUM_CHANNELS))).astype(np.float32)
+    analyzer = RippleAnalyzer(segment=segment, sample_rate=10000.0)
+
+    start = time.perf_counter()
+    for i in range(0, frame_count, batch_size):
+        analyzer.update(volts[i:i + batch_size])
+    elapsed = time.perf_counter() - start
+    report_start = time.perf_counter()
+    analyzer.report()
+    return {
+        "batch_size": batch_size,
+        "segment": segment,
+        "rows_per_s": frame_count / elapsed,
+        "segments": analyzer.segments,
+        "report_ms": (time.perf_counter() - report_start) * 1000,
+    }
+
+
+def bench_upload(repeats: int, window: int) -> dict:
+    """Wall-clock time to configure all channels on a simulated board"""
+    packets = [
+        (protocol.channel_config_packet(i, 1.0, 20.0, 100), f"Channel {i + 1}")
+        for i in range(protocol.NUM_CHANNELS)
+    ]
+    times = []
+    failures = 0
+    with PCCSimulator() as simulator:
+        transport = SerialTransport()
+        transport.connect(simulator.port)
+        uploader = PipelinedUploader(transport, window=window)
+        for _ in range(repeats):
+            failures += len(uploader.upload(packets).result(10))
+            times.append(uploader.elapsed)
+        transport.disconnect()
+    return {"window": window, "failures": failures, **percentiles(times)}
+
+
+def bench_table_upload(repeats: int, window: int) -> dict:
+    """Compile and upload a full-length waveform table to every channel"""
+    from pcc.waveform import TableUploader, WaveformCompiler
+
+    profile = {"shape": "sine", "length": protocol.MAX_TABLE_LENGTH, "low": 1.0, "high": 20.0}
+    compiler = WaveformCompiler()
+    start = time.perf_counter()
+    tables = [compiler.compile(channel, profile) for channel in range(protocol.NUM_CHANNELS)]
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    times = []
+    failures = 0
+    with PCCSimulator() as simulator:
+        transport = SerialTransport()
+        transport.connect(simulator.port)
+        uploader = TableUploader(transport, window=window)
+        for _ in range(repeats):
+            transport.device_state.invalidate()
+            failures += len(uploader.upload(tables).result(60))
+            times.append(uploader.elapsed)
+        transport.disconnect()
+    return {"window": window, "failures": failures, "compile_ms": compile_ms,
+            "cache_hits": compiler.hits, "bytes": uploader.bytes_sent,
+            "bytes_per_s": uploader.bytes_sent / float(np.median(times)), **percentiles(times)}
+
+
+def bench_regulator(rate: float, duration: float) -> dict:
+    """ClosedLoopRegulator holding every channel of a board that reads 3% low"""
+    from pcc.regulator import ClosedLoopRegulator
+
+    with PCCSimulator(rate) as simulator:
+        simulator.gain_error[:] = 0.97
+        transport = SerialTransport()
+        transport.connect(simulator.port)
+        regulator = ClosedLoopRegulator(transport)
+        regulator.set_targets({channel: 10.0 for channel in range(protocol.NUM_CHANNELS)})
+        transport.send_command(protocol.start_packet()).result(5)
+        regulator.start()
+        time.sleep(duration)
+        regulator.stop(restore=False)
+        transport.send_command(protocol.stop_packet()).result(5)
+        transport.disconnect()
+    return {"rate": rate, **regulator.report()}
+
+
+def bench_server_fanout(rate: float, subscribers: int, duration: float) -> dict:
+    """Rows delivered by TelemetryServer to live subscribers next to a stalled one"""
+    import asyncio
+    from pcc.server import MSG_REQUEST, TelemetryClient, TelemetryServer, pack_message
+
+    async def run(port: str) -> dict:
+        transport = SerialTransport()
+        transport.connect(port)
+        server = TelemetryServer(transport)
+        await server.start("127.0.0.1:0")
+        host, _, tcp_port = server.addresses[0].rpartition(":")
+
+        # A client that subscribes and then never reads its socket
+        _, stalled = await asyncio.open_connection(host, int(tcp_port))
+        stalled.write(pack_message(MSG_REQUEST, json.dumps(
+            {"id": 1, "op": "subscribe", "queue": 16, "policy": "drop_oldest"}).encode()))
+
+        latencies: List[float] = []
+        received = [0] * subscribers
+        gaps = [0] * subscribers
+
+        async def consume(index: int, client: TelemetryClient):
+            expected = None
+            async for batch in client.batches():
+                latencies.append((time.monotonic_ns() - batch.time_ns) / 1e9)
+                if expected is not None and batch.sequence != expected:
+                    gaps[index] += 1
+                expected = batch.sequence + len(batch.raw)
+                received[index] += len(batch.raw)
+
+        clients = []
+        for _ in range(subscribers):
+            client = TelemetryClient()
+            await client.connect(server.addresses[0])
+            await client.subscribe()
+            clients.append(client)
+        tasks = [asyncio.ensure_future(consume(i, c)) for i, c in enumerate(clients)]
+        await clients[0].request("start")
+        await asyncio.sleep(duration)
+        await clients[0].request("stop")
+        stalled_dropped = max(c.rows_dropped for c in server.clients)
+
+        for client in clients:
+            await client.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        stalled.close()
+        await server.close()
+        transport.disconnect()
+        return {
+            "rate": rate,
+            "subscribers": subscribers,
+            "rows_received": server.rows_received,
+            "rows_per_subscriber": min(received),
+            "gaps": sum(gaps),
+            "stalled_rows_dropped": stalled_dropped,
+            **percentiles(latencies),
+        }
+
+    with PCCSimulator(frame_rate=rate) as simulator:
+        return asyncio.run(run(simulator.port))
+
+
+def bench_parse_packet(frame_count: int) -> dict:
+    """VoltageMonitor.parse_voltage_packet, one frame and one batch at a time"""
+    from voltage_monitor import VoltageMonitor
+    from serial_manager import SerialManager
+
+    frames = FrameDecoder().feed(make_stream(frame_count, corrupt_rate=0.0))
+    monitor = VoltageMonitor(SerialManager())
+    results = {}
+
+    start = time.perf_counter()
+    for frame in frames:
+        monitor.parse_voltage_packet(frame)
+    results["per_frame_frames_per_s"] = len(frames) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(0, len(frames), 256):
+        monitor.parse_voltage_packets(frames[i:i + 256])
+    results["batch_256_frames_per_s"] = len(frames) / (time.perf_counter() - start)
+
+    monitor.stop_monitoring()
+    monitor.deleteLater()
+    return results
+
+
+def bench_update_voltages(repeats: int) -> dict:
+    """VoltageController.update_voltages until every echo is confirmed"""
+    from PyQt6.QtCore import QEventLoop, Qt, QTimer
+    from voltage_controller import VoltageController
+
+    times = []
+    with PCCSimulator() as simulator:
+        controller = VoltageController()
+        controller.serial_manager.connect(simulator.port)
+        loop = QEventLoop()
+        # Queued after the controller's own handler, so logging is included
+        controller.command_completed.connect(
+            lambda handler, future: handler == controller.log_upload_result and loop.quit(),
+            Qt.ConnectionType.QueuedConnection
+        )
+        for _ in range(repeats):
+            # Measure a full upload, not a delta against the mirrored state
+            controller.serial_manager.transport.device_state.invalidate()
+            start = time.perf_counter()
+            controller.update_voltages()
+            QTimer.singleShot(10000, loop.quit)
+            loop.exec()
+            times.append(time.perf_counter() - start)
+        controller.serial_manager.disconnect()
+        controller.deleteLater()
+    return percentiles(times)
+
+
+def bench_display_latency(rate: float, duration: float) -> dict:
+    """Frame arrival to update_display latency at a telemetry rate"""
+    from PyQt6.QtCore import QEventLoop, QTimer
+    from serial_manager import SerialManager
+    from voltage_monitor import VoltageMonitor
+
+    latencies = []
+    arrivals = {}
+    received = [0]
+
+    with PCCSimulator(frame_rate=rate) as simulator:
+        manager = SerialManager()
+        manager.connect(simulator.port)
+
+        # Stamp each batch when the acquisition thread hands it over
+        emit = manager.transport.on_frames_received
+
+        def on_frames(frames):
+            arrivals[id(frames)] = time.perf_counter()
+            emit(frames)
+
+        manager.transport.on_frames_received = on_frames
+
+        monitor = VoltageMonitor(manager)
+        process_frames = monitor.process_frames
+        update_display = monitor.update_display
+        pending = []  # Arrival times of batches not rendered yet
+
+        def timed_process_frames(frames):
+            arrival = arrivals.pop(id(frames), None)
+            if arrival is not None:
+                pending.append(arrival)
+            process_frames(frames)
+            received[0] += len(frames)
+
+        def timed_update_display():
+            # Renders are coalesced, so the oldest waiting batch sets the latency
+            update_display()
+            if pending:
+                latencies.append(time.perf_counter() - pending[0])
+                pending.clear()
+
+        monitor.update_display = timed_update_display
+        manager.frames_received.disconnect(monitor.process_frames)
+        manager.frames_received.connect(timed_process_frames)
+
+        manager.send_command(protocol.start_packet())
+        loop = QEventLoop()
+        QTimer.singleShot(int(duration * 1000), loop.quit)
+        loop.exec()
+        manager.send_command(protocol.stop_packet())
+
+        manager.disconnect()
+        monitor.deleteLater()
+        sent = simulator.frames_sent
+
+    return {
+        "rate": rate,
+        "frames_sent": sent,
+        "frames_displayed": received[0],
+        "frames_dropped": manager.decoder.frames_dropped,
+        "renders": monitor.renders,
+        "renders_coalesced": monitor.renders_coalesced,
+        **percentiles(latencies),
+    }
+
+
+def bench_import(module: str, repeats: int) -> dict:
+    """Cold import time of a module, each in a fresh interpreter"""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    times = [
+        float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                             check=True).stdout)
+        for _ in range(repeats)
+    ]
+    return {"module": module, **percentiles(times)}
+
+
+def bench_first_frame(cycles: int) -> dict:
+    """Start to first frame drawn over start/stop cycles of the controller"""
+    from PyQt6.QtCore import QEventLoop, QTimer
+    from voltage_controller import VoltageController
+
+    latencies = []
+    with PCCSimulator() as simulator:
+        controller = VoltageController()
+        controller.serial_manager.connect(simulator.port)
+        for _ in range(cycles):
+            controller.start_monitoring()
+            monitor = controller.monitor_window
+            loop = QEventLoop()
+            timer = QTimer()
+            timer.timeout.connect(lambda: monitor.first_frame_latency is not None and loop.quit())
+            timer.start(1)
+            QTimer.singleShot(5000, loop.quit)
+            loop.exec()
+            timer.stop()
+            latencies.append(monitor.first_frame_latency or float('nan'))
+            controller.stop_monitoring()
+        controller.serial_manager.disconnect()
+        controller.close()
+    # The first cycle builds the window, later ones reuse it
+    return {"first_ms": latencies[0] * 1000, "reused": percentiles(latencies[1:])}
+
+
+def git_revision() -> str:
+    """Current commit, if run from a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the host stack")
+    parser.add_argument("--output", help="Write JSON results to this file")
+    parser.add_argument("--quick", action="store_true", help="Smaller workloads")
+    parser.add_argument("--no-gui", action="store_true", help="Skip the Qt benchmarks")
+    args = parser.parse_args()
+
+    frame_count = 20000 if args.quick else 200000
+    duration = 1.0 if args.quick else 3.0
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+    }
+
+    # Transport diagnostics would drown the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["decoder"] = [bench_decoder(frame_count, size, frame_format)
+                              for frame_format in (protocol.FRAME_LEGACY, protocol.FRAME_EXTENDED)
+                              for size in (64, 4096, 65536)]
+        results["convert"] = [bench_convert(frame_count, size) for size in (1, 64, 1024)]
+        results["stats"] = [bench_stats(frame_count, size) for size in (16, 64, 1024)]
+        results["ripple"] = [bench_ripple(frame_count, size, segment)
+                             for size in (64, 1024) for segment in (256, 1024, 4096)]
+        results["upload"] = [bench_upload(5 if args.quick else 20, window) for window in (1, 8, 24)]
+        results["table_upload"] = [bench_table_upload(2 if args.quick else 5, window)
+                                   for window in (8, 16, 32)]
+        results["regulator"] = [bench_regulator(rate, duration) for rate in (1000, 10000)]
+        results["server_fanout"] = [bench_server_fanout(20000, subscribers, duration)
+                                    for subscribers in (1, 4, 16)]
+
+        if not args.no_gui:
+            try:
+                from PyQt6.QtWidgets import QApplication
+            except ImportError:
+                results["gui_skipped"] = "PyQt6 not available"
+            else:
+                app = QApplication.instance() or QApplication(sys.argv)
+                results["import"] = [bench_import(module, 3 if args.quick else 10)
+                                     for module in ("voltage_controller", "voltage_monitor")]
+                results["first_frame"] = bench_first_frame(5 if args.quick else 20)
+                results["parse_voltage_packet"] = bench_parse_packet(frame_count // 10)
+                results["update_voltages"] = bench_update_voltages(5 if args.quick else 20)
+                results["display_latency"] = [
+                    bench_display_latency(rate, duration) for rate in DISPLAY_RATES
+                ]
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
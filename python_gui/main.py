@@ -2,23 +2,54 @@
 """
 Voltage Controller Application
 Entry point for the PyQt6-based voltage controller GUI
+
+Startup milestones are logged at INFO level (PCC_LOG_LEVEL=INFO).
+Pass --acquisition-process to read the serial port in a separate process.
 """
 
+import time
+STARTUP_TIME = time.perf_counter()
+
+import logging
 import sys
 import os
 from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import QTimer
+from pcc.trace import configure_logging
 from voltage_controller import VoltageController
 
+log = logging.getLogger("pcc.gui")
+
+
+def log_milestone(name: str):
+    """Log the time since the interpreter started running main.py"""
+    log.info("Startup: %s after %.1f ms", name, (time.perf_counter() - STARTUP_TIME) * 1000)
+
 
 def main():
-    app = QApplication(sys.argv)
+    # Level from PCC_LOG_LEVEL, e.g. DEBUG for packet hex dumps
+    configure_logging()
+    log_milestone("imports done")
+    
+    # Anything not recognised here is left for Qt
+    acquisition_process = "--acquisition-process" in sys.argv
+    argv = [arg for arg in sys.argv if arg != "--acquisition-process"]
+    
+    app = QApplication(argv)
     app.setApplicationName("Voltage Controller")
     app.setApplicationVersion("1.0")
     
-    controller = VoltageController()
+    controller = VoltageController(acquisition_process=acquisition_process)
     controller.show()
+    log_milestone("main window shown")
+    
+    # Runs once the event loop is processing input
+    QTimer.singleShot(0, lambda: log_milestone("interactive"))
+    
+    # Build the monitor window while idle so the first Start is fast
+    QTimer.singleShot(0, controller.create_monitor_window)
     
     sys.exit(app.exec())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,12 @@
+"""
+pcc - Headless host library for the PCC voltage driver
+
+Protocol, serial transport and telemetry decoding without any Qt
+dependency. The PyQt6 GUI is a thin client on top of this package, and
+`python -m pcc` provides a command-line interface.
+"""
+
+from . import protocol
+from .decoder import FrameDecoder
+from .transport import SerialTransport
+from .uploader import PipelinedUploader
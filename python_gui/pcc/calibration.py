@@ -0,0 +1,239 @@
+"""
+Calibration - Per-channel gain/offset and piecewise corrections
+
+Each channel has two independent corrections:
+
+- output: what the op-amp stage really produces for a requested voltage,
+  measured = output_gain * requested + output_offset. Encoding inverts it
+  so the DAC code written for a channel yields the requested voltage.
+- readback: what the monitor readings really mean,
+  true = readback_gain * reading + readback_offset.
+
+Either can be replaced per channel by a piecewise-linear table of
+(x, y) points for stages that aren't linear. Decoding uses one precomputed
+65536-entry code-to-volt table per channel, so correcting a batch of frames
+is a single np.take.
+
+Files are JSON, see save() and load().
+"""
+
+import json
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+from . import protocol
+
+VERSION = 1
+
+# Voltages held during calibrate_outputs
+CALIBRATION_POINTS = (1.0, 7.5, 15.0, 22.5, 29.0)
+
+
+def fit_linear(x: Sequence[float], y: Sequence[float]) -> Tuple[float, float]:
+    """Least-squares (gain, offset) of y = gain * x + offset"""
+    if len(x) < 2:
+        raise ValueError("At least two calibration points are needed")
+    gain, offset = np.polyfit(np.asarray(x, dtype=float), np.asarray(y, dtype=float), 1)
+    return float(gain), float(offset)
+
+
+class Calibration:
+    def __init__(self, num_channels: int = protocol.NUM_CHANNELS,
+                 max_voltage: float = protocol.MAX_VOLTAGE):
+        self.num_channels = num_channels
+        self.max_voltage = max_voltage
+        self.output_gain = np.ones(num_channels)
+        self.output_offset = np.zeros(num_channels)
+        self.readback_gain = np.ones(num_channels)
+        self.readback_offset = np.zeros(num_channels)
+
+        # Piecewise corrections: channel -> (x, y) arrays sorted by x
+        self.output_points: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        self.readback_points: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+        self._tables: Optional[np.ndarray] = None
+        self._offsets = np.arange(num_channels, dtype=np.int64) * (protocol.DAC_FULL_SCALE + 1)
+
+    def invalidate(self):
+        """Drop the cached decode tables after changing coefficients directly"""
+        self._tables = None
+
+    # Encoding
+
+    def corrected_voltage(self, channel: int, voltage: float) -> float:
+        """Voltage to command so that the channel outputs voltage"""
+        if channel in self.output_points:
+            requested, measured = self.output_points[channel]
+            return float(np.interp(voltage, measured, requested))
+        return (voltage - self.output_offset[channel]) / self.output_gain[channel]
+
+    def corrected_voltages(self, channel: int, voltages: np.ndarray) -> np.ndarray:
+        """corrected_voltage for an array of voltages"""
+        if channel in self.output_points:
+            requested, measured = self.output_points[channel]
+            return np.interp(voltages, measured, requested)
+        return (voltages - self.output_offset[channel]) / self.output_gain[channel]
+
+    def dac_code(self, channel: int, voltage: float) -> int:
+        """Corrected 16-bit DAC code for a channel, clipped to the DAC range"""
+        code = protocol.volts_to_dac(self.corrected_voltage(channel, voltage))
+        return min(max(code, 0), protocol.DAC_FULL_SCALE)
+
+    # Decoding
+
+    def tables(self) -> np.ndarray:
+        """(num_channels, 65536) float32 code-to-volt tables, built on first use"""
+        if self._tables is None:
+            readings = np.arange(protocol.DAC_FULL_SCALE + 1) * (self.max_voltage / protocol.DAC_FULL_SCALE)
+            tables = np.empty((self.num_channels, len(readings)), dtype=np.float32)
+            for channel in range(self.num_channels):
+                if channel in self.readback_points:
+                    x, y = self.readback_points[channel]
+                    tables[channel] = np.interp(readings, x, y)
+                else:
+                    tables[channel] = readings * self.readback_gain[channel] + self.readback_offset[channel]
+            self._tables = tables
+        return self._tables
+
+    def decode(self, raw: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Convert (N, num_channels) raw codes to corrected volts"""
+        flat = self.tables().reshape(-1)
+        return np.take(flat, raw + self._offsets, out=out)
+
+    # Fitting
+
+    def fit_output(self, channel: int, requested: Sequence[float], measured: Sequence[float],
+                   piecewise: bool = False):
+        """Fit the output correction of a channel from requested/measured pairs"""
+        if piecewise:
+            order = np.argsort(measured)
+            self.output_points[channel] = (np.asarray(requested, dtype=float)[order],
+                                           np.asarray(measured, dtype=float)[order])
+        else:
+            self.output_points.pop(channel, None)
+            self.output_gain[channel], self.output_offset[channel] = fit_linear(requested, measured)
+
+    def fit_readback(self, channel: int, readings: Sequence[float], reference: Sequence[float],
+                     piecewise: bool = False):
+        """Fit the readback correction of a channel against a reference meter"""
+        if piecewise:
+            order = np.argsort(readings)
+            self.readback_points[channel] = (np.asarray(readings, dtype=float)[order],
+                                             np.asarray(reference, dtype=float)[order])
+        else:
+            self.readback_points.pop(channel, None)
+            self.readback_gain[channel], self.readback_offset[channel] = fit_linear(readings, reference)
+        self.invalidate()
+
+    # Files
+
+    def to_dict(self) -> dict:
+        """JSON-serialisable form"""
+        def points(table):
+            return {str(channel): [x.tolist(), y.tolist()] for channel, (x, y) in table.items()}
+
+        return {
+            "version": VERSION,
+            "num_channels": self.num_channels,
+            "max_voltage": self.max_voltage,
+            "output_gain": self.output_gain.tolist(),
+            "output_offset": self.output_offset.tolist(),
+            "readback_gain": self.readback_gain.tolist(),
+            "readback_offset": self.readback_offset.tolist(),
+            "output_points": points(self.output_points),
+            "readback_points": points(self.readback_points),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Calibration":
+        if data.get("version") != VERSION:
+            raise ValueError(f"Unsupported calibration version {data.get('version')}")
+        calibration = cls(data["num_channels"], data["max_voltage"])
+        for name in ("output_gain", "output_offset", "readback_gain", "readback_offset"):
+            values = np.asarray(data[name], dtype=float)
+            if values.shape != (calibration.num_channels,):
+                raise ValueError(f"Calibration {name} must have {calibration.num_channels} values")
+            setattr(calibration, name, values)
+        for name in ("output_points", "readback_points"):
+            table = getattr(calibration, name)
+            for channel, (x, y) in data.get(name, {}).items():
+                table[int(channel)] = (np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        return calibration
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "Calibration":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def calibrate_outputs(transport, voltages: Sequence[float] = CALIBRATION_POINTS,
+                      samples: int = 200, settle: float = 0.1, timeout: float = 5.0,
+                      calibration: Optional[Calibration] = None,
+                      piecewise: bool = False) -> Calibration:
+    """Fit the output correction of every channel against the monitor readback
+
+    Holds all channels at each voltage in turn, streams telemetry and
+    averages samples readings per channel after settle seconds. The readback
+    is decoded with calibration's readback correction, so calibrate the
+    readback against a reference meter first if it isn't trusted.
+    """
+    import threading
+    from .convert import FrameConverter
+    from .uploader import PipelinedUploader
+
+    calibration = calibration or Calibration()
+    converter = FrameConverter(calibration.num_channels, calibration.max_voltage,
+                               calibration=calibration)
+    uploader = PipelinedUploader(transport)
+    lock = threading.Lock()
+    collected: List[np.ndarray] = []
+    collecting = threading.Event()
+    enough = threading.Event()
+
+    def on_frames(frames, time_ns):
+        if not collecting.is_set():
+            return
+        block = converter.convert(frames).copy()
+        with lock:
+            collected.append(block)
+            if sum(len(b) for b in collected) >= samples:
+                enough.set()
+
+    measured = np.empty((len(voltages), calibration.num_channels))
+    if not transport.add_frame_listener(on_frames):
+        raise ValueError("Calibration needs a transport that decodes frames in this process")
+    try:
+        for index, voltage in enumerate(voltages):
+            packets = [
+                (protocol.channel_config_packet(channel, voltage, voltage, 1, True), f"Channel {channel + 1}")
+                for channel in range(calibration.num_channels)
+            ]
+            failed = uploader.upload(packets).result(timeout)
+            if failed:
+                raise TimeoutError(f"Channels {[i + 1 for i in failed]} did not confirm {voltage} V")
+            transport.send_command(protocol.start_packet(), "Start monitoring").result(timeout)
+            time.sleep(settle)
+
+            with lock:
+                collected.clear()
+                enough.clear()
+            collecting.set()
+            if not enough.wait(timeout):
+                raise TimeoutError(f"No telemetry received at {voltage} V")
+            collecting.clear()
+            transport.send_command(protocol.stop_packet(), "Stop monitoring").result(timeout)
+
+            with lock:
+                measured[index] = np.concatenate(collected)[:samples].mean(axis=0)
+    finally:
+        collecting.clear()
+        transport.remove_frame_listener(on_frames)
+
+    for channel in range(calibration.num_channels):
+        calibration.fit_output(channel, voltages, measured[:, channel], piecewise)
+    return calibration
@@ -0,0 +1,785 @@
+"""
+Command-line interface for the PCC voltage driver
+
+    python -m pcc ports
+    python -m pcc set --port PORT --channel 1 --channel 2 12.5
+    python -m pcc set --port PORT1 --port PORT2 --channel 30 5.0
+    python -m pcc sweep --port PORT --all --start 0 --end 10 --steps 100
+    python -m pcc stream --port PORT --count 1000
+    python -m pcc calibrate --port PORT --output board1.json
+    python -m pcc sequence --port PORT program.json
+    python -m pcc regulate --port PORT --channel 1 5.0 --duration 10
+    python -m pcc waveform --port PORT waveforms.json --frequency 1000
+    python -m pcc acquire --port PORT --duration 60
+    python -m pcc watch --ring pcc-ring-1234 --stats
+    python -m pcc serve --port PORT --listen 127.0.0.1:8765
+    python -m pcc request --server 127.0.0.1:8765 start
+    python -m pcc subscribe --server 127.0.0.1:8765 --count 1000
+    python -m pcc simulate --rate 5000
+
+Repeating --port drives several boards as one channel space: channel 25 is
+channel 1 of the second board, and so on.
+
+Heavy modules are only imported by the subcommands that need them, so the
+CLI starts without loading numpy or Qt.
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import time
+from typing import List, Optional
+
+from . import protocol
+from .trace import configure_logging
+
+# Seconds to wait for a batch of command echoes
+CONFIRM_TIMEOUT = 5.0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Create the argument parser for all subcommands"""
+    parser = argparse.ArgumentParser(prog="pcc", description="PCC voltage driver control")
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="Log connection events (-v) and packet hex dumps (-vv)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("ports", help="List available serial ports")
+
+    def add_port(subparser):
+        subparser.add_argument("--port", required=True, action="append", dest="ports",
+                               help="Serial port of a board, may be repeated")
+        subparser.add_argument("--baudrate", type=int, default=115200)
+        subparser.add_argument("--trace", metavar="FILE",
+                               help="Capture raw serial traffic to a binary trace file")
+        subparser.add_argument("--calibration", metavar="FILE", action="append", default=[],
+                               help="Calibration file, one per --port in the same order")
+
+    def add_channels(subparser):
+        group = subparser.add_mutually_exclusive_group(required=True)
+        group.add_argument("--channel", type=int, action="append", dest="channels",
+                           help=f"Channel number (1-{protocol.NUM_CHANNELS} per board), may be repeated")
+        group.add_argument("--all", action="store_true", help="Apply to every channel")
+
+    set_parser = subparsers.add_parser("set", help="Hold channels at a constant voltage")
+    add_port(set_parser)
+    add_channels(set_parser)
+    set_parser.add_argument("voltage", type=float)
+
+    sweep_parser = subparsers.add_parser("sweep", help="Configure a ramp and start it")
+    add_port(sweep_parser)
+    add_channels(sweep_parser)
+    sweep_parser.add_argument("--start", type=float, required=True, help="Start voltage (V)")
+    sweep_parser.add_argument("--end", type=float, required=True, help="End voltage (V)")
+    sweep_parser.add_argument("--steps", type=int, default=100)
+    sweep_parser.add_argument("--hold", action="store_true", help="Hold the end value")
+    sweep_parser.add_argument("--frequency", type=int, help="DAC update frequency (Hz)")
+    sweep_parser.add_argument("--no-start", action="store_true",
+                              help="Only configure, don't start data collection")
+
+    stream_parser = subparsers.add_parser("stream", help="Print telemetry as CSV")
+    add_port(stream_parser)
+    stream_parser.add_argument("--count", type=int, help="Stop after this many frames")
+    stream_parser.add_argument("--duration", type=float, help="Stop after this many seconds")
+    stream_parser.add_argument("--no-start", action="store_true",
+                               help="Don't send start/stop packets")
+    stream_parser.add_argument("--extended-frames", action="store_true",
+                               help="Request frames with sequence numbers and CRCs (simulator only)")
+    stream_parser.add_argument("--record", metavar="FILE",
+                               help="Also record the raw frames to a binary file")
+    stream_parser.add_argument("--alarms", metavar="FILE",
+                               help="Report threshold alarms from a JSON file of limits")
+    stream_parser.add_argument("--stats", action="store_true",
+                               help="Print per-channel statistics when the stream ends")
+    stream_parser.add_argument("--ripple", action="store_true",
+                               help="Print the dominant ripple of every channel when the stream ends")
+
+    cal_parser = subparsers.add_parser("calibrate",
+                                       help="Fit output corrections against the readback")
+    add_port(cal_parser)
+    cal_parser.add_argument("--output", required=True, metavar="FILE", help="Calibration file to write")
+    cal_parser.add_argument("--points", type=float, nargs="+", help="Voltages to hold (V)")
+    cal_parser.add_argument("--samples", type=int, default=200, help="Readings averaged per point")
+    cal_parser.add_argument("--piecewise", action="store_true",
+                            help="Store piecewise tables instead of gain and offset")
+
+    seq_parser = subparsers.add_parser("sequence", help="Play a host-timed voltage program")
+    add_port(seq_parser)
+    seq_parser.add_argument("program", help="JSON program file")
+    seq_parser.add_argument("--repeat", type=int, help="Override the program's repeat count")
+
+    reg_parser = subparsers.add_parser("regulate",
+                                       help="Hold channels at a voltage, trimmed by the readback")
+    add_port(reg_parser)
+    add_channels(reg_parser)
+    reg_parser.add_argument("voltage", type=float)
+    reg_parser.add_argument("--duration", type=float, help="Stop after this many seconds")
+    reg_parser.add_argument("--kp", type=float, default=0.2, help="Proportional gain")
+    reg_parser.add_argument("--ki", type=float, default=5.0, help="Integral gain (1/s)")
+    reg_parser.add_argument("--interval", type=float, default=0.02,
+                            help="Seconds between corrections")
+    reg_parser.add_argument("--max-trim", type=float, default=0.5,
+                            help="Largest correction either way (V)")
+    reg_parser.add_argument("--keep-trim", action="store_true",
+                            help="Leave the corrected codes in place on exit")
+
+    wave_parser = subparsers.add_parser("waveform", help="Upload and play waveform tables")
+    add_port(wave_parser)
+    wave_parser.add_argument("waveforms", help="JSON file of per-channel profiles")
+    wave_parser.add_argument("--frequency", type=int, help="DAC update frequency (Hz)")
+    wave_parser.add_argument("--cache", metavar="DIR", help="Keep compiled tables in this directory")
+    wave_parser.add_argument("--no-start", action="store_true",
+                             help="Only upload, don't start data collection")
+
+    acq_parser = subparsers.add_parser("acquire",
+                                       help="Publish telemetry to shared memory from a child process")
+    acq_parser.add_argument("--port", required=True, help="Serial port of the board")
+    acq_parser.add_argument("--baudrate", type=int, default=115200)
+    acq_parser.add_argument("--duration", type=float, help="Stop after this many seconds")
+    acq_parser.add_argument("--extended-frames", action="store_true",
+                            help="Request frames with sequence numbers and CRCs (simulator only)")
+    acq_parser.add_argument("--no-start", action="store_true",
+                            help="Don't send start/stop packets")
+
+    watch_parser = subparsers.add_parser("watch", help="Read telemetry from a shared-memory ring")
+    watch_parser.add_argument("--ring", required=True, metavar="NAME",
+                              help="Ring name printed by the acquire command")
+    watch_parser.add_argument("--count", type=int, help="Stop after this many rows")
+    watch_parser.add_argument("--duration", type=float, help="Stop after this many seconds")
+    watch_parser.add_argument("--stats", action="store_true",
+                              help="Print the row rate once a second instead of CSV")
+
+    serve_parser = subparsers.add_parser("serve", help="Share a board with local clients")
+    serve_parser.add_argument("--port", required=True, help="Serial port of the board")
+    serve_parser.add_argument("--baudrate", type=int, default=115200)
+    serve_parser.add_argument("--listen", action="append", metavar="ADDRESS",
+                              help="HOST:PORT or unix:PATH, may be repeated (default 127.0.0.1:8765)")
+    serve_parser.add_argument("--calibration", metavar="FILE",
+                              help="Calibration applied to channel configurations")
+    serve_parser.add_argument("--duration", type=float, help="Exit after this many seconds")
+
+    def add_server(subparser):
+        subparser.add_argument("--server", default="127.0.0.1:8765", metavar="ADDRESS",
+                               help="HOST:PORT or unix:PATH of a pcc serve process")
+
+    sub_parser = subparsers.add_parser("subscribe", help="Print telemetry from a server as CSV")
+    add_server(sub_parser)
+    sub_parser.add_argument("--count", type=int, help="Stop after this many rows")
+    sub_parser.add_argument("--duration", type=float, help="Stop after this many seconds")
+    sub_parser.add_argument("--stats", action="store_true",
+                            help="Print the row rate once a second instead of CSV")
+    sub_parser.add_argument("--queue", type=int, help="Batches the server may queue for this client")
+    sub_parser.add_argument("--policy", default="drop_oldest",
+                            choices=["drop_oldest", "drop_newest", "disconnect"],
+                            help="What the server does when the queue is full")
+
+    req_parser = subparsers.add_parser("request", help="Send one request to a server")
+    add_server(req_parser)
+    req_parser.add_argument("op", help="info, stats, config, frequency, frame_format, start or stop")
+    req_parser.add_argument("params", nargs="*", metavar="KEY=VALUE",
+                            help="Request fields; values are parsed as JSON when possible")
+
+    sim_parser = subparsers.add_parser("simulate", help="Run a virtual board on a pty")
+    sim_parser.add_argument("--rate", type=float, default=1000, help="Telemetry frames per second")
+    sim_parser.add_argument("--noise", type=float, default=0.0, help="Readback noise (V rms)")
+    sim_parser.add_argument("--drop-rate", type=float, default=0.0,
+                            help="Probability that a frame loses a byte")
+    sim_parser.add_argument("--ack-delay", type=float, default=0.0, help="Echo delay (s)")
+    sim_parser.add_argument("--ack-loss", type=float, default=0.0,
+                            help="Probability that an echo is lost")
+    sim_parser.add_argument("--flip-rate", type=float, default=0.0,
+                            help="Probability that a frame has a reading byte inverted")
+    sim_parser.add_argument("--gain-error", type=float, default=0.0,
+                            help="Output gain error of every channel, e.g. -0.02 for 2%% low")
+    sim_parser.add_argument("--offset-error", type=float, default=0.0,
+                            help="Output offset error of every channel (V)")
+    sim_parser.add_argument("--seed", type=int)
+    sim_parser.add_argument("--duration", type=float, help="Exit after this many seconds")
+
+    return parser
+
+
+def selected_channels(args) -> List[int]:
+    """Zero-based global channel indices selected on the command line"""
+    if args.all:
+        return list(range(protocol.NUM_CHANNELS * len(args.ports)))
+    return [channel - 1 for channel in args.channels]
+
+
+def trace_path(path: str, board: int, boards: int) -> str:
+    """Trace file of one board: the given path, numbered if there are several boards"""
+    if boards == 1:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}-{board + 1}{ext}"
+
+
+def open_devices(args):
+    """Connect to every board given by --port"""
+    from .devices import DeviceManager
+
+    if len(args.calibration) > len(args.ports):
+        raise ValueError("More calibration files than ports")
+    calibrations = []
+    if args.calibration:
+        from .calibration import Calibration
+
+        calibrations = [Calibration.load(path) for path in args.calibration]
+
+    devices = DeviceManager()
+    if not devices.connect(args.ports, args.baudrate):
+        raise SystemExit(f"Could not open {', '.join(args.ports)}")
+    for board, calibration in enumerate(calibrations):
+        devices.set_calibration(board, calibration)
+    if args.trace:
+        for board, transport in enumerate(devices.boards):
+            transport.start_trace(trace_path(args.trace, board, len(devices.boards)))
+    return devices
+
+
+def upload(devices, items) -> bool:
+    """Pipeline (board, packet, description) items and report unconfirmed ones"""
+    failed = devices.upload(items).result(CONFIRM_TIMEOUT)
+    for index in failed:
+        print(f"No confirmation received for {items[index][2]}", file=sys.stderr)
+    print(f"{len(items) - len(failed)}/{len(items)} packets confirmed "
+          f"in {devices.elapsed * 1000:.1f} ms", file=sys.stderr)
+    return not failed
+
+
+def confirm_all(future, description: str) -> bool:
+    """Wait for a broadcast and report boards that didn't confirm"""
+    failed = future.result(CONFIRM_TIMEOUT)
+    for board in failed:
+        print(f"No confirmation received for {description} (board {board + 1})", file=sys.stderr)
+    return not failed
+
+
+def cmd_ports(args, out) -> int:
+    from .transport import SerialTransport
+
+    for port in SerialTransport().get_available_ports():
+        print(port, file=out)
+    return 0
+
+
+def cmd_set(args, out) -> int:
+    devices = open_devices(args)
+    try:
+        items = [
+            (*devices.channel_config_packet(channel, args.voltage, args.voltage, 1, True),
+             f"Channel {channel + 1}")
+            for channel in selected_channels(args)
+        ]
+        return 0 if upload(devices, items) else 1
+    finally:
+        devices.disconnect()
+
+
+def cmd_sweep(args, out) -> int:
+    devices = open_devices(args)
+    try:
+        items = [
+            (*devices.channel_config_packet(channel, args.start, args.end, args.steps, args.hold),
+             f"Channel {channel + 1}")
+            for channel in selected_channels(args)
+        ]
+        if args.frequency is not None:
+            packet = protocol.frequency_packet(args.frequency)
+            items.extend((board, packet, f"Frequency ({args.frequency} Hz, board {board + 1})")
+                         for board in range(len(devices.boards)))
+
+        if not upload(devices, items):
+            return 1
+        if not args.no_start:
+            return 0 if confirm_all(devices.start(), "Start monitoring") else 1
+        return 0
+    finally:
+        devices.disconnect()
+
+
+def cmd_stream(args, out) -> int:
+    import queue
+
+    if args.record and len(args.ports) > 1:
+        raise ValueError("--record supports a single board")
+
+    stats = alarms = None
+    if args.alarms or args.stats:
+        from .stats import ChannelStats, format_event, load_alarms
+
+        num_channels = protocol.NUM_CHANNELS * len(args.ports)
+        window = None
+        if args.alarms:
+            config = load_alarms(args.alarms, num_channels)
+            alarms, window = config["engine"], config["window"]
+        stats = ChannelStats(num_channels, window or ChannelStats.WINDOW)
+
+    ripple = None
+    if args.ripple:
+        from .spectrum import RippleAnalyzer
+
+        ripple = RippleAnalyzer(protocol.NUM_CHANNELS * len(args.ports))
+
+    blocks_queue: "queue.Queue" = queue.Queue()
+    devices = open_devices(args)
+    devices.on_merged = lambda block, time_ns: blocks_queue.put((block, time_ns))
+    # Always select the format: a board keeps it across connections
+    frame_format = protocol.FRAME_EXTENDED if args.extended_frames else protocol.FRAME_LEGACY
+    futures = [board.set_frame_format(frame_format) for board in devices.boards]
+    for board, future in enumerate(futures):
+        if future.exception(CONFIRM_TIMEOUT) is not None:
+            print(f"Board {board + 1} did not confirm the frame format", file=sys.stderr)
+            devices.disconnect()
+            return 1
+
+    recorder = None
+    if args.record:
+        from .recording import TelemetryRecorder
+
+        recorder = TelemetryRecorder(args.record, settings={"port": args.ports[0],
+                                                            "frame_format": frame_format})
+        recorder.start()
+        devices.boards[0].add_frame_listener(recorder.write_frames)
+
+    if not args.no_start:
+        devices.start()
+
+    count = 0
+    start_time = time.monotonic()
+    deadline = start_time + args.duration if args.duration else None
+    print("time," + ",".join(f"ch{i + 1}" for i in range(devices.num_channels)), file=out)
+    try:
+        while args.count is None or count < args.count:
+            timeout = 0.1 if deadline is None else max(0.0, deadline - time.monotonic())
+            if deadline is not None and timeout == 0.0:
+                break
+            try:
+                block, time_ns = blocks_queue.get(timeout=min(timeout, 0.1))
+            except queue.Empty:
+                continue
+            if stats is not None:
+                stats.update(block)
+                if alarms is not None:
+                    for event in alarms.evaluate(block, (time_ns / 1e9) - start_time, stats):
+                        print(f"{event.time:.6f} {format_event(event)}", file=sys.stderr)
+            if ripple is not None:
+                ripple.update(block, time_ns / 1e9)
+            now = time.monotonic() - start_time
+            for voltages in block:
+                print(f"{now:.6f}," + ",".join(f"{v:.4f}" for v in voltages), file=out)
+                count += 1
+                if args.count is not None and count >= args.count:
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if not args.no_start:
+            devices.stop()
+        for board, transport in enumerate(devices.boards):
+            counters = ", ".join(f"{name} {value}" for name, value in transport.decoder.counters().items())
+            print(f"Board {board + 1}: {counters}", file=sys.stderr)
+        devices.disconnect()
+        if recorder:
+            recorder.close()
+            print(f"Recorded {recorder.records_written} frames to {args.record}", file=sys.stderr)
+        if args.stats and stats.count:
+            print("channel,mean,std,min,max,rms,ripple", file=sys.stderr)
+            for channel in range(stats.num_channels):
+                values = (stats.mean, stats.std, stats.minimum, stats.maximum, stats.rms, stats.ripple)
+                print(f"{channel + 1}," + ",".join(f"{v[channel]:.5f}" for v in values), file=sys.stderr)
+        if ripple is not None and ripple.segments:
+            report = ripple.report()
+            print(f"Ripple from {report.segments} segments at {report.sample_rate:.0f} rows/s",
+                  file=sys.stderr)
+            print("channel,frequency_hz,amplitude_v", file=sys.stderr)
+            for channel in range(ripple.num_channels):
+                print(f"{channel + 1},{report.frequency[channel]:.2f},{report.amplitude[channel]:.6f}",
+                      file=sys.stderr)
+    return 0
+
+
+def cmd_calibrate(args, out) -> int:
+    from .calibration import CALIBRATION_POINTS, calibrate_outputs
+
+    if len(args.ports) > 1:
+        raise ValueError("Calibrate one board at a time")
+    devices = open_devices(args)
+    try:
+        calibration = calibrate_outputs(
+            devices.boards[0], args.points or CALIBRATION_POINTS, args.samples,
+            calibration=devices.calibrations[0], piecewise=args.piecewise
+        )
+    finally:
+        devices.disconnect()
+
+    calibration.save(args.output)
+    print("channel,gain,offset", file=out)
+    for channel in range(calibration.num_channels):
+        print(f"{channel + 1},{calibration.output_gain[channel]:.6f},"
+              f"{calibration.output_offset[channel]:.6f}", file=out)
+    return 0
+
+
+def cmd_sequence(args, out) -> int:
+    import json
+    from .sequence import SequenceRunner, load_program
+
+    if len(args.ports) > 1:
+        raise ValueError("Sequences drive a single board")
+    steps, repeat = load_program(args.program)
+    devices = open_devices(args)
+    runner = SequenceRunner(devices.boards[0], steps, args.repeat or repeat,
+                            calibration=devices.calibrations[0])
+    try:
+        runner.start()
+        while not runner.wait(0.1):
+            pass
+    except KeyboardInterrupt:
+        runner.stop()
+    finally:
+        devices.disconnect()
+
+    report = runner.report()
+    print(json.dumps(report, indent=2), file=out)
+    return 1 if report["failed_steps"] else 0
+
+
+def cmd_regulate(args, out) -> int:
+    import json
+    from .regulator import ClosedLoopRegulator
+
+    if len(args.ports) > 1:
+        raise ValueError("Regulate one board at a time")
+    channels = selected_channels(args)
+    devices = open_devices(args)
+    board = devices.boards[0]
+    regulator = ClosedLoopRegulator(board, calibration=devices.calibrations[0], kp=args.kp,
+                                    ki=args.ki, interval=args.interval, max_trim=args.max_trim)
+    try:
+        regulator.set_targets({channel: args.voltage for channel in channels})
+        items = [
+            (*devices.channel_config_packet(channel, args.voltage, args.voltage, 1, True),
+             f"Channel {channel + 1}")
+            for channel in channels
+        ]
+        if not upload(devices, items) or not confirm_all(devices.start(), "Start monitoring"):
+            return 1
+        if not regulator.start():
+            return 1
+        deadline = time.monotonic() + args.duration if args.duration else None
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                time.sleep(0.1 if deadline is None else min(0.1, max(0.0, deadline - time.monotonic())))
+        except KeyboardInterrupt:
+            pass
+        for future in regulator.stop(restore=not args.keep_trim):
+            if future.exception(CONFIRM_TIMEOUT) is not None:
+                print("Open loop setpoint not confirmed", file=sys.stderr)
+        devices.stop()
+    finally:
+        regulator.stop(restore=False)
+        devices.disconnect()
+
+    print(json.dumps(regulator.report(), indent=2), file=out)
+    print("channel,target,error_mv,trim_codes", file=sys.stderr)
+    for channel in channels:
+        print(f"{channel + 1},{args.voltage:.4f},{regulator.error[channel] * 1000:.3f},"
+              f"{regulator.integral[channel]:.1f}", file=sys.stderr)
+    return 0
+
+
+def cmd_waveform(args, out) -> int:
+    from .devices import when_all
+    from .waveform import TableUploader, WaveformCompiler, load_waveforms
+
+    waveforms = load_waveforms(args.waveforms)
+    devices = open_devices(args)
+    try:
+        compilers = [WaveformCompiler(calibration, cache_dir=args.cache)
+                     for calibration in devices.calibrations]
+        per_board = [[] for _ in devices.boards]
+        for channel, (profile, hold_end) in sorted(waveforms.items()):
+            board, local = devices.locate(channel)
+            table = compilers[board].compile(local, profile, hold_end)
+            print(f"Channel {channel + 1}: {len(table)} codes, "
+                  f"quantisation error {table.quantisation_error:.2e} V", file=sys.stderr)
+            per_board[board].append(table)
+
+        if args.frequency is not None:
+            packet = protocol.frequency_packet(args.frequency)
+            items = [(board, packet, f"Frequency ({args.frequency} Hz, board {board + 1})")
+                     for board in range(len(devices.boards))]
+            if not upload(devices, items):
+                return 1
+
+        uploaders = [TableUploader(board) for board in devices.boards]
+        futures = [uploader.upload(tables) for uploader, tables in zip(uploaders, per_board)]
+        when_all(futures).result(CONFIRM_TIMEOUT * 4)
+        failed = [board * devices.channels_per_board + channel
+                  for board, future in enumerate(futures) for channel in future.result()]
+        for channel in failed:
+            print(f"Waveform table of channel {channel + 1} was not committed", file=sys.stderr)
+        sent = sum(uploader.bytes_sent for uploader in uploaders)
+        print(f"{len(waveforms) - len(failed)}/{len(waveforms)} tables committed, "
+              f"{sent} bytes in {max(u.elapsed for u in uploaders) * 1000:.1f} ms", file=sys.stderr)
+        if failed:
+            return 1
+        if not args.no_start:
+            return 0 if confirm_all(devices.start(), "Start monitoring") else 1
+        return 0
+    finally:
+        devices.disconnect()
+
+
+def cmd_acquire(args, out) -> int:
+    from .shared import ProcessTransport
+
+    transport = ProcessTransport()
+    if not transport.connect(args.port, args.baudrate):
+        raise SystemExit(f"Could not open {args.port}")
+    try:
+        frame_format = protocol.FRAME_EXTENDED if args.extended_frames else protocol.FRAME_LEGACY
+        if transport.set_frame_format(frame_format).exception(CONFIRM_TIMEOUT) is not None:
+            print("The board did not confirm the frame format", file=sys.stderr)
+            return 1
+        if not args.no_start:
+            transport.send_packet(protocol.start_packet(), "Start monitoring")
+        # Viewers attach with: python -m pcc watch --ring NAME
+        print(transport.ring.name, file=out)
+        out.flush()
+
+        deadline = time.monotonic() + args.duration if args.duration else None
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                time.sleep(0.1)
+                if not transport.ring.writer_alive():
+                    print("Acquisition process stopped", file=sys.stderr)
+                    return 1
+        except KeyboardInterrupt:
+            pass
+        if not args.no_start:
+            transport.send_packet(protocol.stop_packet(), "Stop monitoring")
+        return 0
+    finally:
+        counters = ", ".join(f"{name} {value}" for name, value in transport.decoder.counters().items())
+        transport.disconnect()
+        print(counters, file=sys.stderr)
+
+
+def cmd_watch(args, out) -> int:
+    from .convert import FrameConverter
+    from .shared import RingReader, SharedRing
+
+    try:
+        ring = SharedRing.attach(args.ring)
+    except FileNotFoundError:
+        raise SystemExit(f"No ring named {args.ring}")
+    except ValueError as e:
+        # Not a ring, or one that can't be read safely without its writer's lock
+        raise SystemExit(str(e))
+    reader = RingReader(ring)
+    converter = FrameConverter(num_channels=ring.raw.shape[1])
+
+    count = 0
+    start_time = time.monotonic()
+    deadline = start_time + args.duration if args.duration else None
+    last_report, last_rows = start_time, 0
+    times = raw = None
+    if not args.stats:
+        print("time," + ",".join(f"ch{i + 1}" for i in range(converter.num_channels)), file=out)
+    try:
+        while args.count is None or count < args.count:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            times, raw = reader.read(None if args.count is None else args.count - count)
+            if len(raw) == 0:
+                if not ring.writer_alive():
+                    print("Acquisition process stopped", file=sys.stderr)
+                    break
+                time.sleep(0.01)
+                continue
+            count += len(raw)
+            if args.stats:
+                now = time.monotonic()
+                if now - last_report >= 1.0:
+                    rate = (reader.rows_read - last_rows) / (now - last_report)
+                    print(f"{rate:.0f} rows/s, {reader.behind} behind, {reader.rows_lost} lost",
+                          file=out)
+                    last_report, last_rows = now, reader.rows_read
+                continue
+            # Copy out of shared memory before the slow formatting below
+            block = converter.convert_raw(raw).copy()
+            seconds = times / 1e9
+            if not reader.intact():
+                continue
+            for timestamp, voltages in zip(seconds, block):
+                print(f"{timestamp:.6f}," + ",".join(f"{v:.4f}" for v in voltages), file=out)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"{reader.rows_read} rows read, {reader.rows_lost} lost", file=sys.stderr)
+        # Views into the ring must be released before it is unmapped
+        times = raw = None
+        ring.close()
+    return 0
+
+
+def cmd_serve(args, out) -> int:
+    import asyncio
+    from .server import serve
+    from .transport import SerialTransport
+
+    calibration = None
+    if args.calibration:
+        from .calibration import Calibration
+
+        calibration = Calibration.load(args.calibration)
+
+    transport = SerialTransport()
+    if not transport.connect(args.port, args.baudrate):
+        raise SystemExit(f"Could not open {args.port}")
+
+    def on_ready(addresses):
+        for address in addresses:
+            print(address, file=out, flush=True)
+
+    try:
+        asyncio.run(serve(transport, args.listen or ["127.0.0.1:8765"], calibration,
+                          args.duration, on_ready))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        transport.disconnect()
+    return 0
+
+
+def cmd_subscribe(args, out) -> int:
+    import asyncio
+    from .server import TelemetryClient
+
+    async def run() -> int:
+        client = TelemetryClient()
+        try:
+            await client.connect(args.server)
+        except OSError as e:
+            raise SystemExit(f"Could not connect to {args.server}: {e}")
+        try:
+            info = await client.request("info")
+            scale = info["scale"]
+            await client.subscribe(args.queue, args.policy)
+            count = 0
+            expected = None
+            gaps = 0
+            start_time = time.monotonic()
+            deadline = start_time + args.duration if args.duration else None
+            last_report, last_count = start_time, 0
+            if not args.stats:
+                print("time," + ",".join(f"ch{i + 1}" for i in range(info["channels"])), file=out)
+            batches = client.batches()
+            while args.count is None or count < args.count:
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    break
+                try:
+                    batch = await asyncio.wait_for(batches.__anext__(), timeout)
+                except (asyncio.TimeoutError, StopAsyncIteration):
+                    break
+                if expected is not None and batch.sequence != expected:
+                    gaps += 1
+                expected = batch.sequence + len(batch.raw)
+                raw = batch.raw if args.count is None else batch.raw[:args.count - count]
+                count += len(raw)
+                if args.stats:
+                    now = time.monotonic()
+                    if now - last_report >= 1.0:
+                        rate = (count - last_count) / (now - last_report)
+                        print(f"{rate:.0f} rows/s, {batch.dropped} dropped by the server", file=out)
+                        last_report, last_count = now, count
+                    continue
+                seconds = batch.time_ns / 1e9
+                for voltages in raw * scale:
+                    print(f"{seconds:.6f}," + ",".join(f"{v:.4f}" for v in voltages), file=out)
+            print(f"{count} rows received, {gaps} gaps", file=sys.stderr)
+            return 0
+        finally:
+            await client.close()
+
+    try:
+        return asyncio.run(run())
+    except KeyboardInterrupt:
+        return 0
+
+
+def cmd_request(args, out) -> int:
+    import asyncio
+    import json
+    from .server import TelemetryClient
+
+    params = {}
+    for item in args.params:
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"Expected KEY=VALUE, got {item!r}")
+        try:
+            params[key] = json.loads(value)
+        except json.JSONDecodeError:
+            params[key] = value
+
+    async def run():
+        client = TelemetryClient()
+        try:
+            await client.connect(args.server)
+        except OSError as e:
+            raise SystemExit(f"Could not connect to {args.server}: {e}")
+        try:
+            return await client.request(args.op, **params)
+        finally:
+            await client.close()
+
+    try:
+        result = asyncio.run(run())
+    except (TimeoutError, RuntimeError) as e:
+        print(f"Request failed: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(result, indent=2), file=out)
+    return 0
+
+
+def cmd_simulate(args, out) -> int:
+    from .simulator import run_simulator
+
+    return run_simulator(args, out)
+
+
+COMMANDS = {
+    "ports": cmd_ports,
+    "set": cmd_set,
+    "sweep": cmd_sweep,
+    "stream": cmd_stream,
+    "calibrate": cmd_calibrate,
+    "sequence": cmd_sequence,
+    "regulate": cmd_regulate,
+    "waveform": cmd_waveform,
+    "acquire": cmd_acquire,
+    "watch": cmd_watch,
+    "serve": cmd_serve,
+    "subscribe": cmd_subscribe,
+    "request": cmd_request,
+    "simulate": cmd_simulate,
+}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    configure_logging([logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)])
+    out = sys.stdout
+    # Diagnostics go to stderr so stdout only carries results
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            return COMMANDS[args.command](args, out)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 2
@@ -0,0 +1,64 @@
+"""
+FrameConverter - Vectorized conversion of telemetry frames to voltages
+"""
+
+from typing import List, Optional
+import numpy as np
+
+from . import protocol
+
+
+class FrameConverter:
+    # Defaults match the firmware (config.h)
+    NUM_CHANNELS = protocol.NUM_CHANNELS
+    MAX_VOLTAGE = protocol.MAX_VOLTAGE
+    DAC_FULL_SCALE = protocol.DAC_FULL_SCALE
+
+    def __init__(self, num_channels: int = NUM_CHANNELS,
+                 max_voltage: float = MAX_VOLTAGE, capacity: int = 256,
+                 calibration=None):
+        self.num_channels = num_channels
+        self.scale = np.float32(max_voltage / self.DAC_FULL_SCALE)
+        # Optional pcc.calibration.Calibration; its tables replace the scale
+        self.calibration = calibration
+        self._block = np.empty((capacity, num_channels), dtype=np.float32)
+
+    def convert(self, frames: List[bytes]) -> np.ndarray:
+        """Convert a batch of frames into an (N, num_channels) voltage block
+
+        The frames must have the same size, as every batch from
+        FrameDecoder.feed does. The returned array is a view into a buffer that is reused by the next
+        call, so receivers that keep the data must copy it.
+        """
+        if not frames:
+            return self._block[:0]
+
+        # Strided view over the 48-byte payloads, skipping the 0xAA marker
+        # (and the sequence number of extended frames)
+        size = len(frames[0])
+        data = b''.join(frames)
+        raw = np.ndarray(
+            shape=(len(frames), self.num_channels),
+            dtype='<u2',
+            buffer=data,
+            offset=protocol.payload_offset(size),
+            strides=(size, 2)
+        )
+        return self.convert_raw(raw)
+
+    def convert_raw(self, raw: np.ndarray) -> np.ndarray:
+        """Convert (N, num_channels) raw DAC codes; same buffer rules as convert"""
+        count = len(raw)
+        if count > len(self._block):
+            # Grow to the next power of two so resizes stay rare
+            capacity = 1 << (count - 1).bit_length()
+            self._block = np.empty((capacity, self.num_channels), dtype=np.float32)
+
+        out = self._block[:count]
+        if count == 0:
+            return out
+        if self.calibration is not None:
+            self.calibration.decode(raw, out=out)
+        else:
+            np.multiply(raw, self.scale, out=out)
+        return out
@@ -0,0 +1,384 @@
+"""
+FrameDecoder - Incremental decoder for the 0xAA ... 0x55 telemetry frames
+and the command echoes interleaved with them
+
+Runs of back-to-back frames are cut out of the buffer in one batch. In the
+extended format (see pcc.protocol) every frame's CRC is checked before it
+is accepted, so a 0xAA/0x55 pair inside the readings can't be mistaken for
+a frame, and gaps in the sequence numbers count the frames that were lost.
+The format follows the stream. The echo of a frame format command only
+shows that the packet arrived (the firmware echoes everything and only the
+simulator implements the command), so it merely makes the requested format
+a candidate: the decoder switches to extended frames at the first one with
+a valid CRC, and back to legacy frames when LEGACY_CONFIRM intact legacy
+frames arrive in a row, e.g. from a board that never switched or was reset.
+"""
+
+import binascii
+import logging
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List
+
+from . import protocol
+
+log = logging.getLogger(__name__)
+
+
+class FrameDecoder:
+    # Legacy frame layout: start marker, 24 x 16-bit readings, end marker
+    START_BYTE = protocol.START_BYTE
+    END_BYTE = protocol.END_BYTE
+    FRAME_SIZE = protocol.FRAME_SIZE
+    LEGACY_CONFIRM = 3  # Back-to-back legacy frames that end extended decoding
+
+    def __init__(self, frame_format: int = protocol.FRAME_LEGACY):
+        self._buffer = bytearray()
+        self._garbage_run = 0  # Bytes discarded since the last good frame
+        self._next_sequence = None  # Expected sequence number of the next extended frame
+        self._streaming = False  # Frames arrived since the line was last quiet
+        self._after_frame = False  # The buffered bytes follow a frame directly
+        self.frames_pending = False  # feed stopped at a format change
+        self.set_format(frame_format)
+
+        # Command echoes being waited for, keyed by packet content
+        self._expected_echoes: Dict[bytes, Deque[Callable[[bytes], None]]] = {}
+        self._echo_lock = threading.Lock()
+
+        # Counters
+        self.frames_decoded = 0
+        self.frames_dropped = 0
+        self.bytes_dropped = 0
+        self.resyncs = 0
+        self.crc_failures = 0  # Extended frames with intact markers but a bad CRC
+        self.sequence_gaps = 0  # Breaks in the extended frame sequence numbers
+
+    def set_format(self, frame_format: int):
+        """Decode FRAME_LEGACY or FRAME_EXTENDED frames from now on"""
+        if frame_format not in protocol.FRAME_SIZES:
+            raise ValueError(f"Unknown frame format {frame_format}")
+        self.frame_format = frame_format
+        self.requested_format = frame_format
+        self._ignored_frames = 0  # Frames of the old format since a change was requested
+        self.frame_size = protocol.FRAME_SIZES[frame_format]
+        self._next_sequence = None
+
+    def feed(self, data: bytes, idle: bool = False) -> List[bytes]:
+        """Add a chunk of received bytes and return every complete frame
+
+        Bytes that can't belong to a frame are discarded and counted. A
+        partial frame at the end of the chunk is kept until the next call.
+        Echoes registered with expect_echo are taken out of the stream and
+        reported to their callbacks instead of being treated as garbage.
+
+        An extended frame whose markers and CRC check out is never taken
+        for an echo, even if it starts with the same bytes. Legacy frames
+        have no CRC, so an expected echo at least as long as a frame wins
+        over one, and a shorter echo only loses to a frame that is aligned
+        with the frame before or after it. While frames are
+        streaming, an echo at the end of the buffered data could still be
+        the start of a frame, so it is held back until more bytes arrive or
+        the line goes quiet and the caller feeds again with idle=True.
+
+        All frames returned by one call have the same size. When the format
+        changes within the buffered bytes, the call stops there and sets
+        frames_pending; feed(b'') returns the frames of the new format.
+        """
+        self.frames_pending = False
+        if idle:
+            self._streaming = False
+            self._after_frame = False
+        after_frame = self._after_frame
+        buffer = self._buffer
+        buffer += data
+
+        frames = []
+        echoes = []
+        size = self.frame_size
+        extended = self.frame_format == protocol.FRAME_EXTENDED
+        start = self.START_BYTE
+        end = self.END_BYTE
+        pos = 0
+        length = len(buffer)
+
+        with self._echo_lock:
+            while pos < length:
+                if buffer[pos] != start:
+                    # Skip ahead to the next start marker
+                    next_start = buffer.find(start, pos + 1)
+                    if next_start < 0:
+                        next_start = length
+                    self._drop(next_start - pos)
+                    pos = next_start
+                    after_frame = False
+                    continue
+
+                # Command echoes share the start marker; a frame that checks
+                # out wins over an echo matching its first bytes
+                complete = pos + size <= length
+                requested = self.requested_format != self.frame_format
+                if requested and complete:
+                    # Frames of a requested format are looked for first
+                    switched = self._detect_format(buffer, pos, length, idle)
+                    if switched is None:
+                        break  # Could be a frame of the requested format, wait for more data
+                    if switched:
+                        if frames:
+                            self.frames_pending = True
+                            break
+                        size = self.frame_size
+                        extended = self.frame_format == protocol.FRAME_EXTENDED
+                        continue
+                marked = complete and buffer[pos + size - 1] == end
+                if marked and self._expected_echoes and not extended:
+                    # Without a CRC the end marker may be a byte of an echo,
+                    # e.g. of table data
+                    echo = self._match_echo(buffer, pos, length)
+                    if echo is None and not idle:
+                        break  # Frame or the start of a long echo, wait for more data
+                    if echo and (len(echo) >= size or not (
+                            after_frame or self._aligned_run(buffer, pos, length) > 1)):
+                        marked = False
+                if marked:
+                    # An echo or a format change may follow any frame, so
+                    # only batch when neither is pending
+                    if self._expected_echoes or requested:
+                        count = 1
+                    else:
+                        count = self._aligned_run(buffer, pos, length)
+                    if count == 1:
+                        run = [bytes(buffer[pos:pos + size])]
+                    else:
+                        run = [bytes(buffer[p:p + size]) for p in range(pos, pos + count * size, size)]
+                    if extended:
+                        del run[self._valid_crcs(run):]
+                    if run:
+                        if self._garbage_run:
+                            self._end_resync()
+                        if extended:
+                            self._check_sequence(run)
+                        frames.extend(run)
+                        self._streaming = True
+                        after_frame = True
+                        pos += len(run) * size
+                        if requested:
+                            self._ignored_frames += len(run)
+                            if self._ignored_frames >= self.LEGACY_CONFIRM:
+                                log.warning("Board keeps sending %s frames, frame format %d not supported",
+                                            "extended" if extended else "legacy", self.requested_format)
+                                self.requested_format = self.frame_format
+                        continue
+
+                if self._expected_echoes:
+                    echo = self._match_echo(buffer, pos, length)
+                    if echo is None:
+                        break  # Could still be an echo, wait for more data
+                    if echo and not complete and self._streaming:
+                        break  # Echo or the start of a frame, the next bytes tell
+                    if echo:
+                        echoes.append((echo, self._take_echo(echo)))
+                        pos += len(echo)
+                        after_frame = False
+                        if echo[2] == protocol.CMD_FRAME_FORMAT and len(echo) == 5 and echo[3] in protocol.FRAME_SIZES:
+                            # A board that implements the command switches after the echo
+                            self.requested_format = echo[3]
+                            self._ignored_frames = 0
+                        continue
+
+                if not complete:
+                    break  # Partial frame, wait for more data
+                if extended and not requested:
+                    # Legacy frames from a board that was reset
+                    switched = self._detect_format(buffer, pos, length, idle)
+                    if switched is None:
+                        break  # Could be legacy frames, wait for more data
+                    if switched:
+                        if frames:
+                            self.frames_pending = True
+                            break
+                        size = self.frame_size
+                        extended = False
+                        continue
+                if marked:
+                    self.crc_failures += 1
+
+                # False start marker: resynchronise on the next one
+                next_start = buffer.find(start, pos + 1)
+                if next_start < 0:
+                    next_start = length
+                self._drop(next_start - pos)
+                pos = next_start
+                after_frame = False
+
+        del buffer[:pos]
+        self._after_frame = after_frame
+
+        for echo, callback in echoes:
+            try:
+                callback(echo)
+            except Exception:
+                log.exception("Error in echo callback")
+
+        self.frames_decoded += len(frames)
+        return frames
+
+    def _detect_format(self, buffer: bytearray, pos: int, length: int, idle: bool):
+        """Switch formats if a frame of the other one starts at pos
+
+        Returns True after switching, False if there is no such frame and
+        None if more bytes are needed to tell.
+        """
+        if self.frame_format == protocol.FRAME_LEGACY:
+            if self.requested_format != protocol.FRAME_EXTENDED:
+                return False
+            size = protocol.EXTENDED_FRAME_SIZE
+            if pos + size > length:
+                return False if idle else None
+            frame = bytes(buffer[pos:pos + size])
+            if frame[-1] != self.END_BYTE or self._valid_crcs([frame]) != 1:
+                return False
+            self.set_format(protocol.FRAME_EXTENDED)
+            return True
+
+        size = protocol.FRAME_SIZE
+        if pos + size * self.LEGACY_CONFIRM > length:
+            return False if idle else None
+        for frame_pos in range(pos, pos + size * self.LEGACY_CONFIRM, size):
+            if buffer[frame_pos] != self.START_BYTE or buffer[frame_pos + size - 1] != self.END_BYTE:
+                return False
+        if self.requested_format == protocol.FRAME_EXTENDED:
+            log.warning("Board sends legacy frames again, falling back from extended frames")
+        self.set_format(protocol.FRAME_LEGACY)
+        return True
+
+    def _aligned_run(self, buffer: bytearray, pos: int, length: int) -> int:
+        """Number of back-to-back frames with intact markers starting at pos"""
+        size = self.frame_size
+        if length - pos < 2 * size:
+            return 1
+        stop = pos + (length - pos) // size * size
+        starts = buffer[pos:stop:size]
+        ends = buffer[pos + size - 1:stop:size]
+        count = len(starts)
+        if starts.count(self.START_BYTE) == count and ends.count(self.END_BYTE) == count:
+            return count
+        for i in range(1, count):
+            if starts[i] != self.START_BYTE or ends[i] != self.END_BYTE:
+                return i
+        return count
+
+    @staticmethod
+    def _valid_crcs(run: List[bytes]) -> int:
+        """Number of leading extended frames whose CRC matches"""
+        crc = binascii.crc_hqx
+        residue = protocol.FRAME_CRC_RESIDUE
+        for i, frame in enumerate(run):
+            # Checking the whole frame against the residue avoids slicing it
+            if crc(frame, 0xFFFF) != residue:
+                return i
+        return len(run)
+
+    def _check_sequence(self, run: List[bytes]):
+        """Count extended frames missing between and before the frames of run"""
+        expected = self._next_sequence
+        for frame in run:
+            sequence = frame[1] | frame[2] << 8
+            if expected is not None and sequence != expected:
+                self.sequence_gaps += 1
+                self.frames_dropped += (sequence - expected) & 0xFFFF
+            expected = (sequence + 1) & 0xFFFF
+        self._next_sequence = expected
+
+    def expect_echo(self, packet: bytes, callback: Callable[[bytes], None]):
+        """Register a packet whose echo should be taken out of the stream
+
+        Identical packets are matched to their callbacks in order.
+        """
+        with self._echo_lock:
+            self._expected_echoes.setdefault(bytes(packet), deque()).append(callback)
+
+    def cancel_echo(self, packet: bytes, callback: Callable[[bytes], None]):
+        """Stop waiting for an echo registered with expect_echo"""
+        packet = bytes(packet)
+        with self._echo_lock:
+            callbacks = self._expected_echoes.get(packet)
+            if callbacks is None:
+                return
+            try:
+                callbacks.remove(callback)
+            except ValueError:
+                pass  # Already matched
+            if not callbacks:
+                del self._expected_echoes[packet]
+
+    def _match_echo(self, buffer: bytearray, pos: int, length: int):
+        """Expected echo at pos
+
+        Returns the echo on a match, None if the buffered bytes are a prefix
+        of an expected echo, or empty bytes otherwise.
+        """
+        partial = False
+        for echo in self._expected_echoes:
+            if pos + len(echo) <= length:
+                if buffer.startswith(echo, pos):
+                    return echo
+            elif echo.startswith(buffer[pos:length]):
+                partial = True
+        return None if partial else b''
+
+    def _take_echo(self, echo: bytes) -> Callable[[bytes], None]:
+        """Callback of the oldest registration of a matched echo"""
+        callbacks = self._expected_echoes[echo]
+        callback = callbacks.popleft()
+        if not callbacks:
+            del self._expected_echoes[echo]
+        return callback
+
+    def _drop(self, count: int):
+        """Account for bytes discarded while resynchronising"""
+        if count <= 0:
+            return
+        self.bytes_dropped += count
+        self._garbage_run += count
+
+    def _end_resync(self):
+        """Close a run of discarded bytes once a good frame is found again"""
+        if self.frame_format == protocol.FRAME_LEGACY:
+            # A run of garbage stands for at least one lost frame; extended
+            # frames count their losses exactly from the sequence numbers
+            self.frames_dropped += max(1, round(self._garbage_run / self.frame_size))
+        self.resyncs += 1
+        self._garbage_run = 0
+
+    def reset(self):
+        """Discard any buffered partial frame"""
+        self._buffer.clear()
+        self._garbage_run = 0
+        self._next_sequence = None
+        self._streaming = False
+        self._after_frame = False
+
+    def reset_counters(self):
+        """Reset the decode statistics"""
+        self.frames_decoded = 0
+        self.frames_dropped = 0
+        self.bytes_dropped = 0
+        self.resyncs = 0
+        self.crc_failures = 0
+        self.sequence_gaps = 0
+
+    def counters(self) -> Dict[str, int]:
+        """Snapshot of the decode statistics"""
+        return {
+            "frames_decoded": self.frames_decoded,
+            "frames_dropped": self.frames_dropped,
+            "bytes_dropped": self.bytes_dropped,
+            "resyncs": self.resyncs,
+            "crc_failures": self.crc_failures,
+            "sequence_gaps": self.sequence_gaps,
+        }
+
+    @property
+    def pending_bytes(self) -> int:
+        """Number of bytes held back waiting for the rest of a frame"""
+        return len(self._buffer)
@@ -0,0 +1,263 @@
+"""
+DeviceManager - Several PCC boards driven as one global channel space
+
+Each board keeps its own SerialTransport, and with it its own acquisition
+thread. Global channel c lives on board c // channels_per_board as local
+channel c % channels_per_board. Uploads are pipelined on every board at the
+same time, and start/stop packets go out to all boards back to back.
+
+Telemetry is merged by TelemetryMerger: the n-th frame of every board since
+the last coordinated start forms row n of one (N, boards * channels) array.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+import numpy as np
+
+from . import protocol
+from .convert import FrameConverter
+from .transport import SerialTransport
+from .uploader import PipelinedUploader
+
+log = logging.getLogger(__name__)
+
+
+def when_all(futures: Sequence[Future]) -> Future:
+    """Future resolving with None once every future is done, failed or not"""
+    result: Future = Future()
+    result.set_running_or_notify_cancel()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            done = remaining[0] == 0
+        if done:
+            result.set_result(None)
+
+    if not futures:
+        result.set_result(None)
+    for future in futures:
+        future.add_done_callback(on_done)
+    return result
+
+
+class TelemetryMerger:
+    # Defaults
+    MAX_LAG = 4096  # Rows a board may run ahead before the others are padded
+
+    def __init__(self, boards: int, channels_per_board: int = protocol.NUM_CHANNELS,
+                 max_voltage: float = protocol.MAX_VOLTAGE, max_lag: int = MAX_LAG):
+        self.boards = boards
+        self.channels_per_board = channels_per_board
+        self.max_voltage = max_voltage
+        self.max_lag = max_lag
+
+        # Called with ((N, boards * channels) volts, (N,) time_ns) from the
+        # acquisition thread that completed the rows
+        self.on_merged: Optional[Callable[[np.ndarray, np.ndarray], None]] = None
+
+        # Converters are only used by their board's acquisition thread
+        self._converters = [FrameConverter(channels_per_board, max_voltage) for _ in range(boards)]
+        self._lock = threading.Lock()
+        self._pending: List[List[Tuple[np.ndarray, np.ndarray]]] = [[] for _ in range(boards)]
+        self._counts = [0] * boards
+
+        # Statistics
+        self.rows_merged = 0
+        self.rows_padded = 0  # Board rows filled with NaN because the board fell behind
+
+    def listener(self, board: int) -> Callable[[List[bytes], int], None]:
+        """Frame listener to register on the transport of board"""
+        def on_frames(frames: List[bytes], time_ns: int):
+            block = self._converters[board].convert(frames).copy()
+            self.add(board, block, np.full(len(block), time_ns, dtype=np.int64))
+        return on_frames
+
+    def set_calibration(self, board: int, calibration):
+        """Decode the telemetry of one board with a calibration"""
+        self._converters[board].calibration = calibration
+
+    def add(self, board: int, block: np.ndarray, time_ns: np.ndarray):
+        """Queue converted rows of one board and emit every complete row"""
+        with self._lock:
+            self._pending[board].append((block, time_ns))
+            self._counts[board] += len(block)
+            merged = self._merge()
+        if merged is not None and self.on_merged:
+            self.on_merged(*merged)
+
+    def reset(self):
+        """Drop partial rows, e.g. before a coordinated start"""
+        with self._lock:
+            self._pending = [[] for _ in range(self.boards)]
+            self._counts = [0] * self.boards
+
+    def _merge(self) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Take the rows every board has delivered (lock held)"""
+        rows = min(self._counts)
+        lead = max(self._counts)
+        if lead - rows > self.max_lag:
+            # A board dropped frames or stalled; give up on its missing rows
+            rows = lead - self.max_lag
+        if rows == 0:
+            return None
+
+        width = self.channels_per_board
+        merged = np.full((rows, self.boards * width), np.nan, dtype=np.float32)
+        times = np.zeros(rows, dtype=np.int64)
+        for board in range(self.boards):
+            available = min(rows, self._counts[board])
+            if available < rows:
+                self.rows_padded += rows - available
+            if available == 0:
+                continue
+            blocks, stamps = zip(*self._pending[board])
+            block = np.concatenate(blocks)
+            stamp = np.concatenate(stamps)
+            merged[:available, board * width:(board + 1) * width] = block[:available]
+            # A row is complete when its last board delivered it
+            np.maximum(times[:available], stamp[:available], out=times[:available])
+            self._pending[board] = [(block[available:], stamp[available:])] if available < len(block) else []
+            self._counts[board] -= available
+        self.rows_merged += rows
+        return merged, times
+
+
+class DeviceManager:
+    def __init__(self, channels_per_board: int = protocol.NUM_CHANNELS,
+                 max_voltage: float = protocol.MAX_VOLTAGE):
+        self.channels_per_board = channels_per_board
+        self.max_voltage = max_voltage
+        self.boards: List[SerialTransport] = []
+        self.uploaders: List[PipelinedUploader] = []
+        self.merger: Optional[TelemetryMerger] = None
+        self.calibrations: List = []  # Optional pcc.calibration.Calibration per board
+
+        # Called with merged telemetry, see TelemetryMerger.on_merged
+        self.on_merged: Optional[Callable[[np.ndarray, np.ndarray], None]] = None
+
+        # Statistics of the last upload
+        self.elapsed = 0.0
+
+    @property
+    def num_channels(self) -> int:
+        """Channels of all connected boards"""
+        return len(self.boards) * self.channels_per_board
+
+    def connect(self, ports: Sequence[str], baudrate: int = 115200) -> bool:
+        """Open every port in parallel; on any failure, close them all"""
+        self.disconnect()
+        boards = [SerialTransport() for _ in ports]
+        with ThreadPoolExecutor(max_workers=max(1, len(ports))) as pool:
+            connected = list(pool.map(lambda b, p: b.connect(p, baudrate), boards, ports))
+        if not all(connected):
+            for board in boards:
+                board.disconnect()
+            return False
+
+        self.boards = boards
+        self.uploaders = [PipelinedUploader(board) for board in boards]
+        self.merger = TelemetryMerger(len(boards), self.channels_per_board, self.max_voltage)
+        self.merger.on_merged = self._on_merged
+        self.calibrations = [None] * len(boards)
+        for index, board in enumerate(boards):
+            board.add_frame_listener(self.merger.listener(index))
+        log.info("Connected %d boards (%d channels)", len(boards), self.num_channels)
+        return True
+
+    def disconnect(self):
+        """Close every board"""
+        for board in self.boards:
+            board.disconnect()
+        self.boards = []
+        self.uploaders = []
+        self.merger = None
+        self.calibrations = []
+
+    def is_connected(self) -> bool:
+        """True if every board is connected"""
+        return bool(self.boards) and all(board.is_connected() for board in self.boards)
+
+    def _on_merged(self, block: np.ndarray, time_ns: np.ndarray):
+        if self.on_merged:
+            self.on_merged(block, time_ns)
+
+    def set_calibration(self, board: int, calibration):
+        """Apply a calibration to the packets and telemetry of one board"""
+        self.calibrations[board] = calibration
+        self.merger.set_calibration(board, calibration)
+
+    def locate(self, channel: int) -> Tuple[int, int]:
+        """Map a zero-based global channel to (board, local channel)"""
+        if not 0 <= channel < self.num_channels:
+            raise ValueError(f"Channel must be between 1 and {self.num_channels}")
+        return divmod(channel, self.channels_per_board)
+
+    def channel_config_packet(self, channel: int, start_v: float, end_v: float, steps: int,
+                              hold_end: bool = False) -> Tuple[int, List[int]]:
+        """(board, packet) configuring a zero-based global channel"""
+        board, local = self.locate(channel)
+        return board, protocol.channel_config_packet(local, start_v, end_v, steps, hold_end,
+                                                     self.calibrations[board])
+
+    def upload(self, items: Sequence[Tuple[int, List[int], str]]) -> Future:
+        """Pipeline (board, packet, description) items on all boards at once
+
+        Returns:
+            Future: Resolves with the sorted indices of the items that were
+            never confirmed
+        """
+        start_time = time.monotonic()
+        per_board: List[List[int]] = [[] for _ in self.boards]
+        for index, (board, _, _) in enumerate(items):
+            per_board[board].append(index)
+
+        futures = []
+        for board, indices in enumerate(per_board):
+            if indices:
+                packets = [(items[i][1], items[i][2]) for i in indices]
+                futures.append((indices, self.uploaders[board].upload(packets)))
+
+        result: Future = Future()
+        result.set_running_or_notify_cancel()
+
+        def on_done(_):
+            self.elapsed = time.monotonic() - start_time
+            failed = [indices[i] for indices, future in futures for i in future.result()]
+            result.set_result(sorted(failed))
+
+        when_all([future for _, future in futures]).add_done_callback(on_done)
+        return result
+
+    def broadcast(self, packet: List[int], description: str = "") -> Future:
+        """Send a command to every board back to back
+
+        Returns:
+            Future: Resolves with the indices of the boards that didn't confirm
+        """
+        futures = [board.send_command(packet, f"{description} (board {i + 1})")
+                   for i, board in enumerate(self.boards)]
+        result: Future = Future()
+        result.set_running_or_notify_cancel()
+
+        def on_done(_):
+            result.set_result([i for i, f in enumerate(futures) if f.exception() is not None])
+
+        when_all(futures).add_done_callback(on_done)
+        return result
+
+    def start(self) -> Future:
+        """Coordinated start: realign telemetry and start every board"""
+        if self.merger:
+            self.merger.reset()
+        return self.broadcast(protocol.start_packet(), "Start monitoring")
+
+    def stop(self) -> Future:
+        """Stop data collection on every board"""
+        return self.broadcast(protocol.stop_packet(), "Stop monitoring")
+
@@ -0,0 +1,113 @@
+"""
+HistoryBuffer - Preallocated rolling history of channel voltages
+"""
+
+import threading
+from typing import Tuple
+import numpy as np
+
+from . import protocol
+
+
+class HistoryBuffer:
+    # Defaults
+    HISTORY_LEN = 1 << 18  # Samples kept per channel
+
+    def __init__(self, history_len: int = HISTORY_LEN,
+                 num_channels: int = protocol.NUM_CHANNELS):
+        self.history_len = history_len
+        self.num_channels = num_channels
+        self.data = np.zeros((history_len, num_channels), dtype=np.float32)
+        self.timestamps = np.zeros(history_len, dtype=np.float64)
+        self._lock = threading.Lock()
+        self._index = 0  # Next row to write
+        self.count = 0  # Valid rows
+        self.total = 0  # Rows ever written
+
+    def extend(self, block: np.ndarray, timestamps: np.ndarray):
+        """Copy an (N, num_channels) block and its timestamps into the ring"""
+        count = len(block)
+        if count == 0:
+            return
+        if count > self.history_len:
+            block = block[-self.history_len:]
+            timestamps = timestamps[-self.history_len:]
+            count = self.history_len
+
+        with self._lock:
+            start = self._index
+            first = min(count, self.history_len - start)
+            self.data[start:start + first] = block[:first]
+            self.timestamps[start:start + first] = timestamps[:first]
+            if first < count:
+                # Wrap around to the beginning
+                self.data[:count - first] = block[first:]
+                self.timestamps[:count - first] = timestamps[first:]
+            self._index = (start + count) % self.history_len
+            self.count = min(self.history_len, self.count + count)
+            self.total += count
+
+    def window(self, seconds: float, channels=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return copies of (timestamps, data) for the last seconds, oldest first
+
+        Args:
+            seconds: Length of the window, relative to the newest sample
+            channels: Optional list of channel indices to select
+        """
+        columns = slice(None) if channels is None else channels
+        with self._lock:
+            if self.count == 0:
+                return np.empty(0), self.data[:0, columns].copy()
+
+            # The valid rows form at most two chronological segments
+            start = (self._index - self.count) % self.history_len
+            if start + self.count <= self.history_len:
+                segments = [(start, start + self.count)]
+            else:
+                segments = [(start, self.history_len), (0, self._index)]
+
+            cutoff = self.timestamps[self._index - 1] - seconds
+            times = []
+            data = []
+            for begin, end in segments:
+                first = begin + np.searchsorted(self.timestamps[begin:end], cutoff, side='left')
+                if first < end:
+                    times.append(self.timestamps[first:end])
+                    data.append(self.data[first:end, columns])
+            return np.concatenate(times), np.concatenate(data)
+
+    def clear(self):
+        """Forget all samples"""
+        with self._lock:
+            self._index = 0
+            self.count = 0
+
+
+def minmax_decimate(x: np.ndarray, y: np.ndarray, max_points: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Reduce a trace to at most max_points while keeping its envelope
+
+    The samples are split into max_points // 2 bins and each bin is replaced
+    by its minimum and maximum, so spikes stay visible however far the plot
+    is zoomed out. y may be (N,) or (N, channels).
+    """
+    count = len(x)
+    bins = max(1, max_points // 2)
+    if count <= max_points:
+        return x, y
+
+    per_bin = count // bins
+    used = per_bin * bins
+    # Keep the newest samples when the length isn't a multiple of the bin size
+    x = x[count - used:]
+    y = y[count - used:]
+
+    binned = y.reshape((bins, per_bin) + y.shape[1:])
+    y_out = np.empty((bins * 2,) + y.shape[1:], dtype=y.dtype)
+    y_out[0::2] = binned.min(axis=1)
+    y_out[1::2] = binned.max(axis=1)
+
+    x_binned = x.reshape(bins, per_bin)
+    x_out = np.empty(bins * 2, dtype=x.dtype)
+    x_out[0::2] = x_binned[:, 0]
+    x_out[1::2] = x_binned[:, -1]
+    return x_out, y_out
@@ -0,0 +1,203 @@
+"""
+Protocol - Packet layout shared with the PCC driver firmware
+
+Every host packet is [0xAA, length, command, ..., 0] and is echoed back by
+the device once it has been received completely.
+
+Waveform tables are uploaded in three steps: a begin packet stages a table
+of the given length, data packets fill it at explicit offsets (so they may
+arrive in any order and be retransmitted on their own), and a commit packet
+carrying the CRC of the whole table makes the channel play it at the DAC
+update frequency instead of its ramp. A channel configuration packet
+switches the channel back to its ramp.
+
+Telemetry comes in two formats. Legacy frames are 0xAA, 24 little-endian
+readings and 0x55. Extended frames add a little-endian 16-bit sequence
+number after the start marker and, before the end marker, the big-endian
+CRC-16/CCITT (initial value 0xFFFF) of everything from the start marker to
+the last reading, so false frames and lost frames can be detected. The
+sequence number counts every frame sent and restarts at 0 when the format
+is selected.
+
+Extended frames and the frame format command (12) are only implemented by
+pcc.simulator so far. The firmware echoes the command like every packet but
+keeps sending legacy frames, which the decoder detects (see pcc.decoder).
+"""
+
+import binascii
+import struct
+from typing import List, Sequence
+
+# Device constants (see config.h in the firmware)
+NUM_CHANNELS = 24
+MAX_VOLTAGE = 30
+DAC_FULL_SCALE = 65535
+MAX_STEPS = 65535
+MAX_FREQUENCY = 200000  # DACs can handle max 200 kHz
+MAX_PACKET_SIZE = 64  # rx_array in the firmware
+MAX_TABLE_LENGTH = 4096  # Codes per channel waveform table
+
+START_BYTE = 0xAA
+END_BYTE = 0x55
+FRAME_SIZE = 2 * NUM_CHANNELS + 2  # Telemetry frame: 0xAA, readings, 0x55
+# Extended frame: 0xAA, 16-bit sequence number, readings, CRC-16, 0x55
+EXTENDED_FRAME_SIZE = FRAME_SIZE + 4
+
+# Telemetry frame formats, selected with frame_format_packet
+FRAME_LEGACY = 0
+FRAME_EXTENDED = 1
+FRAME_SIZES = {FRAME_LEGACY: FRAME_SIZE, FRAME_EXTENDED: EXTENDED_FRAME_SIZE}
+# CRC of a whole intact extended frame: a CRC followed by its own big-endian
+# value leaves zero, which the end marker then turns into this constant
+FRAME_CRC_RESIDUE = binascii.crc_hqx(bytes([END_BYTE]), 0)
+
+# Commands
+CMD_CHANNEL_CONFIG = 1
+CMD_START = 2
+CMD_STOP = 8
+CMD_FREQUENCY = 8  # Same command byte as stop, told apart by the length
+CMD_MONITOR_STOP = 6  # Stop sent by the monitor window when it closes
+CMD_TABLE_BEGIN = 9  # Stage a waveform table of a given length
+CMD_TABLE_DATA = 10  # Write codes into the staged table at an offset
+CMD_TABLE_COMMIT = 11  # Check the staged table and play it on the channel
+CMD_FRAME_FORMAT = 12  # Select the telemetry frame format
+
+# Codes per table data packet: header (start, length, command, channel,
+# 16-bit offset) and trailing zero around big-endian codes
+TABLE_CHUNK_CODES = (MAX_PACKET_SIZE - 7) // 2
+
+
+def volts_to_dac(voltage: float) -> int:
+    """Convert a voltage to a 16-bit DAC code"""
+    return int(voltage * DAC_FULL_SCALE / MAX_VOLTAGE)
+
+
+def channel_config_packet(channel: int, start_voltage: float, end_voltage: float,
+                          steps: int, hold_end: bool = False, calibration=None) -> List[int]:
+    """Create the ramp configuration packet for a channel
+
+    Args:
+        channel: Zero-based channel index
+        start_voltage: Ramp start in volts
+        end_voltage: Ramp end in volts
+        steps: Number of steps between start and end
+        hold_end: Hold the end value instead of repeating the ramp
+        calibration: Optional pcc.calibration.Calibration correcting the
+            DAC codes for the channel's output stage
+    """
+    if not 0 <= channel < NUM_CHANNELS:
+        raise ValueError(f"Channel must be between 1 and {NUM_CHANNELS}, got {channel + 1}")
+    for name, value in (("Start", start_voltage), ("End", end_voltage)):
+        if value < 0 or value > MAX_VOLTAGE:
+            raise ValueError(f"{name} voltage out of range (0-{MAX_VOLTAGE}V) on channel {channel + 1}")
+    if steps <= 0 or steps > MAX_STEPS:
+        raise ValueError(f"Steps must be between 1 and {MAX_STEPS} on channel {channel + 1}")
+
+    if calibration is None:
+        start_code, end_code = volts_to_dac(start_voltage), volts_to_dac(end_voltage)
+    else:
+        start_code = calibration.dac_code(channel, start_voltage)
+        end_code = calibration.dac_code(channel, end_voltage)
+    return channel_code_packet(channel, start_code, end_code, steps, hold_end)
+
+
+def channel_code_packet(channel: int, start_code: int, end_code: int, steps: int,
+                        hold_end: bool = False) -> List[int]:
+    """Ramp configuration packet from raw DAC codes (see channel_config_packet)"""
+    # Create packet with big-endian byte order; channel is 1-indexed on the wire
+    packet = [START_BYTE, 12, CMD_CHANNEL_CONFIG, channel + 1, 1 if hold_end else 0]
+    packet.extend(struct.pack('>H', start_code))
+    packet.extend(struct.pack('>H', end_code))
+    packet.extend(struct.pack('>H', steps))
+    packet.append(0)
+
+    return packet
+
+
+def start_packet() -> List[int]:
+    """Create the start data collection packet"""
+    return [START_BYTE, 4, CMD_START, 0]
+
+
+def stop_packet() -> List[int]:
+    """Create the stop data collection packet"""
+    return [START_BYTE, 4, CMD_STOP, 0]
+
+
+def frequency_packet(frequency: int) -> List[int]:
+    """Create the DAC update frequency packet"""
+    if frequency > MAX_FREQUENCY:
+        raise ValueError(f"Frequency too high. DACs can handle max 200kHz, you set {frequency} Hz")
+    if frequency <= 0:
+        raise ValueError(f"Frequency must be positive, you set {frequency} Hz")
+
+    # Frequency is sent as 3 big-endian bytes
+    freq_bytes = struct.pack('>I', frequency)[1:4]
+    return [START_BYTE, 7, CMD_FREQUENCY] + list(freq_bytes) + [0]
+
+
+def frame_format_packet(frame_format: int) -> List[int]:
+    """Create the packet selecting FRAME_LEGACY or FRAME_EXTENDED telemetry"""
+    if frame_format not in FRAME_SIZES:
+        raise ValueError(f"Unknown frame format {frame_format}")
+    return [START_BYTE, 5, CMD_FRAME_FORMAT, frame_format, 0]
+
+
+def frame_crc(frame: bytes) -> int:
+    """CRC stored in an extended frame, computed over its first size - 3 bytes"""
+    return binascii.crc_hqx(frame[:EXTENDED_FRAME_SIZE - 3], 0xFFFF)
+
+
+def payload_offset(frame_size: int) -> int:
+    """Offset of the first reading in a frame of either format"""
+    return 3 if frame_size == EXTENDED_FRAME_SIZE else 1
+
+
+def table_crc(codes: Sequence[int]) -> int:
+    """CRC-16/CCITT of a table's big-endian codes, checked on commit"""
+    return binascii.crc_hqx(struct.pack(f'>{len(codes)}H', *codes), 0xFFFF)
+
+
+def _check_table_channel(channel: int):
+    if not 0 <= channel < NUM_CHANNELS:
+        raise ValueError(f"Channel must be between 1 and {NUM_CHANNELS}, got {channel + 1}")
+
+
+def table_begin_packet(channel: int, length: int) -> List[int]:
+    """Create the packet that stages an empty table of length codes"""
+    _check_table_channel(channel)
+    if not 0 < length <= MAX_TABLE_LENGTH:
+        raise ValueError(f"Table length must be between 1 and {MAX_TABLE_LENGTH}, got {length}")
+    return [START_BYTE, 7, CMD_TABLE_BEGIN, channel + 1] + list(struct.pack('>H', length)) + [0]
+
+
+def table_data_packet(channel: int, offset: int, codes: Sequence[int]) -> List[int]:
+    """Create a packet writing up to TABLE_CHUNK_CODES codes at offset"""
+    _check_table_channel(channel)
+    if not 0 < len(codes) <= TABLE_CHUNK_CODES:
+        raise ValueError(f"A table packet holds 1 to {TABLE_CHUNK_CODES} codes, got {len(codes)}")
+    if offset < 0 or offset + len(codes) > MAX_TABLE_LENGTH:
+        raise ValueError(f"Table offset {offset} out of range on channel {channel + 1}")
+    packet = [START_BYTE, 7 + 2 * len(codes), CMD_TABLE_DATA, channel + 1]
+    packet.extend(struct.pack('>H', offset))
+    packet.extend(struct.pack(f'>{len(codes)}H', *codes))
+    packet.append(0)
+    return packet
+
+
+def table_commit_packet(channel: int, codes: Sequence[int], hold_end: bool = False) -> List[int]:
+    """Create the packet that plays the staged table once its CRC matches"""
+    _check_table_channel(channel)
+    packet = [START_BYTE, 8, CMD_TABLE_COMMIT, channel + 1, 1 if hold_end else 0]
+    packet.extend(struct.pack('>H', table_crc(codes)))
+    packet.append(0)
+    return packet
+
+
+def frame_to_voltages(frame: bytes) -> List[float]:
+    """Convert one telemetry frame to a list of channel voltages
+
+    For batches use pcc.convert.FrameConverter, which is vectorized.
+    """
+    raw = struct.unpack_from(f'<{NUM_CHANNELS}H', frame, payload_offset(len(frame)))
+    return [value * MAX_VOLTAGE / DAC_FULL_SCALE for value in raw]
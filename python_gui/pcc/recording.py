@@ -0,0 +1,194 @@
+"""
+Recording - Append-only binary telemetry files and memory-mapped playback
+
+File layout (little-endian):
+
+    header   HEADER_SIZE bytes: magic, version, channel count, scale
+             (volts per DAC code), record count, JSON settings
+    records  fixed-size records, one per frame: host monotonic time in ns
+             followed by the raw 16-bit readings of every channel
+
+Records are appended in chunks by a background thread. Because every record
+has the same size, a file can be opened with np.memmap and sliced without
+copying, even while it is still being written.
+"""
+
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+from . import protocol
+
+MAGIC = b'PCCREC\x00\x01'
+VERSION = 1
+HEADER_SIZE = 4096
+# magic, version, header size, channel count, scale, record count, settings length
+HEADER_STRUCT = struct.Struct('<8sHHHdQI')
+
+
+def record_dtype(num_channels: int) -> np.dtype:
+    """Structured dtype of one record"""
+    return np.dtype([('time_ns', '<u8'), ('raw', '<u2', (num_channels,))])
+
+
+class TelemetryRecorder:
+    # Defaults
+    QUEUE_SIZE = 1024  # Batches buffered before new ones are dropped
+    FLUSH_INTERVAL = 0.5  # Seconds between flushes to disk
+
+    def __init__(self, path: str, num_channels: int = protocol.NUM_CHANNELS,
+                 max_voltage: float = protocol.MAX_VOLTAGE,
+                 settings: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.num_channels = num_channels
+        self.scale = max_voltage / protocol.DAC_FULL_SCALE
+        self.settings = settings or {}
+        self.dtype = record_dtype(num_channels)
+
+        self.records_written = 0
+        self.batches_dropped = 0
+
+        self._queue: "queue.Queue[Optional[Tuple[List[bytes], int]]]" = queue.Queue(self.QUEUE_SIZE)
+        self._file = None
+        self._settings_bytes = b''
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Create the file, write the header and start the writer thread"""
+        settings = json.dumps(self.settings).encode('utf-8')
+        if HEADER_STRUCT.size + len(settings) > HEADER_SIZE:
+            raise ValueError("Recording settings don't fit in the file header")
+
+        self._file = open(self.path, 'wb')
+        self._file.write(self._header(0, settings))
+        self._settings_bytes = settings
+
+        self._thread = threading.Thread(target=self._writer_loop, name="TelemetryRecorder", daemon=True)
+        self._thread.start()
+
+    def write_frames(self, frames: List[bytes], time_ns: int):
+        """Queue a batch of frames received at time_ns; never blocks"""
+        try:
+            self._queue.put_nowait((frames, time_ns))
+        except queue.Full:
+            self.batches_dropped += 1
+
+    def close(self):
+        """Write everything still queued, update the header and close"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+        # Record the final count so readers don't have to rely on file size
+        self._file.seek(0)
+        self._file.write(self._header(self.records_written, self._settings_bytes))
+        self._file.close()
+        self._file = None
+
+    def _header(self, record_count: int, settings: bytes) -> bytes:
+        """Pack the fixed-size header"""
+        header = HEADER_STRUCT.pack(MAGIC, VERSION, HEADER_SIZE, self.num_channels,
+                                    self.scale, record_count, len(settings))
+        return (header + settings).ljust(HEADER_SIZE, b'\x00')
+
+    def _writer_loop(self):
+        """Convert queued batches to records and append them in chunks"""
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            item = self._queue.get()
+            batches = [item]
+            # Drain whatever else is waiting so it goes out in one write
+            while True:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batches:
+                running = False
+                batches = batches[:batches.index(None)]
+
+            for frames, time_ns in batches:
+                self._file.write(self._records(frames, time_ns))
+                self.records_written += len(frames)
+
+            now = time.monotonic()
+            if now - last_flush >= self.FLUSH_INTERVAL:
+                self._file.flush()
+                last_flush = now
+
+    def _records(self, frames: List[bytes], time_ns: int) -> bytes:
+        """Build the record block for one batch of frames"""
+        count = len(frames)
+        records = np.empty(count, dtype=self.dtype)
+        records['time_ns'] = time_ns
+        # Strided view over the payloads, skipping markers, sequence numbers and CRCs
+        size = len(frames[0])
+        data = b''.join(frames)
+        records['raw'] = np.ndarray(
+            shape=(count, self.num_channels),
+            dtype='<u2',
+            buffer=data,
+            offset=protocol.payload_offset(size),
+            strides=(size, 2)
+        )
+        return records.tobytes()
+
+
+class TelemetryReader:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+
+        (magic, version, header_size, self.num_channels, self.scale,
+         record_count, settings_len) = HEADER_STRUCT.unpack_from(header)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a telemetry recording")
+        if version != VERSION:
+            raise ValueError(f"Unsupported recording version {version}")
+
+        start = HEADER_STRUCT.size
+        self.settings = json.loads(header[start:start + settings_len] or b'{}')
+        self.dtype = record_dtype(self.num_channels)
+
+        # A file that was never closed has a zero count; use what is on disk
+        available = (os.path.getsize(path) - header_size) // self.dtype.itemsize
+        count = record_count if 0 < record_count <= available else available
+
+        if count:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r',
+                                     offset=header_size, shape=(count,))
+        else:
+            self.records = np.empty(0, dtype=self.dtype)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """Host monotonic receive times in ns (zero-copy view)"""
+        return self.records['time_ns']
+
+    @property
+    def raw(self) -> np.ndarray:
+        """(N, num_channels) raw DAC codes (zero-copy view)"""
+        return self.records['raw']
+
+    def voltages(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Scale a slice of records to volts"""
+        return self.raw[start:stop].astype(np.float32) * np.float32(self.scale)
+
+    def seconds(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Receive times of a slice of records, relative to the first record"""
+        if len(self) == 0:
+            return np.empty(0)
+        return (self.timestamps[start:stop] - self.timestamps[0]) / 1e9
@@ -0,0 +1,334 @@
+"""
+Regulator - Host-side closed-loop trimming of channel setpoints
+
+The firmware drives its DACs open loop, so load current and output stage
+errors leave the measured voltage a little off the requested one.
+ClosedLoopRegulator closes the loop on the host. It runs as a frame
+listener on the acquisition thread, averages each channel's readback
+between updates and runs a PI controller per channel in DAC code space:
+
+- every update is vectorized over all channels; channels without a target
+  are NaN and skipped
+- the command is limited to the DAC range and to max_trim around the open
+  loop code, and the integral is back-calculated when it hits a limit, so
+  it doesn't wind up while the output can't follow (anti-windup)
+- a channel is only sent when its command moved at least one LSB from the
+  code last sent, and not while its previous correction awaits its echo
+- all corrections of an update go out in one write (send_commands)
+- readback taken before a correction was echoed is discarded, so the
+  controller never integrates the error of an output it already changed
+
+The time from receiving the frames to writing the corrections (loop
+latency), the compute time and the time to the echoes are recorded per
+update. An update never waits for the board, so its cost is bounded by
+the channel count; updates slower than the latency budget are counted as
+overruns.
+
+Regulated channels hold a constant voltage: the regulator replaces their
+configuration with one-step hold packets.
+"""
+
+import collections
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from . import protocol
+from .convert import FrameConverter
+
+log = logging.getLogger(__name__)
+
+
+class ClosedLoopRegulator:
+    # Defaults
+    KP = 0.2  # Proportional gain, codes per code of error
+    KI = 5.0  # Integral gain, codes per code of error and second
+    INTERVAL = 0.02  # Seconds between controller updates
+    MAX_TRIM = 0.5  # Largest correction either way (V)
+    LATENCY_BUDGET = 0.005  # Frames to corrections (s); slower updates are overruns
+    MAX_DT = 0.1  # Longest time step integrated at once, e.g. after a stall (s)
+    HISTORY = 1000  # Updates kept for the timing report
+
+    def __init__(self, transport, num_channels: int = protocol.NUM_CHANNELS,
+                 calibration=None, kp: float = KP, ki: float = KI,
+                 interval: float = INTERVAL, max_trim: float = MAX_TRIM,
+                 latency_budget: float = LATENCY_BUDGET):
+        """
+        Args:
+            transport: SerialTransport of the board; its frames drive the loop
+            calibration: Optional pcc.calibration.Calibration used for both
+                the open loop codes and the readback
+            max_trim: Largest correction in volts either way from the open
+                loop setpoint
+        """
+        if kp < 0 or ki < 0:
+            raise ValueError("Controller gains must not be negative")
+        if interval <= 0:
+            raise ValueError("Update interval must be positive")
+        if max_trim < 0:
+            raise ValueError("Trim limit must not be negative")
+        self.transport = transport
+        self.num_channels = num_channels
+        self.calibration = calibration
+        self.kp = kp
+        self.ki = ki
+        self.interval_ns = int(interval * 1e9)
+        self.latency_budget_ns = int(latency_budget * 1e9)
+        self.codes_per_volt = protocol.DAC_FULL_SCALE / protocol.MAX_VOLTAGE
+        self.max_trim = max_trim * self.codes_per_volt
+        self.converter = FrameConverter(num_channels, calibration=calibration)
+
+        self.targets = np.full(num_channels, np.nan)
+        self._base = np.zeros(num_channels)  # Open loop code of each target
+        self._lock = threading.Lock()
+        self._running = False
+        self.reset()
+
+    def reset(self):
+        """Forget integrals, readback and statistics; targets are kept"""
+        with self._lock:
+            channels = self.num_channels
+            self.integral = np.zeros(channels)  # Codes added on top of the open loop code
+            self.command = self._base.copy()  # Last computed (unrounded) command
+            self.sent_codes = np.full(channels, -1, dtype=np.int64)
+            self.error = np.full(channels, np.nan)  # Last error in volts
+            self._in_flight = np.zeros(channels, dtype=bool)
+            self._discard = np.zeros(channels, dtype=bool)  # Confirmed since the last batch
+            self._sums = np.zeros(channels)
+            self._counts = np.zeros(channels, dtype=np.int64)
+            self._last_update_ns: Optional[int] = None
+
+            # Statistics
+            self.updates = 0
+            self.corrections_sent = 0
+            self.corrections_confirmed = 0
+            self.corrections_failed = 0
+            self.below_lsb = 0  # Channel updates that moved less than one LSB
+            self.in_flight_skips = 0  # Channel updates held back by an unconfirmed correction
+            self.saturated = 0  # Channel updates limited by the DAC range or max_trim
+            self.overruns = 0
+            self.latency_ns = collections.deque(maxlen=self.HISTORY)
+            self.compute_ns = collections.deque(maxlen=self.HISTORY)
+            self.confirm_ns = collections.deque(maxlen=self.HISTORY)
+
+    # Targets
+
+    def set_target(self, channel: int, voltage: Optional[float]):
+        """Regulate a channel to voltage, or stop regulating it with None"""
+        self.set_targets({channel: voltage})
+
+    def set_targets(self, targets: Dict[int, Optional[float]]):
+        """set_target for several channels at once"""
+        with self._lock:
+            for channel, voltage in targets.items():
+                if not 0 <= channel < self.num_channels:
+                    raise ValueError(f"Channel {channel + 1} out of range")
+                if voltage is None:
+                    self.targets[channel] = np.nan
+                    continue
+                if not 0.0 <= voltage <= protocol.MAX_VOLTAGE:
+                    raise ValueError(f"Target {voltage} V outside 0-{protocol.MAX_VOLTAGE} V")
+                self.targets[channel] = voltage
+                if self.calibration is not None:
+                    self._base[channel] = self.calibration.dac_code(channel, voltage)
+                else:
+                    self._base[channel] = protocol.volts_to_dac(voltage)
+                # A new setpoint starts from its open loop code
+                self.integral[channel] = 0.0
+                self.command[channel] = self._base[channel]
+                self.sent_codes[channel] = -1
+                self._sums[channel] = 0.0
+                self._counts[channel] = 0
+
+    def clear_targets(self):
+        """Stop regulating every channel"""
+        self.set_targets({channel: None for channel in range(self.num_channels)})
+
+    def correction_packet(self, channel: int) -> Optional[List[int]]:
+        """Hold packet of the trimmed code last sent to a channel, None if there is none"""
+        with self._lock:
+            code = int(self.sent_codes[channel])
+            if np.isnan(self.targets[channel]) or code < 0:
+                return None
+        return protocol.channel_code_packet(channel, code, code, 1, True)
+
+    # Control
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self) -> bool:
+        """Start regulating on the transport's acquisition thread
+
+        Returns False if the transport doesn't hand out frames in this process.
+        """
+        if self._running:
+            return True
+        with self._lock:
+            self._last_update_ns = None
+            self._sums[:] = 0.0
+            self._counts[:] = 0
+        self._running = True
+        if not self.transport.add_frame_listener(self.on_frames):
+            self._running = False
+            return False
+        return True
+
+    def stop(self, restore: bool = True) -> List:
+        """Stop regulating; returns the futures of the restore packets
+
+        Args:
+            restore: Send the open loop code to channels that carry a trim
+        """
+        if not self._running:
+            return []
+        self._running = False
+        self.transport.remove_frame_listener(self.on_frames)
+        log.info("Closed loop stopped after %d updates, %d corrections",
+                 self.updates, self.corrections_sent)
+        if not restore:
+            return []
+        with self._lock:
+            trimmed = (~np.isnan(self.targets) & (self.sent_codes >= 0)
+                       & (self.sent_codes != self._base.astype(np.int64)))
+            packets = [protocol.channel_code_packet(int(channel), int(self._base[channel]),
+                                                    int(self._base[channel]), 1, True)
+                       for channel in np.flatnonzero(trimmed)]
+            self.sent_codes[trimmed] = self._base[trimmed].astype(np.int64)
+        return self.transport.send_commands(packets, "Closed loop restore") if packets else []
+
+    def on_frames(self, frames: List[bytes], time_ns: int):
+        """Frame listener: accumulate readback and update when an interval passed"""
+        if not self._running or not frames:
+            return
+        block = self.converter.convert(frames)
+        with self._lock:
+            if self._discard.any():
+                # Readback up to the echo may predate the correction
+                self._sums[self._discard] = 0.0
+                self._counts[self._discard] = 0
+                self._discard[:] = False
+            self._sums += block.sum(axis=0, dtype=np.float64)
+            self._counts += len(block)
+
+            if self._last_update_ns is None:
+                self._last_update_ns = time_ns
+                return
+            elapsed = time_ns - self._last_update_ns
+            if elapsed < self.interval_ns:
+                return
+            self._last_update_ns = time_ns
+            packets = self._update(min(elapsed / 1e9, self.MAX_DT))
+
+        sent_ns = time.monotonic_ns()
+        futures = self.transport.send_commands([packet for _, packet in packets],
+                                               "Closed loop correction") if packets else []
+        written_ns = time.monotonic_ns()
+        for (channel, _), future in zip(packets, futures):
+            future.add_done_callback(self._confirmation(channel, sent_ns))
+
+        with self._lock:
+            latency = written_ns - time_ns
+            self.latency_ns.append(latency)
+            if latency > self.latency_budget_ns:
+                self.overruns += 1
+
+    def _update(self, dt: float) -> List:
+        """One PI step over all channels; returns (channel, packet) to send"""
+        start_ns = time.monotonic_ns()
+        self.updates += 1
+        active = ~np.isnan(self.targets) & (self._counts > 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            measured = self._sums / self._counts
+        self._sums[:] = 0.0
+        self._counts[:] = 0
+        # NaN readback (padding of a lagging board) leaves the channel alone
+        active &= ~np.isnan(measured)
+        self.error = np.where(active, self.targets - measured, np.nan)
+
+        # Channels waiting for an echo keep their integral
+        waiting = active & self._in_flight
+        self.in_flight_skips += int(np.count_nonzero(waiting))
+        active &= ~self._in_flight
+        if not active.any():
+            self.compute_ns.append(time.monotonic_ns() - start_ns)
+            return []
+
+        error = np.where(active, self.error, 0.0) * self.codes_per_volt
+        integral = self.integral + self.ki * error * dt
+        proportional = self.kp * error
+        command = self._base + proportional + integral
+        low = np.maximum(0.0, self._base - self.max_trim)
+        high = np.minimum(float(protocol.DAC_FULL_SCALE), self._base + self.max_trim)
+        limited = np.clip(command, low, high)
+        saturated = active & (limited != command)
+        self.saturated += int(np.count_nonzero(saturated))
+        # Back-calculate the integral so the limited command is its own steady state
+        integral = np.where(saturated, limited - self._base - proportional, integral)
+        self.integral = np.where(active, integral, self.integral)
+        self.command = np.where(active, limited, self.command)
+
+        codes = np.rint(self.command).astype(np.int64)
+        moved = active & (np.abs(self.command - self.sent_codes) >= 1.0) & (codes != self.sent_codes)
+        self.below_lsb += int(np.count_nonzero(active & ~moved))
+        packets = []
+        for channel in np.flatnonzero(moved):
+            code = int(codes[channel])
+            packets.append((int(channel), protocol.channel_code_packet(int(channel), code, code, 1, True)))
+        self.sent_codes[moved] = codes[moved]
+        self._in_flight[moved] = True
+        self.corrections_sent += len(packets)
+        self.compute_ns.append(time.monotonic_ns() - start_ns)
+        return packets
+
+    def _confirmation(self, channel: int, sent_ns: int):
+        """Done callback of a correction's echo future"""
+        def on_done(future):
+            with self._lock:
+                self._in_flight[channel] = False
+                if future.exception() is None:
+                    self.corrections_confirmed += 1
+                    self.confirm_ns.append(time.monotonic_ns() - sent_ns)
+                    self._discard[channel] = True
+                else:
+                    # Resend on the next update
+                    self.corrections_failed += 1
+                    self.sent_codes[channel] = -1
+        return on_done
+
+    def report(self) -> dict:
+        """Timing and activity summary of the updates so far"""
+        with self._lock:
+            latency = sorted(self.latency_ns)
+            compute = sorted(self.compute_ns)
+            confirmed = sorted(self.confirm_ns)
+            error = self.error[~np.isnan(self.error)]
+            counters = {
+                "updates": self.updates,
+                "corrections_sent": self.corrections_sent,
+                "corrections_confirmed": self.corrections_confirmed,
+                "corrections_failed": self.corrections_failed,
+                "below_lsb": self.below_lsb,
+                "in_flight_skips": self.in_flight_skips,
+                "saturated": self.saturated,
+                "overruns": self.overruns,
+            }
+
+        def percentile(values, fraction):
+            return values[min(len(values) - 1, int(fraction * len(values)))] / 1000 if values else 0.0
+
+        return {
+            **counters,
+            "latency_p50_us": percentile(latency, 0.5),
+            "latency_p99_us": percentile(latency, 0.99),
+            "latency_max_us": latency[-1] / 1000 if latency else 0.0,
+            "compute_p50_us": percentile(compute, 0.5),
+            "compute_max_us": compute[-1] / 1000 if compute else 0.0,
+            "confirm_p50_us": percentile(confirmed, 0.5),
+            "confirm_max_us": confirmed[-1] / 1000 if confirmed else 0.0,
+            "error_max_mv": float(np.abs(error).max()) * 1000 if len(error) else 0.0,
+        }
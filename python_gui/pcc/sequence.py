@@ -0,0 +1,291 @@
+"""
+Sequence - Host-timed multi-step voltage programs
+
+A program is a list of SequenceSteps. Each step applies setpoints (channels
+held at a voltage) and/or ramps (the firmware's start/end/steps ramp) and
+then dwells. SequenceRunner plays a program on its own thread:
+
+- step times are absolute offsets from the start on time.monotonic_ns, so
+  a late step doesn't push the following ones back
+- the thread waits on an Event until shortly before a step is due and
+  spins for the rest, instead of time.sleep
+- packets go out through PipelinedUploader without waiting for the echoes
+  of the previous step; setpoints are only sent to channels whose value
+  differs from the last one the runner sent (earlier steps may still be
+  in flight), ramps are always sent since that restarts them
+- a packet still waiting for a retransmission is dropped once a later step
+  sends the same channel, so an old value can't land after a newer one
+- the lateness of every step and the time to its confirmation are recorded
+
+Programs can be loaded from JSON:
+
+    {"repeat": 2, "steps": [
+        {"dwell": 0.5, "setpoints": {"1": 5.0, "2": 5.0}},
+        {"dwell": 1.0, "ramps": {"1": [0.0, 10.0, 100, true]}}
+    ]}
+
+Channel numbers in files are one-based, in code they are zero-based.
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from . import protocol
+from .state import DeviceState
+from .uploader import PipelinedUploader, UploadStats
+
+log = logging.getLogger(__name__)
+
+
+class SequenceStep:
+    def __init__(self, dwell: float, setpoints: Optional[Dict[int, float]] = None,
+                 ramps: Optional[Dict[int, Tuple[float, float, int, bool]]] = None):
+        """
+        Args:
+            dwell: Seconds until the next step
+            setpoints: Zero-based channel -> voltage to hold
+            ramps: Zero-based channel -> (start V, end V, steps, hold_end)
+        """
+        if dwell < 0:
+            raise ValueError(f"Dwell time must not be negative, got {dwell}")
+        self.dwell = dwell
+        self.setpoints = setpoints or {}
+        self.ramps = ramps or {}
+
+    def packets(self, calibration=None) -> List[Tuple[List[int], str]]:
+        """Channel configuration packets of the step, setpoints first"""
+        packets = [
+            (protocol.channel_config_packet(channel, voltage, voltage, 1, True, calibration),
+             f"Channel {channel + 1} = {voltage:.3f} V")
+            for channel, voltage in self.setpoints.items()
+        ]
+        packets.extend(
+            (protocol.channel_config_packet(channel, start, end, steps, hold_end, calibration),
+             f"Channel {channel + 1} ramp")
+            for channel, (start, end, steps, hold_end) in self.ramps.items()
+        )
+        return packets
+
+
+def setpoint_list(channels: Sequence[int], voltages: Sequence[float],
+                  dwell: float) -> List[SequenceStep]:
+    """Hold channels at each voltage in turn"""
+    return [SequenceStep(dwell, {channel: voltage for channel in channels}) for voltage in voltages]
+
+
+def staircase(channels: Sequence[int], start: float, end: float, count: int,
+              dwell: float) -> List[SequenceStep]:
+    """count equal steps from start to end, inclusive"""
+    if count < 2:
+        return setpoint_list(channels, [start], dwell)
+    voltages = [start + (end - start) * i / (count - 1) for i in range(count)]
+    return setpoint_list(channels, voltages, dwell)
+
+
+def repeated_ramp(channels: Sequence[int], start: float, end: float, steps: int,
+                  period: float, repeats: int) -> List[SequenceStep]:
+    """Restart a firmware ramp on every channel once per period"""
+    ramp = (start, end, steps, True)
+    return [SequenceStep(period, ramps={channel: ramp for channel in channels})
+            for _ in range(repeats)]
+
+
+def channel_staircases(starts: Sequence[float], ends: Sequence[float], steps: Sequence[int],
+                       dwell: float) -> List[SequenceStep]:
+    """Step every channel from its start to its end in its own number of steps
+
+    Channels with fewer steps hold their end value while the others finish.
+    """
+    count = max(steps) + 1
+    program = []
+    for i in range(count):
+        setpoints = {}
+        for channel, (start, end, channel_steps) in enumerate(zip(starts, ends, steps)):
+            fraction = min(i, channel_steps) / channel_steps
+            setpoints[channel] = start + (end - start) * fraction
+        program.append(SequenceStep(dwell, setpoints))
+    return program
+
+
+def load_program(path: str) -> Tuple[List[SequenceStep], int]:
+    """Read a JSON program; returns (steps, repeat)"""
+    with open(path) as f:
+        data = json.load(f)
+    try:
+        steps = [
+            SequenceStep(
+                float(step["dwell"]),
+                {int(ch) - 1: float(v) for ch, v in step.get("setpoints", {}).items()},
+                {int(ch) - 1: (float(r[0]), float(r[1]), int(r[2]), bool(r[3]))
+                 for ch, r in step.get("ramps", {}).items()},
+            )
+            for step in data["steps"]
+        ]
+    except (KeyError, TypeError, IndexError) as e:
+        raise ValueError(f"Invalid sequence program: {e}")
+    return steps, int(data.get("repeat", 1))
+
+
+class SequenceRunner:
+    # Timing
+    SPIN_NS = 1_000_000  # Busy-wait this long before a step instead of blocking
+
+    def __init__(self, transport, steps: Sequence[SequenceStep], repeat: int = 1,
+                 calibration=None, window: int = PipelinedUploader.WINDOW):
+        self.transport = transport
+        self.steps = list(steps)
+        self.repeat = max(1, repeat)
+        self.calibration = calibration
+        self.uploader = PipelinedUploader(transport, window=window)
+
+        # Callbacks, invoked from the runner thread
+        self.on_step: Optional[Callable[[int, SequenceStep], None]] = None
+        self.on_finished: Optional[Callable[[dict], None]] = None
+
+        # Per executed step: lateness and confirmation latency in ns
+        self.lateness_ns: List[int] = []
+        self.confirm_ns: List[Optional[int]] = []
+        self.failed_steps: List[int] = []
+        self.upload_stats: List[UploadStats] = []  # Per executed step
+
+        # Device state slot -> (packet, step) last sent by this run
+        self._sent: Dict[object, Tuple[bytes, int]] = {}
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Compile every step's packets, then start playing"""
+        # Encoding errors surface here rather than halfway through a run
+        self._packets = [step.packets(self.calibration) for step in self.steps]
+        self._sent = {}
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="SequenceRunner", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Abort the program; the current channel settings stay in place"""
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the program has finished; False on timeout"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return not self.running
+
+    def _wait_until(self, deadline_ns: int) -> bool:
+        """Wait for an absolute monotonic time; False if stopped first"""
+        remaining = deadline_ns - time.monotonic_ns()
+        if remaining > self.SPIN_NS:
+            if self._stop_event.wait((remaining - self.SPIN_NS) / 1e9):
+                return False
+        while time.monotonic_ns() < deadline_ns:
+            pass  # Waking from a blocking wait is too coarse for the last stretch
+        return not self._stop_event.is_set()
+
+    def _run(self):
+        start_ns = time.monotonic_ns()
+        offset_ns = 0
+        index = 0
+        for _ in range(self.repeat):
+            for step, packets in zip(self.steps, self._packets):
+                target_ns = start_ns + offset_ns
+                if not self._wait_until(target_ns):
+                    self._finish()
+                    return
+                sent_ns = time.monotonic_ns()
+                self._send(index, packets, sent_ns)
+                with self._lock:
+                    self.lateness_ns.append(sent_ns - target_ns)
+                if self.on_step:
+                    self.on_step(index, step)
+                offset_ns += int(step.dwell * 1e9)
+                index += 1
+
+        # Let the last step dwell before reporting the end
+        self._wait_until(start_ns + offset_ns)
+        self._finish()
+
+    def _send(self, index: int, packets, sent_ns: int):
+        """Pipeline a step's packets and record when they are confirmed"""
+        setpoints = len(self.steps[index % len(self.steps)].setpoints)
+        stats = UploadStats()
+        selected = []
+        keys = []
+        with self._lock:
+            self.confirm_ns.append(None)
+            self.upload_stats.append(stats)
+            for i, (packet, _) in enumerate(packets):
+                key = DeviceState.key(packet)
+                if i < setpoints:
+                    last = self._sent.get(key)
+                    if last is None:
+                        # Nothing sent by this run yet; compare with the board
+                        unchanged = self.transport.device_state.is_current(packet)
+                    else:
+                        unchanged = last[0] == bytes(packet)
+                    if unchanged:
+                        stats.skipped += 1
+                        continue
+                self._sent[key] = (bytes(packet), index)
+                selected.append(packets[i])
+                keys.append(key)
+
+        def superseded(i: int) -> bool:
+            with self._lock:
+                return self._sent.get(keys[i], (None, None))[1] != index
+
+        def on_done(future):
+            failed = future.result()
+            with self._lock:
+                self.confirm_ns[index] = time.monotonic_ns() - sent_ns
+                if failed:
+                    self.failed_steps.append(index)
+                for i in failed:
+                    # The board may not have it; let the next step send it again
+                    if self._sent.get(keys[i], (None, None))[1] == index:
+                        del self._sent[keys[i]]
+
+        self.uploader.upload(selected, superseded=superseded, stats=stats).add_done_callback(on_done)
+
+    def _finish(self):
+        report = self.report()
+        log.info("Sequence finished: %d steps, lateness mean %.1f us, max %.1f us",
+                 report["steps"], report["lateness_mean_us"], report["lateness_max_us"])
+        if self.on_finished:
+            self.on_finished(report)
+
+    def report(self) -> dict:
+        """Timing summary of the steps executed so far"""
+        with self._lock:
+            lateness = sorted(self.lateness_ns)
+            confirmed = sorted(c for c in self.confirm_ns if c is not None)
+            failed = list(self.failed_steps)
+            uploads = list(self.upload_stats)
+
+        def percentile(values, fraction):
+            return values[min(len(values) - 1, int(fraction * len(values)))] / 1000 if values else 0.0
+
+        return {
+            "steps": len(lateness),
+            "failed_steps": failed,
+            "lateness_mean_us": sum(lateness) / len(lateness) / 1000 if lateness else 0.0,
+            "lateness_p99_us": percentile(lateness, 0.99),
+            "lateness_max_us": lateness[-1] / 1000 if lateness else 0.0,
+            "confirm_p50_us": percentile(confirmed, 0.5),
+            "confirm_max_us": confirmed[-1] / 1000 if confirmed else 0.0,
+            "retransmissions": sum(stats.retransmissions for stats in uploads),
+            "skipped_packets": sum(stats.skipped for stats in uploads),
+            "superseded_packets": sum(stats.superseded for stats in uploads),
+        }
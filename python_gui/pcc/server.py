@@ -0,0 +1,545 @@
+"""
+Server - One board shared by several local clients over TCP or a Unix socket
+
+TelemetryServer owns the SerialTransport of a board and serves clients from
+an asyncio event loop. Every message, in both directions, is
+
+    header   MESSAGE_STRUCT: payload length (u32), message type (u8)
+    payload  MSG_REQUEST, MSG_RESPONSE: UTF-8 JSON object
+             MSG_FRAMES: FRAMES_STRUCT (sequence of the first row, receive
+             time in ns, row count, channel count, rows dropped for this
+             client so far) followed by the little-endian raw DAC codes of
+             every row
+
+Requests are {"id": n, "op": name, ...} and are answered with {"id": n,
+"ok": true, "result": ...} or {"id": n, "ok": false, "type": exception name,
+"error": text}, not necessarily in order. Telemetry is only sent after a
+"subscribe" request. Rows are numbered from the start of the server, so a
+client sees the rows it lost as gaps in the sequence.
+
+Frames are handed over by the acquisition thread without ever blocking it.
+Each subscriber has a bounded queue with a drop policy: a client that reads
+too slowly only loses its own data (or its connection).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+
+from . import protocol
+from .transport import SerialTransport
+from .uploader import PipelinedUploader
+
+log = logging.getLogger(__name__)
+
+MSG_REQUEST = 1
+MSG_RESPONSE = 2
+MSG_FRAMES = 3
+
+# Payload length, message type
+MESSAGE_STRUCT = struct.Struct('<IB')
+# First row sequence, time_ns, rows, channels, rows dropped so far
+FRAMES_STRUCT = struct.Struct('<QQIHQ')
+MAX_REQUEST_SIZE = 1 << 20
+
+# What happens to a batch of rows that doesn't fit in a subscriber's queue
+DROP_OLDEST = "drop_oldest"  # Discard the oldest queued batch
+DROP_NEWEST = "drop_newest"  # Discard the new batch
+DISCONNECT = "disconnect"  # Close the client's connection
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+
+def parse_address(address: str) -> Tuple[Optional[str], Optional[int], Optional[str]]:
+    """(host, port, path) of "HOST:PORT", ":PORT" or "unix:PATH" """
+    if address.startswith("unix:"):
+        return None, None, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    try:
+        return host or "127.0.0.1", int(port), None
+    except ValueError:
+        raise ValueError(f"Invalid address {address!r}, expected HOST:PORT or unix:PATH")
+
+
+def pack_message(message_type: int, payload: bytes) -> bytes:
+    return MESSAGE_STRUCT.pack(len(payload), message_type) + payload
+
+
+async def read_message(reader: asyncio.StreamReader,
+                       max_size: Optional[int] = None) -> Tuple[int, bytes]:
+    """Next (message type, payload); raises IncompleteReadError at EOF"""
+    length, message_type = MESSAGE_STRUCT.unpack(await reader.readexactly(MESSAGE_STRUCT.size))
+    if max_size is not None and length > max_size:
+        raise ValueError(f"Message of {length} bytes is too large")
+    return message_type, await reader.readexactly(length)
+
+
+def frames_to_codes(frames: List[bytes], num_channels: int = protocol.NUM_CHANNELS) -> bytes:
+    """Raw readings of a batch of frames of one size, row after row"""
+    size = len(frames[0])
+    raw = np.ndarray(
+        shape=(len(frames), num_channels),
+        dtype='<u2',
+        buffer=b''.join(frames),
+        offset=protocol.payload_offset(size),
+        strides=(size, 2)
+    )
+    return raw.tobytes()
+
+
+class Batch(NamedTuple):
+    sequence: int  # Server-wide index of the first row
+    time_ns: int  # Host monotonic receive time
+    rows: int
+    codes: bytes  # rows x channels little-endian u16
+
+
+class ClientSession:
+    # Defaults
+    QUEUE_SIZE = 256  # Batches a subscriber may have queued
+
+    def __init__(self, server: "TelemetryServer", reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.peer = writer.get_extra_info("peername") or "unix socket"
+
+        # Responses are never dropped; telemetry goes through a bounded queue
+        self.responses: Deque[bytes] = deque()
+        self.batches: Deque[Batch] = deque()
+        self.subscribed = False
+        self.queue_size = self.QUEUE_SIZE
+        self.policy = DROP_OLDEST
+        self.closing = False
+        self._wake = asyncio.Event()
+        self._requests = set()  # Running request tasks, kept referenced until done
+
+        # Statistics
+        self.rows_sent = 0
+        self.rows_dropped = 0
+
+    def subscribe(self, queue_size: int, policy: str):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Drop policy must be one of {', '.join(DROP_POLICIES)}")
+        if queue_size < 1:
+            raise ValueError("Queue size must be at least 1")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.subscribed = True
+
+    def unsubscribe(self):
+        self.subscribed = False
+        self.rows_dropped += sum(batch.rows for batch in self.batches)
+        self.batches.clear()
+
+    def offer(self, batch: Batch):
+        """Queue a batch of rows, applying the drop policy when full (event loop)"""
+        if len(self.batches) >= self.queue_size:
+            if self.policy == DROP_NEWEST:
+                self.rows_dropped += batch.rows
+                return
+            if self.policy == DISCONNECT:
+                log.info("Disconnecting %s: %d batches behind", self.peer, len(self.batches))
+                self.close()
+                return
+            self.rows_dropped += self.batches.popleft().rows
+        self.batches.append(batch)
+        self._wake.set()
+
+    def respond(self, response: Dict[str, Any]):
+        self.responses.append(pack_message(MSG_RESPONSE, json.dumps(response).encode('utf-8')))
+        self._wake.set()
+
+    def close(self):
+        """End the session, discarding anything the socket hasn't sent yet"""
+        self.closing = True
+        self._wake.set()
+        # Also wakes a write_loop waiting in drain() on a stalled client
+        self.writer.transport.abort()
+
+    async def write_loop(self):
+        """Send queued responses first, then telemetry, at the client's pace"""
+        writer = self.writer
+        channels = self.server.num_channels
+        while not self.closing:
+            await self._wake.wait()
+            self._wake.clear()
+            while (self.responses or self.batches) and not self.closing:
+                if self.responses:
+                    writer.write(self.responses.popleft())
+                else:
+                    batch = self.batches.popleft()
+                    header = FRAMES_STRUCT.pack(batch.sequence, batch.time_ns, batch.rows,
+                                                channels, self.rows_dropped)
+                    writer.write(MESSAGE_STRUCT.pack(len(header) + len(batch.codes), MSG_FRAMES))
+                    writer.write(header)
+                    writer.write(batch.codes)
+                    self.rows_sent += batch.rows
+                # Only this client waits when its socket buffer is full; the
+                # queue keeps filling (and dropping) in the meantime
+                await writer.drain()
+
+    async def read_loop(self):
+        while not self.closing:
+            message_type, payload = await read_message(self.reader, MAX_REQUEST_SIZE)
+            if message_type != MSG_REQUEST:
+                raise ValueError(f"Unexpected message type {message_type}")
+            request = json.loads(payload)
+            # Requests may wait for the board, so later ones don't queue behind them
+            task = asyncio.ensure_future(self.server.handle_request(self, request))
+            self._requests.add(task)
+            task.add_done_callback(self._requests.discard)
+
+
+class TelemetryServer:
+    # Defaults
+    QUEUE_SIZE = ClientSession.QUEUE_SIZE
+    INCOMING_BATCHES = 4096  # Batches held for the event loop before the oldest is dropped
+    CONFIRM_TIMEOUT = 5.0  # Seconds to wait for the echoes of a request
+
+    def __init__(self, transport: SerialTransport, num_channels: int = protocol.NUM_CHANNELS,
+                 max_voltage: float = protocol.MAX_VOLTAGE, calibration=None):
+        """
+        Args:
+            transport: Connected transport of the board; its acquisition
+                thread must be running
+            calibration: Optional pcc.calibration.Calibration applied to
+                channel configurations (telemetry is sent raw)
+        """
+        self.transport = transport
+        self.uploader = PipelinedUploader(transport)
+        self.num_channels = num_channels
+        self.max_voltage = max_voltage
+        self.calibration = calibration
+        self.clients: List[ClientSession] = []
+        self.frame_format = protocol.FRAME_LEGACY
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._servers: List[asyncio.AbstractServer] = []
+        self._lock = threading.Lock()
+        self._incoming: Deque[Batch] = deque(maxlen=self.INCOMING_BATCHES)
+        self._notified = False
+        self._sessions = set()  # Tasks serving a client
+
+        # Statistics
+        self.rows_received = 0
+        self.batches_overflowed = 0  # Lost because the event loop fell behind
+
+        self.ops: Dict[str, Callable] = {
+            "info": self._op_info,
+            "stats": self._op_stats,
+            "config": self._op_config,
+            "frequency": self._op_frequency,
+            "frame_format": self._op_frame_format,
+            "start": self._op_start,
+            "stop": self._op_stop,
+            "subscribe": self._op_subscribe,
+            "unsubscribe": self._op_unsubscribe,
+        }
+
+    async def start(self, address: str):
+        """Listen on "HOST:PORT" or "unix:PATH"; may be called for several addresses"""
+        self._loop = asyncio.get_running_loop()
+        host, port, path = parse_address(address)
+        if path is not None:
+            if os.path.exists(path):
+                os.unlink(path)  # Left over from a server that didn't exit cleanly
+            server = await asyncio.start_unix_server(self._serve_client, path)
+        else:
+            server = await asyncio.start_server(self._serve_client, host, port)
+        if not self._servers and not self.transport.add_frame_listener(self._on_frames):
+            server.close()
+            raise ValueError("The server needs a transport that decodes frames in this process")
+        self._servers.append(server)
+        log.info("Serving on %s", address)
+        return server
+
+    async def close(self):
+        """Stop listening and disconnect every client"""
+        self.transport.remove_frame_listener(self._on_frames)
+        for server in self._servers:
+            server.close()
+        for client in list(self.clients):
+            client.close()
+        await asyncio.gather(*self._sessions, return_exceptions=True)
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+
+    @property
+    def addresses(self) -> List[str]:
+        """Addresses the server listens on, with the actual port numbers"""
+        addresses = []
+        for server in self._servers:
+            for sock in server.sockets:
+                name = sock.getsockname()
+                addresses.append(f"unix:{name}" if isinstance(name, str) else f"{name[0]}:{name[1]}")
+        return addresses
+
+    def _on_frames(self, frames: List[bytes], time_ns: int):
+        """Frame listener; runs on the acquisition thread and never blocks"""
+        codes = frames_to_codes(frames, self.num_channels)
+        with self._lock:
+            if len(self._incoming) == self._incoming.maxlen:
+                self.batches_overflowed += 1
+            self._incoming.append(Batch(self.rows_received, time_ns, len(frames), codes))
+            self.rows_received += len(frames)
+            if self._notified:
+                return
+            self._notified = True
+        # One wakeup per burst of batches, not per batch
+        try:
+            self._loop.call_soon_threadsafe(self._publish)
+        except RuntimeError:
+            pass  # Event loop already closed
+
+    def _publish(self):
+        """Fan new batches out to the subscribers (event loop)"""
+        with self._lock:
+            batches = list(self._incoming)
+            self._incoming.clear()
+            self._notified = False
+        subscribers = [client for client in self.clients if client.subscribed and not client.closing]
+        for batch in batches:
+            for client in subscribers:
+                client.offer(batch)
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = ClientSession(self, reader, writer)
+        self.clients.append(client)
+        session = asyncio.current_task()
+        self._sessions.add(session)
+        log.info("Client %s connected", client.peer)
+        writer_task = asyncio.ensure_future(client.write_loop())
+        reader_task = asyncio.ensure_future(client.read_loop())
+        try:
+            # Whichever ends first (EOF, a protocol error or close()) ends the session
+            done, _ = await asyncio.wait([writer_task, reader_task],
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is not None and not isinstance(error, (asyncio.IncompleteReadError,
+                                                                ConnectionError)):
+                    log.warning("Client %s: %s", client.peer, error)
+        finally:
+            client.close()
+            reader_task.cancel()
+            writer_task.cancel()
+            self.clients.remove(client)
+            self._sessions.discard(session)
+            writer.close()
+            log.info("Client %s disconnected (%d rows sent, %d dropped)",
+                     client.peer, client.rows_sent, client.rows_dropped)
+
+    async def handle_request(self, client: ClientSession, request: Dict[str, Any]):
+        request_id = request.get("id")
+        try:
+            op = self.ops.get(request.get("op"))
+            if op is None:
+                raise ValueError(f"Unknown op {request.get('op')!r}")
+            result = await op(client, request)
+            response = {"id": request_id, "ok": True, "result": result}
+        except KeyError as e:
+            response = {"id": request_id, "ok": False, "type": "ValueError",
+                        "error": f"Missing field {e.args[0]!r}"}
+        except Exception as e:
+            response = {"id": request_id, "ok": False, "type": type(e).__name__, "error": str(e)}
+        client.respond(response)
+
+    async def _confirm(self, packet: List[int], description: str):
+        """Send a command and wait for its echo"""
+        future = self.transport.send_command(packet, description)
+        await asyncio.wait_for(asyncio.wrap_future(future), self.CONFIRM_TIMEOUT)
+
+    async def _op_info(self, client, request):
+        return {
+            "channels": self.num_channels,
+            "max_voltage": self.max_voltage,
+            "scale": self.max_voltage / protocol.DAC_FULL_SCALE,
+            "frame_format": self.frame_format,
+            "connected": self.transport.is_connected(),
+        }
+
+    async def _op_stats(self, client, request):
+        return {
+            "decoder": self.transport.decoder.counters(),
+            "rows_received": self.rows_received,
+            "batches_overflowed": self.batches_overflowed,
+            "clients": len(self.clients),
+            "subscribers": sum(c.subscribed for c in self.clients),
+            "rows_sent": client.rows_sent,
+            "rows_dropped": client.rows_dropped,
+            "queued": len(client.batches),
+        }
+
+    async def _op_config(self, client, request):
+        """Upload {"channels": [{"channel", "start", "end", "steps", "hold"}]}
+
+        Channels are numbered from 1. Returns the channels that were not
+        confirmed.
+        """
+        configs = request.get("channels") or []
+        packets = []
+        for config in configs:
+            channel = int(config["channel"]) - 1
+            if not 0 <= channel < self.num_channels:
+                raise ValueError(f"Channel must be between 1 and {self.num_channels}")
+            packet = protocol.channel_config_packet(
+                channel, float(config["start"]), float(config.get("end", config["start"])),
+                int(config.get("steps", 1)), bool(config.get("hold", False)), self.calibration
+            )
+            packets.append((packet, f"Channel {channel + 1}"))
+        future = self.uploader.upload(packets, only_changed=bool(request.get("only_changed", False)))
+        failed = await asyncio.wait_for(asyncio.wrap_future(future), self.CONFIRM_TIMEOUT)
+        return {"failed": [int(configs[i]["channel"]) for i in failed],
+                "skipped": self.uploader.skipped}
+
+    async def _op_frequency(self, client, request):
+        frequency = int(request["frequency"])
+        await self._confirm(protocol.frequency_packet(frequency), f"Frequency ({frequency} Hz)")
+
+    async def _op_frame_format(self, client, request):
+        frame_format = int(request["format"])
+        future = self.transport.set_frame_format(frame_format)
+        await asyncio.wait_for(asyncio.wrap_future(future), self.CONFIRM_TIMEOUT)
+        self.frame_format = frame_format
+
+    async def _op_start(self, client, request):
+        await self._confirm(protocol.start_packet(), "Start monitoring")
+
+    async def _op_stop(self, client, request):
+        await self._confirm(protocol.stop_packet(), "Stop monitoring")
+
+    async def _op_subscribe(self, client, request):
+        client.subscribe(int(request.get("queue", self.QUEUE_SIZE)),
+                         request.get("policy", DROP_OLDEST))
+        return {"sequence": self.rows_received, "channels": self.num_channels}
+
+    async def _op_unsubscribe(self, client, request):
+        client.unsubscribe()
+
+
+class FrameBatch(NamedTuple):
+    sequence: int  # Server-wide index of the first row
+    time_ns: int  # Server monotonic receive time
+    raw: np.ndarray  # (rows, channels) uint16 DAC codes
+    dropped: int  # Rows the server dropped for this client so far
+
+
+class TelemetryClient:
+    # Defaults
+    QUEUE_SIZE = 64  # Batches buffered before the client stops reading the socket
+
+    def __init__(self, queue_size: int = QUEUE_SIZE):
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self._next_id = 0
+        self._pending: Dict[int, asyncio.Future] = {}
+        # Bounded, so a slow consumer pushes back on the server, whose drop
+        # policy then applies
+        self._batches: "asyncio.Queue[Optional[FrameBatch]]" = asyncio.Queue(queue_size)
+        self._read_task: Optional[asyncio.Task] = None
+
+    async def connect(self, address: str):
+        host, port, path = parse_address(address)
+        if path is not None:
+            self.reader, self.writer = await asyncio.open_unix_connection(path)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(host, port)
+        self._read_task = asyncio.ensure_future(self._read_loop())
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        if self._read_task is not None:
+            self._read_task.cancel()
+
+    async def request(self, op: str, **params) -> Any:
+        """Send a request and return its result
+
+        Raises:
+            TimeoutError: The board didn't confirm the command
+            ValueError: The server rejected the request
+            RuntimeError: Any other failure reported by the server
+            ConnectionError: The connection was closed
+        """
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        payload = json.dumps({"id": request_id, "op": op, **params}).encode('utf-8')
+        self.writer.write(pack_message(MSG_REQUEST, payload))
+        await self.writer.drain()
+        return await future
+
+    async def subscribe(self, queue: Optional[int] = None, policy: str = DROP_OLDEST) -> Dict[str, int]:
+        params = {"policy": policy}
+        if queue is not None:
+            params["queue"] = queue
+        return await self.request("subscribe", **params)
+
+    async def batches(self) -> AsyncIterator[FrameBatch]:
+        """Telemetry batches until the connection closes"""
+        while True:
+            batch = await self._batches.get()
+            if batch is None:
+                return
+            yield batch
+
+    async def _read_loop(self):
+        try:
+            while True:
+                message_type, payload = await read_message(self.reader)
+                if message_type == MSG_FRAMES:
+                    sequence, time_ns, rows, channels, dropped = FRAMES_STRUCT.unpack_from(payload)
+                    raw = np.frombuffer(payload, dtype='<u2', offset=FRAMES_STRUCT.size)
+                    await self._batches.put(FrameBatch(sequence, time_ns,
+                                                       raw.reshape(rows, channels), dropped))
+                elif message_type == MSG_RESPONSE:
+                    self._resolve(json.loads(payload))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection to the server closed"))
+            self._pending.clear()
+            await self._batches.put(None)
+
+    def _resolve(self, response: Dict[str, Any]):
+        future = self._pending.pop(response.get("id"), None)
+        if future is None or future.done():
+            return
+        if response.get("ok"):
+            future.set_result(response.get("result"))
+            return
+        error_type = {"TimeoutError": TimeoutError,
+                      "ValueError": ValueError}.get(response.get("type"), RuntimeError)
+        future.set_exception(error_type(response.get("error")))
+
+
+async def serve(transport: SerialTransport, addresses: List[str], calibration=None,
+                duration: Optional[float] = None, on_ready: Optional[Callable[[List[str]], None]] = None):
+    """Run a server until cancelled or for duration seconds (used by the CLI)"""
+    server = TelemetryServer(transport, calibration=calibration)
+    for address in addresses:
+        await server.start(address)
+    if on_ready:
+        on_ready(server.addresses)
+    try:
+        if duration:
+            await asyncio.sleep(duration)
+        else:
+            await asyncio.Event().wait()
+    finally:
+        await server.close()
@@ -0,0 +1,568 @@
+"""
+Shared - Acquisition in a separate process with a shared-memory telemetry ring
+
+ProcessTransport stands in for SerialTransport: a child process owns the
+serial port, decodes telemetry and writes the raw readings of every frame
+into a SharedRing. Serial reads and decoding then never wait for the GIL of
+the process that draws the plots, and any number of viewers can attach to
+the same ring by name.
+
+Ring layout (native byte order, in one multiprocessing.shared_memory block):
+
+    header   HEADER_FIELDS u64: magic, capacity, channel count, write
+             sequence (rows ever written), writer pid, writer heartbeat
+             (monotonic ns), the decoder counters of the writer and the
+             claimed sequence (rows the writer has started to write)
+    times    capacity x int64 host monotonic receive time in ns
+    raw      capacity x channels x uint16 DAC codes
+
+Row n lives in slot n % capacity. The writer claims the slots of a batch,
+fills them and then publishes them by advancing the write sequence. A reader
+takes zero-copy views of the rows up to the published sequence and, once
+done with them, checks against the claimed sequence that the writer hasn't
+come round again and started to overwrite them. When the ring is given a
+multiprocessing lock, both sequences are stored and loaded under it, whose
+barriers order them with the rows. Without one the ring relies on stores
+and loads becoming visible in program order, which only holds on x86, so
+elsewhere a ring can only be opened with its writer's lock.
+
+Commands go to the child over a Pipe; their futures resolve when the
+board's echo reaches the child, as with SerialTransport.send_command.
+"""
+
+import contextlib
+import itertools
+import logging
+import multiprocessing
+import os
+import platform
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from . import protocol
+from .decoder import FrameDecoder
+from .trace import HexDump
+from .transport import SerialTransport
+
+log = logging.getLogger(__name__)
+
+MAGIC = int.from_bytes(b'PCCRING1', 'little')
+
+# Header fields
+HEADER_FIELDS = 16
+MAGIC_FIELD = 0
+CAPACITY_FIELD = 1
+CHANNELS_FIELD = 2
+SEQUENCE_FIELD = 3
+PID_FIELD = 4
+HEARTBEAT_FIELD = 5
+# Decoder counters, in the order of FrameDecoder.counters()
+COUNTER_FIELDS = {
+    "frames_decoded": 6,
+    "frames_dropped": 7,
+    "bytes_dropped": 8,
+    "resyncs": 9,
+    "crc_failures": 10,
+    "sequence_gaps": 11,
+}
+CLAIM_FIELD = 12
+
+# Processors whose memory model keeps stores and loads in program order
+ORDERED_MACHINES = {"x86_64", "amd64", "i386", "i686", "x86"}
+
+
+def _check_ordering(lock):
+    """Refuse lock-free access where the processor may reorder memory accesses"""
+    if lock is None and platform.machine().lower() not in ORDERED_MACHINES:
+        raise ValueError(f"A telemetry ring needs its writer's lock on {platform.machine()}")
+
+
+def _attach_memory(name: str, untrack: bool) -> SharedMemory:
+    """Open an existing block without letting this process's exit remove it"""
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block for removal at exit
+        shm = SharedMemory(name=name)
+        if untrack and os.name == "posix":
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class SharedRing:
+    # Defaults
+    CAPACITY = 1 << 16  # Rows; about 3 s at 20k frames/s
+
+    def __init__(self, shm: SharedMemory, owner: bool, lock=None):
+        self.shm = shm
+        self.owner = owner
+        # Orders the sequences with the rows; see the module docstring
+        self._fence = lock if lock is not None else contextlib.nullcontext()
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.uint64, buffer=shm.buf)
+        if int(self.header[MAGIC_FIELD]) != MAGIC:
+            shm.close()
+            raise ValueError(f"{shm.name} is not a telemetry ring")
+        self.capacity = int(self.header[CAPACITY_FIELD])
+        self.num_channels = int(self.header[CHANNELS_FIELD])
+        offset = HEADER_FIELDS * 8
+        self.times = np.ndarray((self.capacity,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self.capacity * 8
+        self.raw = np.ndarray((self.capacity, self.num_channels), dtype=np.uint16,
+                              buffer=shm.buf, offset=offset)
+
+    @classmethod
+    def create(cls, capacity: int = CAPACITY, num_channels: int = protocol.NUM_CHANNELS,
+               name: Optional[str] = None, lock=None) -> "SharedRing":
+        """Allocate a new ring; the creator removes it in close()
+
+        Args:
+            lock: multiprocessing lock shared with the writer and readers
+        """
+        _check_ordering(lock)
+        size = HEADER_FIELDS * 8 + capacity * 8 + capacity * num_channels * 2
+        shm = SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.uint64, buffer=shm.buf)
+        header[:] = 0
+        header[CAPACITY_FIELD] = capacity
+        header[CHANNELS_FIELD] = num_channels
+        header[MAGIC_FIELD] = MAGIC  # Last, so a half-initialised ring is rejected
+        del header
+        return cls(shm, owner=True, lock=lock)
+
+    @classmethod
+    def attach(cls, name: str, untrack: bool = True, lock=None) -> "SharedRing":
+        """Map an existing ring by name
+
+        Args:
+            untrack: Keep the ring when this process exits. Pass False in
+                processes started by the ring's creator through
+                multiprocessing, which share its resource tracker.
+            lock: The lock the ring was created with, if any
+        """
+        _check_ordering(lock)
+        return cls(_attach_memory(name, untrack), owner=False, lock=lock)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def sequence(self) -> int:
+        """Rows written since the ring was created"""
+        with self._fence:
+            return int(self.header[SEQUENCE_FIELD])
+
+    @property
+    def claimed(self) -> int:
+        """Rows the writer has started to write, at least sequence"""
+        with self._fence:
+            return int(self.header[CLAIM_FIELD])
+
+    def counters(self) -> Dict[str, int]:
+        """Decoder counters of the writer"""
+        return {name: int(self.header[field]) for name, field in COUNTER_FIELDS.items()}
+
+    def writer_alive(self, timeout: float = 2.0) -> bool:
+        """True if the writer has updated its heartbeat within timeout seconds"""
+        heartbeat = int(self.header[HEARTBEAT_FIELD])
+        return heartbeat != 0 and time.monotonic_ns() - heartbeat < timeout * 1e9
+
+    def write_frames(self, frames: List[bytes], time_ns: int):
+        """Append the readings of a batch of frames received at time_ns (writer only)"""
+        count = len(frames)
+        if count == 0:
+            return
+        size = len(frames[0])
+        data = b''.join(frames)
+        raw = np.ndarray(
+            shape=(count, self.num_channels),
+            dtype='<u2',
+            buffer=data,
+            offset=protocol.payload_offset(size),
+            strides=(size, 2)
+        )
+        sequence = int(self.header[SEQUENCE_FIELD])
+        end = sequence + count
+        if count > self.capacity:
+            # Only the newest rows fit; the others still count as written
+            raw = raw[-self.capacity:]
+            count = self.capacity
+
+        # Readers of the rows about to be overwritten must see the claim first
+        with self._fence:
+            self.header[CLAIM_FIELD] = end
+        start = (end - count) % self.capacity
+        first = min(count, self.capacity - start)
+        self.raw[start:start + first] = raw[:first]
+        self.times[start:start + first] = time_ns
+        if first < count:
+            # Wrap around to the beginning
+            self.raw[:count - first] = raw[first:]
+            self.times[:count - first] = time_ns
+        # Publish the rows only once they are complete
+        with self._fence:
+            self.header[SEQUENCE_FIELD] = end
+
+    def update_status(self, counters: Dict[str, int]):
+        """Store the writer's heartbeat and decoder counters (writer only)"""
+        for name, field in COUNTER_FIELDS.items():
+            self.header[field] = counters[name]
+        self.header[PID_FIELD] = os.getpid()
+        self.header[HEARTBEAT_FIELD] = time.monotonic_ns()
+
+    def close(self):
+        """Unmap the ring; the creator also removes it"""
+        # Views into the buffer must be gone before it can be closed
+        self.header = self.times = self.raw = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RingReader:
+    # Defaults
+    SLACK = 1024  # Rows kept clear of the writer when catching up after an overrun
+
+    def __init__(self, ring: SharedRing, from_start: bool = False):
+        """
+        Args:
+            ring: Ring to read
+            from_start: Also return the rows already in the ring
+        """
+        self.ring = ring
+        sequence = ring.sequence
+        self.position = max(0, sequence - ring.capacity) if from_start else sequence
+        self._last_start = self.position
+
+        # Statistics
+        self.rows_read = 0
+        self.rows_lost = 0  # Rows overwritten before they were read
+
+    def read(self, max_rows: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Zero-copy (times_ns, raw) views of the next unread rows
+
+        Rows are returned up to the end of the ring buffer, so a wrapped
+        range takes two calls; an empty result means no new rows. The views
+        are only safe to use until intact() returns False.
+        """
+        ring = self.ring
+        capacity = ring.capacity
+        sequence = ring.sequence
+        if sequence - self.position > capacity:
+            # Lapped by the writer: skip to rows it won't overwrite right away
+            skip_to = sequence - capacity + min(self.SLACK, capacity // 2)
+            self.rows_lost += skip_to - self.position
+            self.position = skip_to
+
+        start = self.position % capacity
+        count = min(sequence - self.position, capacity - start)
+        if max_rows is not None:
+            count = min(count, max_rows)
+        self._last_start = self.position
+        self.position += count
+        self.rows_read += count
+        return ring.times[start:start + count], ring.raw[start:start + count]
+
+    def intact(self) -> bool:
+        """True if the rows from the last read haven't been overwritten since"""
+        if self.ring.claimed - self._last_start <= self.ring.capacity:
+            return True
+        lost = self.position - self._last_start
+        self.rows_lost += lost
+        self.rows_read -= lost
+        return False
+
+    @property
+    def behind(self) -> int:
+        """Rows published but not read yet"""
+        return self.ring.sequence - self.position
+
+
+class RingCounters:
+    """Decoder counters of the acquisition process, read from the ring header
+
+    Stands in for SerialTransport.decoder where only counters are used.
+    """
+
+    def __init__(self, ring: SharedRing):
+        self._ring = ring
+
+    def __getattr__(self, name: str) -> int:
+        try:
+            field = COUNTER_FIELDS[name]
+        except KeyError:
+            raise AttributeError(name)
+        return int(self._ring.header[field])
+
+    def counters(self) -> Dict[str, int]:
+        return self._ring.counters()
+
+
+def acquisition_main(port: str, baudrate: int, ring_name: str, conn, lock=None):
+    """Entry point of the acquisition process
+
+    Owns the serial port, writes telemetry into the ring and serves
+    ("command", id, packet, description, timeout), ("packet", packet,
+    description), ("trace", path or None) and ("stop",) messages from conn.
+    """
+    from .trace import configure_logging
+
+    configure_logging()
+    ring = SharedRing.attach(ring_name, untrack=False, lock=lock)
+    transport = SerialTransport()
+    send_lock = threading.Lock()
+
+    def reply(message):
+        with send_lock:
+            try:
+                conn.send(message)
+            except (OSError, EOFError):
+                pass  # Parent is gone; the main loop notices too
+
+    def on_frames(frames, time_ns):
+        ring.write_frames(frames, time_ns)
+        ring.update_status(transport.decoder.counters())
+
+    transport.add_frame_listener(on_frames)
+    if not transport.connect(port, baudrate):
+        reply(("connected", False))
+        ring.close()
+        return
+    ring.update_status(transport.decoder.counters())
+    reply(("connected", True))
+
+    try:
+        while True:
+            try:
+                if not conn.poll(0.1):
+                    ring.update_status(transport.decoder.counters())
+                    if not transport.is_connected():
+                        break
+                    continue
+                message = conn.recv()
+            except (OSError, EOFError):
+                break  # Parent exited without stopping us
+
+            kind = message[0]
+            if kind == "command":
+                _, command_id, packet, description, timeout = message
+                future = transport.send_command(packet, description, timeout)
+
+                def on_done(done, command_id=command_id):
+                    error = done.exception()
+                    reply(("done", command_id,
+                           None if error is None else (type(error).__name__, str(error))))
+
+                future.add_done_callback(on_done)
+            elif kind == "packet":
+                transport.send_packet(message[1], message[2])
+            elif kind == "trace":
+                if message[1]:
+                    transport.start_trace(message[1])
+                else:
+                    transport.stop_trace()
+            elif kind == "stop":
+                break
+    finally:
+        transport.disconnect()
+        ring.close()
+
+
+class ProcessTransport(SerialTransport):
+    """SerialTransport whose port is read by a separate acquisition process
+
+    Commands, device state and callbacks work as in SerialTransport, except
+    that on_data_received and on_frames_received are never called and
+    add_frame_listener returns False: telemetry is read from the ring, see
+    RingReader.
+    """
+
+    # Defaults
+    CONNECT_TIMEOUT = 10.0  # Seconds for the child to start and open the port
+
+    def __init__(self, capacity: int = SharedRing.CAPACITY):
+        super().__init__()
+        self.capacity = capacity
+        self.ring: Optional[SharedRing] = None
+        self.process: Optional[multiprocessing.Process] = None
+        self.port: Optional[str] = None
+        self._conn = None
+        self._send_lock = threading.Lock()
+        self._commands: Dict[int, Tuple[Future, List[int], int]] = {}
+        self._ids = itertools.count()
+        self._reply_thread: Optional[threading.Thread] = None
+
+    def connect(self, port: str, baudrate: int = 115200) -> bool:
+        """Start the acquisition process on port and wait until it is open"""
+        self.disconnect()
+        context = multiprocessing.get_context("spawn")  # Forking a Qt process isn't safe
+        parent_conn, child_conn = context.Pipe()
+        lock = context.Lock()
+        ring = SharedRing.create(self.capacity, lock=lock)
+        process = context.Process(target=acquisition_main, name="PCCAcquisition",
+                                  args=(port, baudrate, ring.name, child_conn, lock), daemon=True)
+        process.start()
+        child_conn.close()
+
+        connected = False
+        if parent_conn.poll(self.CONNECT_TIMEOUT):
+            try:
+                connected = parent_conn.recv() == ("connected", True)
+            except EOFError:
+                pass
+        if not connected:
+            log.error("Failed to connect to %s", port)
+            process.join(1.0)
+            if process.is_alive():
+                process.terminate()
+            parent_conn.close()
+            ring.close()
+            if self.on_connection_changed:
+                self.on_connection_changed(False, port)
+            return False
+
+        self.ring = ring
+        self.process = process
+        self.port = port
+        self._conn = parent_conn
+        self.decoder = RingCounters(ring)
+        self.device_state.invalidate()
+        self._reply_thread = threading.Thread(target=self._reply_loop, name="AcquisitionReplies",
+                                              daemon=True)
+        self._reply_thread.start()
+        log.info("Connected to %s at %d baud in process %d, ring %s",
+                 port, baudrate, process.pid, ring.name)
+        if self.on_connection_changed:
+            self.on_connection_changed(True, port)
+        return True
+
+    def disconnect(self):
+        """Stop the acquisition process and remove the ring"""
+        if self.process is None:
+            return
+        self._send(("stop",))
+        self.process.join(2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self._conn.close()
+        if self._reply_thread is not threading.current_thread():
+            self._reply_thread.join(1.0)
+        self._fail_all(ConnectionError("Serial port disconnected"))
+
+        # Keep the final counters for anyone still looking at them
+        counters = self.ring.counters()
+        self.decoder = FrameDecoder()
+        for name, value in counters.items():
+            setattr(self.decoder, name, value)
+        self.ring.close()
+        self.ring = None
+        self.process = None
+        self._conn = None
+        log.info("Disconnected from serial port")
+        if self.on_connection_changed:
+            self.on_connection_changed(False, self.port)
+
+    def is_connected(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def _send(self, message) -> bool:
+        with self._send_lock:
+            try:
+                self._conn.send(message)
+                return True
+            except (OSError, EOFError, AttributeError):
+                return False
+
+    def _reply_loop(self):
+        """Resolve command futures as the child reports echoes"""
+        conn = self._conn
+        while True:
+            try:
+                message = conn.recv()
+            except (OSError, EOFError):
+                break
+            if message[0] != "done":
+                continue
+            _, command_id, error = message
+            with self._command_lock:
+                entry = self._commands.pop(command_id, None)
+            if entry is None:
+                continue
+            future, packet, generation = entry
+            if error is None:
+                self.device_state.acknowledge(packet, generation)
+                future.set_result(bytes(packet))
+            else:
+                # Uploaders retransmit on TimeoutError, so keep that distinction
+                name, text = error
+                future.set_exception(TimeoutError(text) if name == "TimeoutError"
+                                     else ConnectionError(text))
+        self._fail_all(ConnectionError("Acquisition process exited"))
+
+    def _fail_all(self, error: Exception):
+        with self._command_lock:
+            pending = list(self._commands.values())
+            self._commands.clear()
+        for future, _, _ in pending:
+            if not future.done():
+                future.set_exception(error)
+
+    def _report_sent(self, packet: List[int], description: str):
+        if self.on_packet_sent or log.isEnabledFor(logging.DEBUG):
+            log_msg = f"{description or 'Packet sent'}: {HexDump(bytes(packet))}"
+            log.debug(log_msg)
+            if self.on_packet_sent:
+                self.on_packet_sent(log_msg)
+
+    def send_packet(self, packet: List[int], description: str = ""):
+        """Have the acquisition process send a packet"""
+        if not self.is_connected() or not self._send(("packet", list(packet), description)):
+            log.warning("Cannot send packet: not connected")
+            return False
+        self._report_sent(packet, description)
+        return True
+
+    def send_command(self, packet: List[int], description: str = "",
+                     timeout: float = SerialTransport.COMMAND_TIMEOUT) -> Future:
+        """Send a command through the acquisition process; resolves on its echo"""
+        future: Future = Future()
+        future.set_running_or_notify_cancel()
+        command_id = next(self._ids)
+        with self._command_lock:
+            self._commands[command_id] = (future, list(packet), self.device_state.generation)
+        message = ("command", command_id, list(packet), description, timeout)
+        if not self.is_connected() or not self._send(message):
+            with self._command_lock:
+                self._commands.pop(command_id, None)
+            future.set_exception(ConnectionError(f"Could not send {description or 'packet'}"))
+            return future
+        self._report_sent(packet, description)
+        return future
+
+    def send_commands(self, packets: List[List[int]], description: str = "",
+                      timeout: float = SerialTransport.COMMAND_TIMEOUT) -> List[Future]:
+        """Send several commands; the acquisition process writes them one by one"""
+        return [self.send_command(packet, description, timeout) for packet in packets]
+
+    def start_acquisition(self):
+        """The acquisition process reads the port"""
+
+    def stop_acquisition(self):
+        """The acquisition process reads the port"""
+
+    def add_frame_listener(self, listener) -> bool:
+        """Frames stay in the acquisition process; read them with RingReader"""
+        log.warning("Frame listeners need the frames in this process; read the ring instead")
+        return False
+
+    def start_trace(self, path: str):
+        """Capture raw traffic in the acquisition process"""
+        self._send(("trace", path))
+
+    def stop_trace(self):
+        self._send(("trace", None))
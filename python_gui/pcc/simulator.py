@@ -0,0 +1,334 @@
+"""
+PCCSimulator - Virtual PCC board on a Linux pseudo-terminal
+
+Emulates the firmware protocol closely enough to load-test the host stack
+without hardware:
+
+- every complete host packet is echoed, like USB_DataReceived does
+- cmd 1 configures a channel ramp, cmd 2 starts streaming, cmd 8 stops it
+  (4-byte packet) or sets the DAC frequency (7-byte packet), cmd 6 stops it
+- cmd 9/10/11 stage, fill and commit a waveform table; a committed table
+  whose CRC matches replaces the channel's ramp until the next cmd 1
+- while streaming, 0xAA ... 0x55 voltage frames are sent at a configurable
+  rate; cmd 12 switches between legacy and extended (sequence number and
+  CRC-16) frames
+
+Noise, dropped and flipped bytes, delayed and lost acks can be injected, as well as
+per-channel gain and offset errors of the output stages. The slave side
+of the pty is a normal serial device, so SerialTransport.connect works on
+it unchanged.
+"""
+
+import os
+import random
+import select
+import threading
+import time
+import tty
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from . import protocol
+from .transport import PORTS_ENV
+
+
+class PCCSimulator:
+    # Defaults
+    FRAME_RATE = 1000  # Telemetry frames per second
+    TICK = 0.001  # Seconds between scheduling passes
+    MAX_PENDING = 1 << 20  # Bytes of unread output kept before dropping frames
+
+    def __init__(self, frame_rate: float = FRAME_RATE, noise: float = 0.0,
+                 drop_rate: float = 0.0, ack_delay: float = 0.0,
+                 ack_loss: float = 0.0, seed: Optional[int] = None,
+                 flip_rate: float = 0.0):
+        """
+        Args:
+            frame_rate: Telemetry frames per second while streaming
+            noise: Standard deviation of readback noise in volts
+            drop_rate: Probability that a frame loses one of its bytes
+            ack_delay: Seconds before a packet is echoed
+            ack_loss: Probability that an echo is never sent
+            seed: Seed for the noise and fault injection
+            flip_rate: Probability that a frame has one of its readings'
+                bytes inverted, which only extended frames can detect
+        """
+        self.frame_rate = frame_rate
+        self.noise = noise
+        self.drop_rate = drop_rate
+        self.ack_delay = ack_delay
+        self.ack_loss = ack_loss
+        self.flip_rate = flip_rate
+        self._random = random.Random(seed)
+        self._rng = np.random.default_rng(seed)
+
+        # Device state, mirrors ChannelConfig in the firmware
+        channels = protocol.NUM_CHANNELS
+        self.start_codes = np.zeros(channels)
+        self.end_codes = np.zeros(channels)
+        self.steps = np.ones(channels)
+        self.hold_end = np.ones(channels, dtype=bool)
+        self.ramp_start = np.zeros(channels)
+        self.frequency = 1000
+
+        # Waveform tables: channel -> codes being received / being played
+        self._staged: Dict[int, np.ndarray] = {}
+        self.tables: Dict[int, np.ndarray] = {}
+        self.table_hold = np.zeros(channels, dtype=bool)
+
+        # Output stage errors, seen in the readback: gain and offset in volts
+        self.gain_error = np.ones(channels)
+        self.offset_error = np.zeros(channels)
+        self.streaming = False
+        self.frame_format = protocol.FRAME_LEGACY
+        self.sequence = 0  # Sequence number of the next extended frame
+
+        # Statistics
+        self.packets_received = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0  # Frames not sent because the host fell behind
+        self.bytes_corrupted = 0
+        self.bytes_flipped = 0
+        self.table_errors = 0  # Table packets rejected, e.g. on a CRC mismatch
+
+        self._master: Optional[int] = None
+        self._slave: Optional[int] = None
+        self.port: Optional[str] = None
+        self._rx = bytearray()
+        self._tx = bytearray()
+        self._acks: List[Tuple[float, bytes]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._last_frame_time = 0.0
+
+    def start(self) -> str:
+        """Open the pty, start the device thread and return the port name"""
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="PCCSimulator", daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        """Stop the device thread and close the pty"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        os.close(self._master)
+        os.close(self._slave)
+        self._master = self._slave = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        """Device main loop: receive packets, send acks and telemetry"""
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([self._master], [], [], self.TICK)
+            now = time.monotonic()
+            if readable:
+                try:
+                    self._receive(os.read(self._master, 65536), now)
+                except OSError:
+                    pass  # Nothing to read while no one has the port open
+
+            # Due acks go out ahead of telemetry, like a single USB transmit
+            while self._acks and self._acks[0][0] <= now:
+                self._tx += self._acks.pop(0)[1]
+
+            if self.streaming:
+                self._generate_frames(now)
+            else:
+                self._last_frame_time = now
+
+            self._flush()
+
+    def _receive(self, data: bytes, now: float):
+        """Frame host packets by their length byte and handle them"""
+        for byte in data:
+            self._rx.append(byte)
+            length = self._rx[1] if len(self._rx) >= 2 else 0
+            if len(self._rx) >= 2 and (len(self._rx) == length or len(self._rx) >= 64):
+                packet = bytes(self._rx)
+                self._rx.clear()
+                self.packets_received += 1
+                self._handle_packet(packet, now)
+
+    def _handle_packet(self, packet: bytes, now: float):
+        """Apply a command and schedule its echo"""
+        if self._random.random() >= self.ack_loss:
+            self._acks.append((now + self.ack_delay, packet))
+
+        if len(packet) < 4 or packet[0] != protocol.START_BYTE:
+            return
+
+        command = packet[2]
+        if command == protocol.CMD_CHANNEL_CONFIG and len(packet) == 12:
+            channel = packet[3] - 1
+            if 0 <= channel < protocol.NUM_CHANNELS:
+                self.hold_end[channel] = bool(packet[4])
+                self.start_codes[channel] = int.from_bytes(packet[5:7], 'big')
+                self.end_codes[channel] = int.from_bytes(packet[7:9], 'big')
+                self.steps[channel] = max(1, int.from_bytes(packet[9:11], 'big'))
+                self.ramp_start[channel] = now
+                self.tables.pop(channel, None)
+        elif command in (protocol.CMD_TABLE_BEGIN, protocol.CMD_TABLE_DATA, protocol.CMD_TABLE_COMMIT):
+            self._handle_table_packet(command, packet, now)
+        elif command == protocol.CMD_START and len(packet) == 4:
+            if not self.streaming:
+                self._last_frame_time = now
+            self.streaming = True
+            self.ramp_start[:] = now
+        elif command == protocol.CMD_FRAME_FORMAT and len(packet) == 5:
+            if packet[3] in protocol.FRAME_SIZES:
+                self.frame_format = packet[3]
+                self.sequence = 0
+        elif command == protocol.CMD_FREQUENCY and len(packet) == 7:
+            self.frequency = max(1, int.from_bytes(packet[3:6], 'big'))
+        elif command in (protocol.CMD_STOP, protocol.CMD_MONITOR_STOP) and len(packet) == 4:
+            self.streaming = False
+
+    def _handle_table_packet(self, command: int, packet: bytes, now: float):
+        """Stage, fill or commit a waveform table"""
+        channel = packet[3] - 1
+        if not 0 <= channel < protocol.NUM_CHANNELS:
+            self.table_errors += 1
+            return
+        if command == protocol.CMD_TABLE_BEGIN and len(packet) == 7:
+            length = int.from_bytes(packet[4:6], 'big')
+            if 0 < length <= protocol.MAX_TABLE_LENGTH:
+                self._staged[channel] = np.zeros(length, dtype=np.uint16)
+                return
+        elif command == protocol.CMD_TABLE_DATA and len(packet) >= 9 and len(packet) % 2 == 1:
+            staged = self._staged.get(channel)
+            offset = int.from_bytes(packet[4:6], 'big')
+            codes = np.frombuffer(packet[6:-1], dtype='>u2')
+            if staged is not None and offset + len(codes) <= len(staged):
+                staged[offset:offset + len(codes)] = codes
+                return
+        elif command == protocol.CMD_TABLE_COMMIT and len(packet) == 8:
+            staged = self._staged.get(channel)
+            crc = int.from_bytes(packet[5:7], 'big')
+            if staged is not None and protocol.table_crc(staged.tolist()) == crc:
+                self.tables[channel] = staged.astype(float)
+                self.table_hold[channel] = bool(packet[4])
+                self.ramp_start[channel] = now
+                return
+        self.table_errors += 1
+
+    def _generate_frames(self, now: float):
+        """Append every telemetry frame due since the last pass"""
+        count = int((now - self._last_frame_time) * self.frame_rate)
+        if count <= 0:
+            return
+        times = self._last_frame_time + np.arange(1, count + 1) / self.frame_rate
+        self._last_frame_time = times[-1]
+
+        if len(self._tx) > self.MAX_PENDING:
+            # The host isn't reading; a real board would stall its FIFO
+            self.frames_dropped += count
+            self.sequence = (self.sequence + count) & 0xFFFF
+            return
+
+        self._tx += self.make_frames(times)
+        self.frames_sent += count
+
+    def channel_codes(self, times: np.ndarray) -> np.ndarray:
+        """DAC codes of every channel at the given times, shape (N, channels)"""
+        elapsed = np.maximum(times[:, None] - self.ramp_start[None, :], 0.0)
+        step = np.floor(elapsed * self.frequency)
+        step = np.where(self.hold_end, np.minimum(step, self.steps), step % (self.steps + 1))
+        codes = self.start_codes + (self.end_codes - self.start_codes) * step / self.steps
+        for channel, table in self.tables.items():
+            index = np.floor(elapsed[:, channel] * self.frequency).astype(np.int64)
+            if self.table_hold[channel]:
+                index = np.minimum(index, len(table) - 1)
+            else:
+                index %= len(table)
+            codes[:, channel] = table[index]
+        offset_codes = self.offset_error * protocol.DAC_FULL_SCALE / protocol.MAX_VOLTAGE
+        return codes * self.gain_error + offset_codes
+
+    def make_frames(self, times: np.ndarray) -> bytes:
+        """Build telemetry frames for the given times, with injected faults"""
+        codes = self.channel_codes(times)
+        if self.noise:
+            noise_codes = self.noise * protocol.DAC_FULL_SCALE / protocol.MAX_VOLTAGE
+            codes = codes + self._rng.normal(0.0, noise_codes, codes.shape)
+
+        count = len(times)
+        size = protocol.FRAME_SIZES[self.frame_format]
+        offset = protocol.payload_offset(size)
+        readings = slice(offset, offset + 2 * protocol.NUM_CHANNELS)
+        frames = np.empty((count, size), dtype=np.uint8)
+        frames[:, 0] = protocol.START_BYTE
+        frames[:, -1] = protocol.END_BYTE
+        frames[:, readings] = np.clip(np.rint(codes), 0, protocol.DAC_FULL_SCALE).astype('<u2').view(np.uint8)
+        if self.frame_format == protocol.FRAME_EXTENDED:
+            sequence = (self.sequence + np.arange(count)) & 0xFFFF
+            self.sequence = (self.sequence + count) & 0xFFFF
+            frames[:, 1:3] = sequence.astype('<u2')[:, None].view(np.uint8)
+            crcs = [protocol.frame_crc(frame.tobytes()) for frame in frames]
+            frames[:, -3:-1] = np.asarray(crcs, dtype='>u2')[:, None].view(np.uint8)
+
+        if self.flip_rate:
+            # Invert one reading byte of each affected frame, after the CRC
+            flipped = np.flatnonzero(self._rng.random(count) < self.flip_rate)
+            columns = offset + self._rng.integers(0, 2 * protocol.NUM_CHANNELS, len(flipped))
+            frames[flipped, columns] ^= 0xFF
+            self.bytes_flipped += len(flipped)
+        data = frames.tobytes()
+
+        if self.drop_rate:
+            # Remove one random byte from each corrupted frame
+            corrupted = np.flatnonzero(self._rng.random(count) < self.drop_rate)
+            if len(corrupted):
+                offsets = corrupted * size + self._rng.integers(0, size, len(corrupted))
+                keep = np.ones(len(data), dtype=bool)
+                keep[offsets] = False
+                data = np.frombuffer(data, dtype=np.uint8)[keep].tobytes()
+                self.bytes_corrupted += len(corrupted)
+        return data
+
+    def _flush(self):
+        """Write as much pending output as the pty accepts"""
+        if not self._tx:
+            return
+        try:
+            written = os.write(self._master, self._tx)
+        except (BlockingIOError, OSError):
+            return
+        del self._tx[:written]
+
+
+def run_simulator(args, out) -> int:
+    """Run a simulator until interrupted (used by the CLI)"""
+    simulator = PCCSimulator(args.rate, args.noise, args.drop_rate,
+                             args.ack_delay, args.ack_loss, args.seed, args.flip_rate)
+    simulator.gain_error[:] = 1.0 + args.gain_error
+    simulator.offset_error[:] = args.offset_error
+    port = simulator.start()
+    print(port, file=out, flush=True)
+    print(f"Simulated PCC board on {port}; export {PORTS_ENV}={port} to list it", flush=True)
+    try:
+        if args.duration:
+            time.sleep(args.duration)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+    return 0
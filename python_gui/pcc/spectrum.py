@@ -0,0 +1,187 @@
+"""
+Spectrum - Welch-averaged ripple spectra of every channel
+
+RippleAnalyzer cuts the telemetry stream into overlapping segments, removes
+each segment's mean, applies a Hann window and transforms every channel of
+every segment a batch completed in a single numpy.fft.rfft call. The power
+spectra of the last `averages` segments are averaged (Welch's method), and
+the strongest component above the lowest few bins is reported per channel
+as the dominant ripple frequency and its peak amplitude in volts.
+
+Samples are collected in a linear buffer that is compacted when it fills,
+so the cost per row is constant: one copy in, an occasional move, and a
+share of one FFT per hop.
+"""
+
+from typing import NamedTuple, Optional
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from . import protocol
+
+
+class RippleReport(NamedTuple):
+    frequency: np.ndarray  # (channels,) dominant ripple frequency in Hz
+    amplitude: np.ndarray  # (channels,) its peak amplitude in volts
+    sample_rate: float
+    segments: int  # Segments averaged into the spectrum
+
+
+class RippleAnalyzer:
+    # Defaults
+    SEGMENT = 1024  # Rows per FFT segment
+    OVERLAP = 0.5  # Fraction of a segment shared with the next one
+    AVERAGES = 8  # Segments averaged into the spectrum
+    MIN_BINS = 3  # Bins next to DC ignored when looking for the dominant peak
+    BUFFER_SEGMENTS = 4  # Buffer size in segments; larger means rarer compaction
+
+    def __init__(self, num_channels: int = protocol.NUM_CHANNELS, segment: int = SEGMENT,
+                 overlap: float = OVERLAP, averages: int = AVERAGES,
+                 sample_rate: Optional[float] = None, min_bins: int = MIN_BINS):
+        """
+        Args:
+            sample_rate: Telemetry rows per second; estimated from the
+                timestamps given to update when None
+            min_bins: Lowest bin considered for the dominant peak, which
+                keeps slow drift and ramps out of the ripple report
+        """
+        if segment < 16 or segment & (segment - 1):
+            raise ValueError("Segment length must be a power of two of at least 16")
+        if not 0 <= overlap < 1:
+            raise ValueError("Overlap must be at least 0 and less than 1")
+        if averages < 1:
+            raise ValueError("At least one segment must be averaged")
+        self.num_channels = num_channels
+        self.segment = segment
+        self.hop = max(1, int(round(segment * (1 - overlap))))
+        self.averages = averages
+        self.fixed_sample_rate = sample_rate
+        self.min_bins = max(1, min_bins)
+
+        self.window = np.hanning(segment).astype(np.float32)
+        # Energy of the window; a sine of amplitude A puts (A/2)^2 * segment
+        # * window_energy into each half of the spectrum
+        self.window_energy = float(np.sum(np.square(self.window.astype(np.float64))))
+        self.window_sum = float(np.sum(self.window.astype(np.float64)))
+        self.bins = segment // 2 + 1
+        self._buffer = np.zeros((segment * self.BUFFER_SEGMENTS, num_channels), dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        """Drop all samples and spectra, e.g. when acquisition restarts"""
+        self._filled = 0
+        self._next_end = self.segment  # Buffer row at which the next segment ends
+        self._spectra = np.zeros((self.averages, self.num_channels, self.bins))
+        self.segments = 0
+
+        # Sample rate estimate from (rows, time) since the first timestamped batch
+        self._rows_seen = 0
+        self._first_time: Optional[float] = None
+        self._first_rows = 0
+        self._last_time: Optional[float] = None
+        self._last_rows = 0
+
+    @property
+    def sample_rate(self) -> float:
+        """Rows per second, fixed or estimated (0.0 while unknown)"""
+        if self.fixed_sample_rate is not None:
+            return self.fixed_sample_rate
+        if self._first_time is None or self._last_time <= self._first_time:
+            return 0.0
+        return (self._last_rows - self._first_rows) / (self._last_time - self._first_time)
+
+    def update(self, block: np.ndarray, times: Optional[np.ndarray] = None):
+        """Add an (N, num_channels) block of voltages with optional row times in seconds"""
+        count = len(block)
+        if count == 0:
+            return
+        if times is not None and len(times):
+            # Rows received before a batch's time stamp are complete at that time
+            if self._first_time is None:
+                self._first_time = float(times[-1])
+                self._first_rows = self._rows_seen + count
+            self._last_time = float(times[-1])
+            self._last_rows = self._rows_seen + count
+        self._rows_seen += count
+
+        offset = 0
+        while offset < count:
+            space = len(self._buffer) - self._filled
+            if space == 0:
+                self._compact()
+                continue
+            take = min(space, count - offset)
+            self._buffer[self._filled:self._filled + take] = block[offset:offset + take]
+            self._filled += take
+            offset += take
+            self._transform()
+
+    def _compact(self):
+        """Move the rows still needed by the next segment to the front"""
+        start = self._next_end - self.segment
+        keep = self._filled - start
+        self._buffer[:keep] = self._buffer[start:self._filled]
+        self._filled = keep
+        self._next_end -= start
+
+    def _transform(self):
+        """Transform every segment completed since the last call, all at once"""
+        if self._filled < self._next_end:
+            return
+        count = (self._filled - self._next_end) // self.hop + 1
+        first = self._next_end - self.segment
+        # (rows, channels, segment) view; picking the segment starts copies them
+        windows = sliding_window_view(self._buffer[:self._filled], self.segment, axis=0)
+        segments = windows[first:first + count * self.hop:self.hop]
+        # NaN rows (padding of a lagging board) would spoil the whole average
+        segments = np.nan_to_num(segments - segments.mean(axis=-1, keepdims=True))
+        spectra = np.fft.rfft(segments * self.window, axis=-1)
+        power = np.square(spectra.real) + np.square(spectra.imag)
+
+        # Only the newest segments can still be part of the average
+        for segment_power in power[-self.averages:]:
+            self._spectra[self.segments % self.averages] = segment_power
+            self.segments += 1
+        self.segments += max(0, count - self.averages)
+        self._next_end += count * self.hop
+
+    def power(self) -> np.ndarray:
+        """(num_channels, bins) Welch-averaged power of the windowed segments"""
+        used = min(self.segments, self.averages)
+        if used == 0:
+            return np.zeros((self.num_channels, self.bins))
+        return self._spectra[:used].mean(axis=0)
+
+    def frequencies(self) -> np.ndarray:
+        """Frequency of every bin in Hz (bin numbers while the rate is unknown)"""
+        rate = self.sample_rate or self.segment
+        return np.fft.rfftfreq(self.segment, 1.0 / rate)
+
+    def amplitude_spectrum(self) -> np.ndarray:
+        """(num_channels, bins) peak amplitude in volts of a sine centred on each bin"""
+        return 2.0 * np.sqrt(self.power()) / self.window_sum
+
+    def report(self) -> RippleReport:
+        """Dominant ripple component of every channel"""
+        power = self.power()
+        rate = self.sample_rate
+        channels = np.arange(self.num_channels)
+        if self.segments == 0:
+            nan = np.full(self.num_channels, np.nan)
+            return RippleReport(nan, nan.copy(), rate, 0)
+
+        peak = self.min_bins + power[:, self.min_bins:-1].argmax(axis=1)
+        # Parabolic interpolation between the neighbouring bins of the peak
+        # (on log power, which is exact for a Gaussian-like Hann main lobe)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            left, centre, right = (np.log(power[channels, peak + shift] + 1e-30) for shift in (-1, 0, 1))
+            offset = 0.5 * (left - right) / (left - 2 * centre + right)
+        offset = np.clip(np.nan_to_num(offset), -0.5, 0.5)
+        frequency = (peak + offset) * (rate / self.segment) if rate else np.full(self.num_channels, np.nan)
+
+        # Energy of the main lobe (two bins on either side for a Hann window)
+        # doesn't depend on where between bins the component falls
+        lobe = np.clip(peak[:, np.newaxis] + np.arange(-2, 3), 0, self.bins - 1)
+        energy = power[channels[:, np.newaxis], lobe].sum(axis=1)
+        amplitude = 2.0 * np.sqrt(energy / (self.segment * self.window_energy))
+        return RippleReport(frequency, amplitude, rate, self.segments)
@@ -0,0 +1,99 @@
+"""
+DeviceState - Host mirror of the configuration a board has acknowledged
+
+The mirror stores the last echoed channel configuration or waveform table
+commit packet of every channel and the last echoed frequency packet. Uploads can then skip
+packets that would not change anything. A packet is only recorded once its
+echo arrives, so lost or failed packets are sent again next time.
+
+The mirror is cleared whenever the port is (re)connected, since the board
+resets its configuration when it is power cycled or re-enumerated.
+
+Presets are JSON files holding the frequency and per-channel settings, in
+the same shape as the settings stored in telemetry recordings.
+"""
+
+import json
+import threading
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from . import protocol
+
+
+class DeviceState:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acknowledged: Dict[Hashable, bytes] = {}
+        self.generation = 0  # Incremented by invalidate
+
+    @staticmethod
+    def key(packet: Sequence[int]) -> Optional[Hashable]:
+        """Mirror slot of a packet, or None if it isn't configuration"""
+        if len(packet) < 4 or packet[0] != protocol.START_BYTE:
+            return None
+        if packet[2] == protocol.CMD_CHANNEL_CONFIG and len(packet) == 12:
+            return ("channel", packet[3])
+        if packet[2] == protocol.CMD_FREQUENCY and len(packet) == 7:
+            return "frequency"
+        if packet[2] == protocol.CMD_TABLE_COMMIT and len(packet) == 8:
+            return ("table", packet[3])
+        return None
+
+    @staticmethod
+    def _superseded(key: Hashable) -> Optional[Hashable]:
+        """Slot a packet replaces on the board: a ramp stops a table and vice versa"""
+        if isinstance(key, tuple):
+            return ("table" if key[0] == "channel" else "channel", key[1])
+        return None
+
+    def acknowledge(self, packet: Sequence[int], generation: int):
+        """Record an echoed packet, unless the mirror was invalidated since it was sent"""
+        key = self.key(packet)
+        if key is None:
+            return
+        with self._lock:
+            if generation == self.generation:
+                self._acknowledged[key] = bytes(packet)
+                self._acknowledged.pop(self._superseded(key), None)
+
+    def is_current(self, packet: Sequence[int]) -> bool:
+        """True if the board already has this configuration"""
+        key = self.key(packet)
+        with self._lock:
+            return key is not None and self._acknowledged.get(key) == bytes(packet)
+
+    def changed(self, packets: Sequence[Tuple[List[int], str]]) -> List[int]:
+        """Indices of (packet, description) pairs that still need sending"""
+        return [i for i, (packet, _) in enumerate(packets) if not self.is_current(packet)]
+
+    def invalidate(self):
+        """Forget everything, e.g. after a reconnect or device reset"""
+        with self._lock:
+            self._acknowledged.clear()
+            self.generation += 1
+
+
+def save_preset(path: str, preset: Dict[str, Any]):
+    """Write a preset: {"frequency": Hz, "channels": [{start, end, steps, hold_end}]}"""
+    with open(path, 'w') as f:
+        json.dump(preset, f, indent=2)
+
+
+def load_preset(path: str, num_channels: int = protocol.NUM_CHANNELS) -> Dict[str, Any]:
+    """Read and validate a preset written by save_preset"""
+    with open(path) as f:
+        preset = json.load(f)
+
+    channels = preset.get("channels")
+    if not isinstance(channels, list) or len(channels) != num_channels:
+        raise ValueError(f"Preset must configure {num_channels} channels")
+    try:
+        for i, channel in enumerate(channels):
+            # Encoding the packet checks every range
+            protocol.channel_config_packet(i, channel["start"], channel["end"],
+                                           channel["steps"], channel["hold_end"])
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Invalid channel settings in preset: {e}")
+    if "frequency" in preset:
+        protocol.frequency_packet(preset["frequency"])
+    return preset
@@ -0,0 +1,326 @@
+"""
+Stats - Streaming per-channel statistics and threshold alarms
+
+ChannelStats keeps, for every channel at once:
+  - count, mean and variance since the last reset (Welford's algorithm,
+    merged a whole batch at a time with Chan's parallel update)
+  - minimum and maximum since the last reset
+  - RMS and ripple (standard deviation) over the last `window` rows
+
+AlarmEngine compares every batch with per-channel high, low and ripple
+limits. An alarm is raised on the first row past its limit and cleared once
+the value is back inside the limit by more than the hysteresis, so a value
+hovering at the limit doesn't toggle it on every frame.
+
+Both work on (N, channels) voltage blocks with vectorized NumPy, and the
+cost of a batch depends only on its size, never on how long the session
+has been running.
+"""
+
+import json
+from typing import Any, Dict, List, NamedTuple, Optional
+import numpy as np
+
+from . import protocol
+
+HIGH = "high"
+LOW = "low"
+RIPPLE = "ripple"
+ALARM_KINDS = (HIGH, LOW, RIPPLE)
+
+
+class ChannelStats:
+    # Defaults
+    WINDOW = 1000  # Rows covered by the RMS and ripple
+
+    def __init__(self, num_channels: int = protocol.NUM_CHANNELS, window: int = WINDOW):
+        if window < 1:
+            raise ValueError("Statistics window must be at least 1 row")
+        self.num_channels = num_channels
+        self.window = window
+        self._buffer = np.zeros((window, num_channels), dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        """Forget everything seen so far"""
+        channels = self.num_channels
+        self.count = 0
+        self.mean = np.zeros(channels)
+        self._m2 = np.zeros(channels)  # Sum of squared deviations from the mean
+        self.minimum = np.full(channels, np.inf)
+        self.maximum = np.full(channels, -np.inf)
+
+        # Window ring buffer with running sums of x and x^2
+        self._position = 0
+        self._filled = 0
+        self._sum = np.zeros(channels)
+        self._sum_sq = np.zeros(channels)
+        self._since_resum = 0
+
+        # Statistics
+        self.rows_skipped = 0  # Rows with NaN, e.g. padding of a lagging board
+
+    def update(self, block: np.ndarray):
+        """Add an (N, num_channels) block of voltages"""
+        if len(block) == 0:
+            return
+        block = np.asarray(block, dtype=np.float64)
+        block_sum = block.sum(axis=0)
+        if not np.isfinite(block_sum).all():
+            finite = np.isfinite(block).all(axis=1)
+            self.rows_skipped += int(len(block) - finite.sum())
+            block = block[finite]
+            if len(block) == 0:
+                return
+            block_sum = block.sum(axis=0)
+
+        # Chan et al.: merge the batch's mean and M2 into the running ones
+        count = len(block)
+        batch_mean = block_sum / count
+        deviation = block - batch_mean
+        batch_m2 = np.einsum('ij,ij->j', deviation, deviation)
+        total = self.count + count
+        delta = batch_mean - self.mean
+        self.mean += delta * (count / total)
+        self._m2 += batch_m2 + np.square(delta) * (self.count * count / total)
+        self.count = total
+
+        np.minimum(self.minimum, block.min(axis=0), out=self.minimum)
+        np.maximum(self.maximum, block.max(axis=0), out=self.maximum)
+        self._update_window(block, block_sum)
+
+    def _update_window(self, block: np.ndarray, block_sum: np.ndarray):
+        window = self.window
+        if len(block) >= window:
+            self._buffer[:] = block[-window:]
+            self._position = 0
+            self._filled = window
+            self._resum()
+            return
+
+        # Rows replaced in the ring, in at most two slices; once it is full
+        # they are the oldest ones and leave the running sums
+        start = self._position
+        first = min(len(block), window - start)
+        segments = [(slice(start, start + first), block[:first])]
+        if first < len(block):
+            segments.append((slice(0, len(block) - first), block[first:]))
+        for rows, new in segments:
+            if self._filled == window:
+                old = self._buffer[rows]
+                self._sum -= old.sum(axis=0)
+                self._sum_sq -= np.einsum('ij,ij->j', old, old)
+            self._buffer[rows] = new
+        self._sum += block_sum
+        self._sum_sq += np.einsum('ij,ij->j', block, block)
+        self._position = (start + len(block)) % window
+        self._filled = min(window, self._filled + len(block))
+
+        # Subtracting drifts; an exact sum once per window length keeps the
+        # error bounded at a constant cost per row
+        self._since_resum += len(block)
+        if self._since_resum >= window:
+            self._resum()
+
+    def _resum(self):
+        rows = self._buffer[:self._filled]
+        self._sum = rows.sum(axis=0)
+        self._sum_sq = np.einsum('ij,ij->j', rows, rows)
+        self._since_resum = 0
+
+    @property
+    def variance(self) -> np.ndarray:
+        """Sample variance since the last reset (NaN before two rows)"""
+        if self.count < 2:
+            return np.full(self.num_channels, np.nan)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.variance)
+
+    @property
+    def rms(self) -> np.ndarray:
+        """Root mean square over the window"""
+        if self._filled == 0:
+            return np.full(self.num_channels, np.nan)
+        return np.sqrt(np.maximum(self._sum_sq / self._filled, 0.0))
+
+    @property
+    def ripple(self) -> np.ndarray:
+        """Standard deviation over the window, i.e. the RMS of the AC part"""
+        if self._filled == 0:
+            return np.full(self.num_channels, np.nan)
+        mean = self._sum / self._filled
+        return np.sqrt(np.maximum(self._sum_sq / self._filled - np.square(mean), 0.0))
+
+    def summary(self) -> Dict[str, List[float]]:
+        """Every statistic as per-channel lists, e.g. for JSON"""
+        return {
+            "count": self.count,
+            "mean": self.mean.tolist(),
+            "std": self.std.tolist(),
+            "min": self.minimum.tolist(),
+            "max": self.maximum.tolist(),
+            "rms": self.rms.tolist(),
+            "ripple": self.ripple.tolist(),
+        }
+
+
+class AlarmEvent(NamedTuple):
+    channel: int  # Zero-based
+    kind: str  # HIGH, LOW or RIPPLE
+    raised: bool  # False when the alarm clears
+    value: float  # Voltage (or ripple) that changed the state
+    limit: float
+    row: int  # Row of the batch, -1 for ripple alarms (evaluated per batch)
+    time: Optional[float]  # Time of the row (last row for ripple), if the batch had timestamps
+
+
+def _first_true(mask: np.ndarray) -> np.ndarray:
+    """Index of the first True row per column, len(mask) if there is none"""
+    return np.where(mask.any(axis=0), mask.argmax(axis=0), len(mask))
+
+
+def _last_true(mask: np.ndarray) -> np.ndarray:
+    """Index of the last True row per column, -1 if there is none"""
+    return np.where(mask.any(axis=0), len(mask) - 1 - mask[::-1].argmax(axis=0), -1)
+
+
+class AlarmEngine:
+    # Defaults
+    HYSTERESIS = 0.05  # Volts an alarm's value must come back by to clear it
+
+    def __init__(self, num_channels: int = protocol.NUM_CHANNELS,
+                 hysteresis: float = HYSTERESIS):
+        self.num_channels = num_channels
+        # Limits per kind and channel; NaN disables the alarm
+        self.limits = {kind: np.full(num_channels, np.nan) for kind in ALARM_KINDS}
+        self.hysteresis = np.full(num_channels, float(hysteresis))
+        self.active = {kind: np.zeros(num_channels, dtype=bool) for kind in ALARM_KINDS}
+
+        # Statistics
+        self.events_raised = 0
+
+    def set_limits(self, channel: int, high: Optional[float] = None, low: Optional[float] = None,
+                   ripple: Optional[float] = None, hysteresis: Optional[float] = None):
+        """Set the limits of a zero-based channel; None disables a limit"""
+        if not 0 <= channel < self.num_channels:
+            raise ValueError(f"Channel must be between 1 and {self.num_channels}")
+        if high is not None and low is not None and low >= high:
+            raise ValueError(f"Channel {channel + 1}: low limit must be below the high limit")
+        if hysteresis is not None:
+            if hysteresis < 0:
+                raise ValueError("Hysteresis can't be negative")
+            self.hysteresis[channel] = hysteresis
+        for kind, limit in ((HIGH, high), (LOW, low), (RIPPLE, ripple)):
+            self.limits[kind][channel] = np.nan if limit is None else float(limit)
+            self.active[kind][channel] = False
+
+    @property
+    def enabled(self) -> bool:
+        """True if any limit is set"""
+        return any(not np.isnan(limits).all() for limits in self.limits.values())
+
+    def active_alarms(self) -> List[tuple]:
+        """(channel, kind) of every raised alarm"""
+        return [(int(channel), kind) for kind in ALARM_KINDS
+                for channel in np.flatnonzero(self.active[kind])]
+
+    def reset(self):
+        """Clear every alarm without reporting it"""
+        for active in self.active.values():
+            active[:] = False
+
+    def evaluate(self, block: np.ndarray, times: Optional[np.ndarray] = None,
+                 stats: Optional[ChannelStats] = None) -> List[AlarmEvent]:
+        """Update the alarms with an (N, num_channels) block
+
+        The state after the batch is exact. Within one batch, an alarm
+        reports at most two events: its first transition and, if the batch
+        ends in the state it started in, the transition back. Ripple alarms
+        need stats, already updated with the block.
+        """
+        events: List[AlarmEvent] = []
+        if len(block) == 0:
+            return events
+        # NaN compares False, so padded rows and disabled limits never trigger
+        with np.errstate(invalid='ignore'):
+            high = self.limits[HIGH]
+            if not np.isnan(high).all():
+                self._transitions(events, HIGH, block, times,
+                                  block > high, block < high - self.hysteresis)
+            low = self.limits[LOW]
+            if not np.isnan(low).all():
+                self._transitions(events, LOW, block, times,
+                                  block < low, block > low + self.hysteresis)
+            if stats is not None and not np.isnan(self.limits[RIPPLE]).all():
+                ripple = stats.ripple[np.newaxis, :]
+                limit = self.limits[RIPPLE]
+                self._transitions(events, RIPPLE, ripple, times, ripple > limit,
+                                  ripple < limit - self.hysteresis)
+        self.events_raised += sum(event.raised for event in events)
+        return events
+
+    def _transitions(self, events: List[AlarmEvent], kind: str, values: np.ndarray,
+                     times: Optional[np.ndarray], trigger: np.ndarray, release: np.ndarray):
+        active = self.active[kind]
+        if not (trigger.any() or (active.any() and release.any())):
+            return
+        last_trigger = _last_true(trigger)
+        last_release = _last_true(release)
+        # The later of the two decides; with neither the state is kept
+        final = np.where(last_trigger > last_release, True,
+                         np.where(last_release > last_trigger, False, active))
+
+        rows = np.arange(len(values))[:, np.newaxis]
+        # Inactive: raised at the first trigger, cleared again after the last one
+        first = np.where(active, _first_true(release), _first_true(trigger))
+        again = np.where(active, _first_true(trigger & (rows > last_release)),
+                         _first_true(release & (rows > last_trigger)))
+        for channel in np.flatnonzero(first < len(values)):
+            was_active = bool(active[channel])
+            self._add_event(events, kind, values, times, channel, first[channel], not was_active)
+            if final[channel] == was_active:
+                self._add_event(events, kind, values, times, channel, again[channel], was_active)
+        active[:] = final
+
+    def _add_event(self, events, kind, values, times, channel, row, raised):
+        per_batch = kind == RIPPLE
+        events.append(AlarmEvent(
+            channel=int(channel), kind=kind, raised=bool(raised),
+            value=float(values[row, channel]), limit=float(self.limits[kind][channel]),
+            row=-1 if per_batch else int(row),
+            time=None if times is None else float(times[-1 if per_batch else row]),
+        ))
+
+
+def format_event(event: AlarmEvent) -> str:
+    """One-line description, e.g. 'Ch 3 high raised: 12.610 V (limit 12.500 V)'"""
+    state = "raised" if event.raised else "cleared"
+    return (f"Ch{event.channel + 1:2d} {event.kind} {state}: {event.value:.3f} V "
+            f"(limit {event.limit:.3f} V)")
+
+
+def load_alarms(path: str, num_channels: int = protocol.NUM_CHANNELS) -> Dict[str, Any]:
+    """Read {"window": rows, "hysteresis": volts, "channels": {"1": {"high": ...}}}
+
+    Returns {"window": int or None, "engine": AlarmEngine}. A channel entry
+    may set "high", "low", "ripple" and "hysteresis"; "*" applies to every
+    channel without an entry of its own.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    try:
+        engine = AlarmEngine(num_channels, float(data.get("hysteresis", AlarmEngine.HYSTERESIS)))
+        channels = dict(data.get("channels", {}))
+        default = channels.pop("*", None)
+        if default is not None:
+            for channel in range(num_channels):
+                engine.set_limits(channel, **default)
+        for channel, limits in channels.items():
+            engine.set_limits(int(channel) - 1, **{**(default or {}), **limits})
+        window = data.get("window")
+        return {"window": None if window is None else int(window), "engine": engine}
+    except (TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid alarm file: {e}")
@@ -0,0 +1,135 @@
+"""
+Trace - Leveled logging, binary TX/RX traces and hot-path timing
+
+Diagnostics go through the standard logging module under the "pcc" logger.
+Hex dumps are wrapped in HexDump, which only formats when a record is
+actually emitted, so a disabled level costs a single isEnabledFor check.
+
+Raw traffic can also be captured to a compact binary file:
+
+    header   TRACE_MAGIC
+    records  time_ns (u64), direction (u8, TX or RX), length (u32), payload
+
+read_trace iterates over such a file.
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+# Level of the "pcc" logger when configure_logging is given none, e.g. DEBUG
+LOG_LEVEL_ENV = "PCC_LOG_LEVEL"
+
+TX = 0
+RX = 1
+
+TRACE_MAGIC = b'PCCTRC\x00\x01'
+# time_ns, direction, payload length
+RECORD_STRUCT = struct.Struct('<QBI')
+
+
+def configure_logging(level: Optional[int] = None):
+    """Send "pcc" log records to stderr at level (default from LOG_LEVEL_ENV or INFO)"""
+    if level is None:
+        name = os.environ.get(LOG_LEVEL_ENV, "INFO").upper()
+        level = logging.getLevelName(name)
+        if not isinstance(level, int):
+            level = logging.INFO
+    logging.basicConfig(format="%(message)s")
+    logging.getLogger("pcc").setLevel(level)
+
+
+class HexDump:
+    """Bytes rendered as 'AA 04 02 00' when converted to str"""
+    __slots__ = ('data', 'limit')
+
+    def __init__(self, data: bytes, limit: Optional[int] = None):
+        self.data = data
+        self.limit = limit
+
+    def __str__(self) -> str:
+        if self.limit is None or len(self.data) <= self.limit:
+            return self.data.hex(' ').upper()
+        return f"{self.data[:self.limit].hex(' ').upper()} ... ({len(self.data)} bytes)"
+
+
+class TraceWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self.records_written = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        self._file.write(TRACE_MAGIC)
+
+    def write(self, direction: int, data: bytes, time_ns: Optional[int] = None):
+        """Append one chunk; time_ns defaults to time.monotonic_ns()"""
+        if time_ns is None:
+            time_ns = time.monotonic_ns()
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(RECORD_STRUCT.pack(time_ns, direction, len(data)))
+            self._file.write(data)
+            self.records_written += 1
+
+    def close(self):
+        """Flush and close the file"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_trace(path: str) -> Iterator[Tuple[int, int, bytes]]:
+    """Yield (time_ns, direction, data) for every record of a trace file"""
+    with open(path, 'rb') as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f"{path} is not a PCC trace")
+        while True:
+            header = f.read(RECORD_STRUCT.size)
+            if len(header) < RECORD_STRUCT.size:
+                return  # Clean end, or a record cut short by a crash
+            time_ns, direction, length = RECORD_STRUCT.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield time_ns, direction, data
+
+
+class CallTimer:
+    """Timing hook that aggregates (name, duration_ns) calls
+
+    Assign an instance to SerialTransport.timing_hook to see where the
+    acquisition thread spends its time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, list] = {}  # name -> [count, total_ns, max_ns]
+
+    def __call__(self, name: str, duration_ns: int):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                self._stats[name] = [1, duration_ns, duration_ns]
+            else:
+                stats[0] += 1
+                stats[1] += duration_ns
+                if duration_ns > stats[2]:
+                    stats[2] = duration_ns
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, mean and max duration in microseconds per name"""
+        with self._lock:
+            return {
+                name: {"count": count, "mean_us": total / count / 1000, "max_us": peak / 1000}
+                for name, (count, total, peak) in self._stats.items()
+            }
+
+    def reset(self):
+        """Forget all measurements"""
+        with self._lock:
+            self._stats.clear()
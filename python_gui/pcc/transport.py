@@ -0,0 +1,383 @@
+"""
+SerialTransport - Serial port I/O, acquisition thread and command echoes
+
+Qt-free: events are reported through plain callbacks that are invoked from
+the acquisition thread. Command futures can be awaited from asyncio with
+asyncio.wrap_future.
+"""
+
+import logging
+import os
+import serial
+import serial.tools.list_ports
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from . import protocol
+from .decoder import FrameDecoder
+from .state import DeviceState
+from .trace import RX, TX, HexDump, TraceWriter
+
+log = logging.getLogger(__name__)
+
+# Extra ports (os.pathsep separated) to offer in get_available_ports, e.g.
+# the pty of a simulated board
+PORTS_ENV = "PCC_EXTRA_PORTS"
+
+
+class SerialTransport:
+    
+    # Acquisition settings
+    READ_TIMEOUT = 0.05  # Seconds the acquisition thread blocks per read
+    COMMAND_TIMEOUT = 0.5  # Seconds to wait for a command echo
+    
+    def __init__(self):
+        self.connection: Optional[serial.Serial] = None
+        
+        # Acquisition thread and the decoder it feeds
+        self._acquisition_thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self.decoder = FrameDecoder()
+        
+        # Commands waiting for their echo: future -> (packet, callback, deadline)
+        self._pending_commands: Dict[Future, Tuple[List[int], Callable[[bytes], None], float]] = {}
+        self._command_lock = threading.Lock()
+        
+        # Configuration the board has echoed; cleared on every (re)connect
+        self.device_state = DeviceState()
+        
+        # Callbacks; on_data_received and on_frames_received are invoked
+        # from the acquisition thread
+        self.on_data_received: Optional[Callable[[bytes], None]] = None
+        self.on_frames_received: Optional[Callable[[List[bytes]], None]] = None
+        self.on_packet_sent: Optional[Callable[[str], None]] = None
+        self.on_connection_changed: Optional[Callable[[bool, str], None]] = None
+        
+        # Extra consumers of decoded frames, called from the acquisition
+        # thread with (frames, receive time from time.monotonic_ns)
+        self.frame_listeners: List[Callable[[List[bytes], int], None]] = []
+        
+        # Diagnostics, both off by default: a binary capture of raw TX/RX
+        # and a hook called with (name, duration_ns) around hot-path steps
+        self.trace: Optional[TraceWriter] = None
+        self.timing_hook: Optional[Callable[[str, int], None]] = None
+        
+    def get_available_ports(self) -> List[str]:
+        """Get list of available serial ports"""
+        ports = serial.tools.list_ports.comports()
+        # Filter for common port patterns (adjust as needed for your system)
+        available_ports = []
+        for port in ports:
+            port_name = port.device
+            # On macOS/Linux, look for USB/cu ports
+            if '/dev/cu.' in port_name or '/dev/ttyUSB' in port_name or '/dev/ttyACM' in port_name:
+                available_ports.append(port_name)
+            # On Windows, include COM ports
+            elif 'COM' in port_name:
+                available_ports.append(port_name)
+        
+        # If no filtered ports, return all ports
+        if not available_ports:
+            available_ports = [port.device for port in ports]
+            
+        # Ports that can't be enumerated, such as simulator ptys
+        for port_name in os.environ.get(PORTS_ENV, "").split(os.pathsep):
+            if port_name and port_name not in available_ports:
+                available_ports.insert(0, port_name)
+            
+        return available_ports
+        
+    def connect(self, port: str, baudrate: int = 115200) -> bool:
+        """Connect to serial port"""
+        try:
+            self.connection = serial.Serial(
+                port=port,
+                baudrate=baudrate,
+                bytesize=serial.EIGHTBITS,
+                parity=serial.PARITY_NONE,
+                stopbits=serial.STOPBITS_ONE,
+                timeout=self.READ_TIMEOUT
+            )
+            
+            # Clear any existing data
+            self.connection.reset_input_buffer()
+            self.connection.reset_output_buffer()
+            self.device_state.invalidate()
+            
+            self.start_acquisition()
+            
+            log.info("Connected to %s at %d baud", port, baudrate)
+            if self.on_connection_changed:
+                self.on_connection_changed(True, port)
+            return True
+            
+        except Exception as e:
+            log.error("Failed to connect to %s: %s", port, e)
+            self.connection = None
+            if self.on_connection_changed:
+                self.on_connection_changed(False, port)
+            return False
+        
+    def disconnect(self):
+        """Disconnect from serial port and stop any trace"""
+        self.stop_acquisition()
+        self.stop_trace()
+        self._fail_pending_commands(ConnectionError("Serial port disconnected"))
+        if self.connection and self.connection.is_open:
+            try:
+                port_name = self.connection.port
+                self.connection.close()
+                log.info("Disconnected from serial port")
+                if self.on_connection_changed:
+                    self.on_connection_changed(False, port_name)
+            except Exception as e:
+                log.error("Error disconnecting: %s", e)
+        self.connection = None
+        
+    def is_connected(self) -> bool:
+        """Check if connected to serial port"""
+        return self.connection is not None and self.connection.is_open
+        
+    def send_packet(self, packet: List[int], description: str = ""):
+        """Send packet over serial connection"""
+        if not self.is_connected():
+            log.warning("Cannot send packet: not connected")
+            return False
+            
+        try:
+            # Convert to bytes
+            packet_bytes = bytes(packet)
+            hook = self.timing_hook
+            start = time.perf_counter_ns() if hook else 0
+            self.connection.write(packet_bytes)
+            if self.trace:
+                self.trace.write(TX, packet_bytes)
+            if hook:
+                hook("send", time.perf_counter_ns() - start)
+            
+            # Only format the hex dump if someone will see it
+            if self.on_packet_sent or log.isEnabledFor(logging.DEBUG):
+                log_msg = f"{description or 'Packet sent'}: {HexDump(packet_bytes)}"
+                log.debug(log_msg)
+                if self.on_packet_sent:
+                    self.on_packet_sent(log_msg)
+            return True
+            
+        except Exception as e:
+            error_msg = f"Error sending packet: {e}"
+            log.error(error_msg)
+            if self.on_packet_sent:
+                self.on_packet_sent(error_msg)
+            return False
+            
+    def send_command(self, packet: List[int], description: str = "",
+                     timeout: float = COMMAND_TIMEOUT) -> Future:
+        """Send a command packet without waiting for the device
+        
+        The device echoes every complete packet. The returned future
+        resolves with the echo once the acquisition thread sees it, or fails
+        with TimeoutError if no echo arrives within timeout seconds.
+        """
+        # Register before sending so a fast echo isn't missed
+        future = self._register_command(packet, timeout)
+        if not self.send_packet(packet, description):
+            self._fail_command(future, ConnectionError(f"Could not send {description or 'packet'}"))
+            
+        return future
+        
+    def send_commands(self, packets: List[List[int]], description: str = "",
+                      timeout: float = COMMAND_TIMEOUT) -> List[Future]:
+        """Send several command packets back to back in a single write
+        
+        Like send_command for every packet, but one system call (and USB
+        transfer) carries them all. Returns one future per packet.
+        """
+        futures = [self._register_command(packet, timeout) for packet in packets]
+        if packets and not self.send_packet([byte for packet in packets for byte in packet],
+                                            description):
+            for future in futures:
+                self._fail_command(future, ConnectionError(f"Could not send {description or 'packets'}"))
+        return futures
+        
+    def _register_command(self, packet: List[int], timeout: float) -> Future:
+        """Future resolved by the echo of packet, failed after timeout seconds"""
+        future: Future = Future()
+        future.set_running_or_notify_cancel()
+        generation = self.device_state.generation
+        
+        def on_echo(echo):
+            with self._command_lock:
+                self._pending_commands.pop(future, None)
+            self.device_state.acknowledge(packet, generation)
+            if not future.done():
+                future.set_result(echo)
+                
+        with self._command_lock:
+            self._pending_commands[future] = (packet, on_echo, time.monotonic() + timeout)
+        self.expect_echo(packet, on_echo)
+        return future
+        
+    def set_frame_format(self, frame_format: int,
+                         timeout: float = COMMAND_TIMEOUT) -> Future:
+        """Select the telemetry frame format of the board
+        
+        The echo only confirms that the packet arrived; the decoder switches
+        when frames of the new format show up, and stays with legacy frames
+        if the board doesn't implement the command (only the simulator does).
+        """
+        return self.send_command(protocol.frame_format_packet(frame_format),
+                                 f"Frame format {frame_format}", timeout)
+        
+    def _fail_command(self, future: Future, error: Exception):
+        """Stop waiting for a command and fail its future"""
+        with self._command_lock:
+            pending = self._pending_commands.pop(future, None)
+        if pending is None:
+            return  # Already resolved
+        packet, on_echo, _ = pending
+        self.cancel_echo(packet, on_echo)
+        if not future.done():
+            future.set_exception(error)
+            
+    def _expire_commands(self):
+        """Fail commands whose echo did not arrive in time"""
+        now = time.monotonic()
+        with self._command_lock:
+            expired = [future for future, (_, _, deadline) in self._pending_commands.items()
+                       if now >= deadline]
+        for future in expired:
+            self._fail_command(future, TimeoutError("No confirmation received"))
+            
+    def _fail_pending_commands(self, error: Exception):
+        """Fail every command still waiting for its echo"""
+        with self._command_lock:
+            pending = list(self._pending_commands)
+        for future in pending:
+            self._fail_command(future, error)
+            
+    def start_acquisition(self):
+        """Start the background thread that reads the serial port"""
+        if self._acquisition_thread is not None:
+            return
+            
+        self._stop_event.clear()
+        self.decoder.reset()
+        self._acquisition_thread = threading.Thread(
+            target=self._acquisition_loop,
+            name="SerialAcquisition",
+            daemon=True
+        )
+        self._acquisition_thread.start()
+        
+    def stop_acquisition(self):
+        """Stop the background acquisition thread"""
+        if self._acquisition_thread is None:
+            return
+            
+        self._stop_event.set()
+        if self._acquisition_thread is not threading.current_thread():
+            self._acquisition_thread.join(timeout=1.0)
+        self._acquisition_thread = None
+        
+    def _acquisition_loop(self):
+        """Block on the port, buffer raw chunks and decode telemetry frames"""
+        connection = self.connection
+        while not self._stop_event.is_set():
+            if self._pending_commands:
+                self._expire_commands()
+                
+            try:
+                # Block for the first byte, then take whatever else is queued
+                data = connection.read(max(1, connection.in_waiting))
+                time_ns = time.monotonic_ns()
+            except Exception as e:
+                if not self._stop_event.is_set():
+                    log.error("Error reading data: %s", e)
+                break
+                
+            if not data:
+                # The line went quiet: an echo held back in case it was the
+                # start of a frame is an echo after all
+                self._dispatch(self.decoder.feed(b'', idle=True), time.monotonic_ns())
+                self._dispatch_pending(time.monotonic_ns())
+                continue
+                
+            if self.trace:
+                self.trace.write(RX, data, time_ns)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("RX %s", HexDump(data))
+            hook = self.timing_hook
+                
+            if self.on_data_received:
+                self.on_data_received(data)
+            
+            start = time.perf_counter_ns() if hook else 0
+            frames = self.decoder.feed(data)
+            if hook:
+                hook("decode", time.perf_counter_ns() - start)
+            self._dispatch(frames, time_ns)
+            self._dispatch_pending(time_ns)
+                
+    def _dispatch_pending(self, time_ns: int):
+        """Dispatch frames held back by a format change, one format at a time"""
+        while self.decoder.frames_pending:
+            self._dispatch(self.decoder.feed(b''), time_ns)
+            
+    def _dispatch(self, frames: List[bytes], time_ns: int):
+        """Hand decoded frames to the callbacks and listeners; all have the same size"""
+        if not frames:
+            return
+        hook = self.timing_hook
+        if hook:
+            start = time.perf_counter_ns()
+        if self.on_frames_received:
+            self.on_frames_received(frames)
+        for listener in self.frame_listeners:
+            listener(frames, time_ns)
+        if hook:
+            hook("dispatch", time.perf_counter_ns() - start)
+            
+    def add_frame_listener(self, listener: Callable[[List[bytes], int], None]) -> bool:
+        """Register a consumer of decoded frames on the acquisition thread
+
+        Returns False if the frames aren't decoded in this process.
+        """
+        # Replace the list so the acquisition thread never sees it mid-update
+        self.frame_listeners = self.frame_listeners + [listener]
+        return True
+        
+    def remove_frame_listener(self, listener: Callable[[List[bytes], int], None]):
+        """Unregister a consumer added with add_frame_listener"""
+        self.frame_listeners = [l for l in self.frame_listeners if l != listener]
+        
+    def start_trace(self, path: str):
+        """Capture all raw TX/RX traffic to a binary trace file"""
+        self.stop_trace()
+        self.trace = TraceWriter(path)
+        log.info("Tracing serial traffic to %s", path)
+        
+    def stop_trace(self):
+        """Close the trace file, if any"""
+        trace, self.trace = self.trace, None
+        if trace:
+            trace.close()
+            log.info("Wrote %d trace records to %s", trace.records_written, trace.path)
+        
+    def expect_echo(self, packet: List[int], callback: Callable[[bytes], None]):
+        """Call callback from the acquisition thread when packet is echoed"""
+        self.decoder.expect_echo(bytes(packet), callback)
+        
+    def cancel_echo(self, packet: List[int], callback: Callable[[bytes], None]):
+        """Stop waiting for the echo of packet"""
+        self.decoder.cancel_echo(bytes(packet), callback)
+        
+    def flush_buffers(self):
+        """Flush input and output buffers"""
+        if self.is_connected():
+            try:
+                self.connection.reset_input_buffer()
+                self.connection.reset_output_buffer()
+            except Exception as e:
+                log.error("Error flushing buffers: %s", e)
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+PipelinedUploader - Sends a batch of command packets with several in flight
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+
+from .transport import SerialTransport
+
+
+class UploadStats:
+    """Counters of one upload, updated while it runs"""
+
+    def __init__(self):
+        self.retransmissions = 0
+        self.skipped = 0  # Packets the board already had (only_changed)
+        self.superseded = 0  # Packets dropped because a newer one replaced them
+        self.elapsed = 0.0  # Seconds until every packet was confirmed or given up
+
+
+class PipelinedUploader:
+    # Defaults
+    WINDOW = 8  # Packets sent before waiting for their echoes
+    TIMEOUT = 0.25  # Seconds before an unechoed packet is retransmitted
+    MAX_RETRIES = 3
+
+    def __init__(self, transport: SerialTransport, window: int = WINDOW,
+                 timeout: float = TIMEOUT, max_retries: int = MAX_RETRIES):
+        self.transport = transport
+        self.window = max(1, window)
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        # Statistics of the most recent upload; uploads that overlap keep
+        # their own UploadStats
+        self.stats = UploadStats()
+
+    @property
+    def retransmissions(self) -> int:
+        return self.stats.retransmissions
+
+    @property
+    def skipped(self) -> int:
+        return self.stats.skipped
+
+    @property
+    def elapsed(self) -> float:
+        return self.stats.elapsed
+
+    def upload(self, packets: List[Tuple[List[int], str]], only_changed: bool = False,
+               superseded: Optional[Callable[[int], bool]] = None,
+               stats: Optional[UploadStats] = None) -> Future:
+        """Send (packet, description) pairs without blocking the caller
+
+        Every packet is sent with SerialTransport.send_command, which resolves
+        when its echo arrives. Packets without an echo after the timeout are
+        retransmitted on their own. With only_changed, packets the board has
+        already acknowledged (see SerialTransport.device_state) are skipped.
+
+        Args:
+            superseded: Called with a packet index before every (re)send;
+                packets it returns True for have been replaced by a newer
+                upload and are dropped without counting as failed
+            stats: Counters to fill, e.g. one per step of a sequence
+
+        Returns:
+            Future: Resolves with the sorted indices of the packets that were
+            never confirmed
+        """
+        result: Future = Future()
+        result.set_running_or_notify_cancel()
+        start_time = time.monotonic()
+        stats = stats or UploadStats()
+        self.stats = stats
+
+        indices = range(len(packets))
+        if only_changed:
+            indices = self.transport.device_state.changed(packets)
+        stats.skipped += len(packets) - len(indices)
+
+        lock = threading.RLock()
+        queued = deque(indices)
+        attempts = [0] * len(packets)
+        failed = []
+        in_flight = 0
+
+        def on_done(index, future):
+            nonlocal in_flight
+            with lock:
+                in_flight -= 1
+                error = future.exception()
+                if isinstance(error, TimeoutError) and attempts[index] <= self.max_retries:
+                    queued.append(index)
+                elif error is not None:
+                    failed.append(index)
+                pump()
+
+        def pump():
+            nonlocal in_flight
+            # Keep the window full
+            while queued and in_flight < self.window:
+                index = queued.popleft()
+                if superseded is not None and superseded(index):
+                    stats.superseded += 1
+                    continue
+                packet, description = packets[index]
+                if attempts[index]:
+                    stats.retransmissions += 1
+                    description = f"{description} (retry {attempts[index]})"
+                attempts[index] += 1
+                in_flight += 1
+                future = self.transport.send_command(packet, description, self.timeout)
+                future.add_done_callback(lambda f, i=index: on_done(i, f))
+
+            if not queued and in_flight == 0 and not result.done():
+                stats.elapsed = time.monotonic() - start_time
+                result.set_result(sorted(failed))
+
+        with lock:
+            pump()
+        return result
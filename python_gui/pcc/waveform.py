@@ -0,0 +1,361 @@
+"""
+Waveform - Arbitrary per-channel profiles compiled to DAC code tables
+
+The firmware ramp only knows start/end/steps. For any other shape the host
+computes every output sample up front and uploads it as a table the board
+plays at the DAC update frequency (see the table packets in pcc.protocol).
+
+Profiles are plain dicts so they can come from JSON:
+
+    {"shape": "sine", "length": 1000, "low": 0.0, "high": 10.0, "cycles": 1, "phase": 0.0}
+    {"shape": "triangle", "length": 500, "low": 2.0, "high": 8.0, "cycles": 2}
+    {"shape": "piecewise", "length": 800, "points": [[0, 0.0], [0.25, 12.0], [1, 12.0]]}
+    {"shape": "array", "values": [0.0, 1.5, 3.0, ...]}
+
+Piecewise points are (position, volts) with positions running from 0 (first
+sample) to 1 (last sample); phase is a fraction of a cycle.
+
+WaveformCompiler renders a profile with NumPy, applies the output
+calibration, checks the result against MAX_VOLTAGE and the DAC range, and
+converts it to uint16 codes the same way protocol.volts_to_dac does. Tables
+are cached by a SHA-256 of the profile and the calibration of the channel,
+in memory and optionally in a directory of .npz files, so compiling the
+same profile again costs a dictionary lookup.
+
+TableUploader streams compiled tables as 64-byte data packets, pipelined
+with a wider window than single channel configurations.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+from . import protocol
+from .uploader import PipelinedUploader
+
+log = logging.getLogger(__name__)
+
+SHAPES = ("sine", "triangle", "piecewise", "array")
+
+# Volts per DAC code
+LSB = protocol.MAX_VOLTAGE / protocol.DAC_FULL_SCALE
+
+
+def sine(length: int, low: float, high: float, cycles: float = 1.0, phase: float = 0.0) -> np.ndarray:
+    """Sine between low and high; phase 0 starts at the midpoint, rising"""
+    t = np.arange(length) / length
+    return (low + high) / 2 + (high - low) / 2 * np.sin(2 * np.pi * (cycles * t + phase))
+
+
+def triangle(length: int, low: float, high: float, cycles: float = 1.0) -> np.ndarray:
+    """Triangle starting at low, reaching high halfway through each cycle"""
+    position = (np.arange(length) * cycles / length) % 1.0
+    return low + (high - low) * (1.0 - np.abs(2.0 * position - 1.0))
+
+
+def piecewise_linear(length: int, points: Sequence[Sequence[float]]) -> np.ndarray:
+    """Linear interpolation between (position 0..1, volts) points"""
+    points = np.asarray(points, dtype=float)
+    if points.ndim != 2 or points.shape[1] != 2 or len(points) < 2:
+        raise ValueError("A piecewise profile needs at least two [position, volts] points")
+    if np.any(np.diff(points[:, 0]) < 0):
+        raise ValueError("Piecewise profile positions must not decrease")
+    positions = np.arange(length) / max(1, length - 1)
+    return np.interp(positions, points[:, 0], points[:, 1])
+
+
+def render(profile: Dict[str, Any]) -> np.ndarray:
+    """Voltages of a profile, one per table entry"""
+    shape = profile.get("shape")
+    try:
+        if shape == "array":
+            return np.asarray(profile["values"], dtype=float).reshape(-1)
+        length = int(profile["length"])
+        if not 0 < length <= protocol.MAX_TABLE_LENGTH:
+            raise ValueError(f"Table length must be between 1 and {protocol.MAX_TABLE_LENGTH}, got {length}")
+        if shape == "sine":
+            return sine(length, float(profile["low"]), float(profile["high"]),
+                        float(profile.get("cycles", 1.0)), float(profile.get("phase", 0.0)))
+        if shape == "triangle":
+            return triangle(length, float(profile["low"]), float(profile["high"]),
+                            float(profile.get("cycles", 1.0)))
+        if shape == "piecewise":
+            return piecewise_linear(length, profile["points"])
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Invalid {shape} profile: missing or bad {e}")
+    raise ValueError(f"Unknown profile shape {shape!r}, expected one of {', '.join(SHAPES)}")
+
+
+def profile_key(profile: Dict[str, Any]) -> str:
+    """Canonical text of a profile; arrays are replaced by a digest of their values"""
+    def canonical(value):
+        if isinstance(value, np.ndarray):
+            return hashlib.sha256(np.ascontiguousarray(value, dtype=float).tobytes()).hexdigest()
+        if isinstance(value, dict):
+            return {k: canonical(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [canonical(v) for v in value]
+        return value
+
+    return json.dumps(canonical(profile), sort_keys=True)
+
+
+class WaveformTable:
+    def __init__(self, channel: int, codes: np.ndarray, hold_end: bool = False,
+                 quantisation_error: float = 0.0, key: str = ""):
+        """
+        Args:
+            channel: Zero-based channel
+            codes: Read-only uint16 DAC codes, played in order
+            hold_end: Hold the last code instead of repeating the table
+            quantisation_error: Largest difference between a requested and an
+                encoded voltage, in volts
+            key: Content hash the table was cached under
+        """
+        self.channel = channel
+        self.codes = codes
+        self.hold_end = hold_end
+        self.quantisation_error = quantisation_error
+        self.key = key
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def begin_packet(self) -> List[int]:
+        return protocol.table_begin_packet(self.channel, len(self.codes))
+
+    def data_packets(self) -> List[List[int]]:
+        """Packets carrying the codes, TABLE_CHUNK_CODES at a time"""
+        codes = self.codes.tolist()
+        chunk = protocol.TABLE_CHUNK_CODES
+        return [protocol.table_data_packet(self.channel, offset, codes[offset:offset + chunk])
+                for offset in range(0, len(codes), chunk)]
+
+    def commit_packet(self) -> List[int]:
+        return protocol.table_commit_packet(self.channel, self.codes.tolist(), self.hold_end)
+
+
+class WaveformCompiler:
+    # Defaults
+    MAX_CACHED = 256  # Tables kept in memory
+
+    def __init__(self, calibration=None, max_voltage: float = protocol.MAX_VOLTAGE,
+                 cache_dir: Optional[str] = None, max_cached: int = MAX_CACHED):
+        """
+        Args:
+            calibration: Optional pcc.calibration.Calibration whose output
+                correction is applied to the codes
+            max_voltage: Highest voltage a profile may request
+            cache_dir: Directory keeping compiled tables across runs
+            max_cached: Tables kept in memory, least recently used dropped first
+        """
+        self.calibration = calibration
+        self.max_voltage = max_voltage
+        self.cache_dir = cache_dir
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[str, Tuple[np.ndarray, float]]" = OrderedDict()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    def _calibration_key(self, channel: int) -> str:
+        """Part of the cache key that depends on the channel"""
+        calibration = self.calibration
+        if calibration is None:
+            return ""  # Every channel encodes the same way
+        if channel in calibration.output_points:
+            x, y = calibration.output_points[channel]
+            return f"points:{x.tolist()}:{y.tolist()}"
+        return f"linear:{calibration.output_gain[channel]!r}:{calibration.output_offset[channel]!r}"
+
+    def key(self, channel: int, profile: Dict[str, Any]) -> str:
+        """Content hash identifying the compiled table"""
+        text = f"{profile_key(profile)}|{self._calibration_key(channel)}|{self.max_voltage!r}"
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def compile(self, channel: int, profile: Dict[str, Any], hold_end: bool = False) -> WaveformTable:
+        """Compile a profile for a zero-based channel, reusing cached tables
+
+        Raises:
+            ValueError: The profile is malformed, leaves 0-MAX_VOLTAGE or the
+                DAC range after calibration, or varies by less than one DAC step
+        """
+        if not 0 <= channel < protocol.NUM_CHANNELS:
+            raise ValueError(f"Channel must be between 1 and {protocol.NUM_CHANNELS}, got {channel + 1}")
+        key = self.key(channel, profile)
+        cached = self._lookup(key)
+        if cached is not None:
+            self.hits += 1
+            codes, error = cached
+        else:
+            self.misses += 1
+            codes, error = self._encode(channel, render(profile))
+            self._store(key, codes, error)
+        return WaveformTable(channel, codes, hold_end, error, key)
+
+    def _encode(self, channel: int, voltages: np.ndarray):
+        """Check voltages and convert them to (read-only codes, quantisation error)"""
+        where = f"on channel {channel + 1}"
+        if not 0 < len(voltages) <= protocol.MAX_TABLE_LENGTH:
+            raise ValueError(f"Table length must be between 1 and {protocol.MAX_TABLE_LENGTH} {where}")
+        if not np.all(np.isfinite(voltages)):
+            raise ValueError(f"Profile contains non-finite values {where}")
+        low, high = voltages.min(), voltages.max()
+        if low < 0 or high > self.max_voltage:
+            index = int(np.argmax((voltages < 0) | (voltages > self.max_voltage)))
+            raise ValueError(f"Profile voltage {voltages[index]:.3f} V at sample {index} "
+                             f"out of range (0-{self.max_voltage}V) {where}")
+
+        if self.calibration is not None:
+            voltages = self.calibration.corrected_voltages(channel, voltages)
+        exact = voltages * (protocol.DAC_FULL_SCALE / protocol.MAX_VOLTAGE)
+        # Truncate like volts_to_dac so tables and ramps agree on every voltage
+        codes = exact.astype(np.int64)
+        if codes.min() < 0 or codes.max() > protocol.DAC_FULL_SCALE:
+            raise ValueError(f"Calibrated profile exceeds the DAC range {where}")
+        if high - low > 0 and codes.min() == codes.max():
+            raise ValueError(f"Profile varies by {high - low:.2e} V, less than one DAC step "
+                             f"({LSB:.2e} V) {where}")
+
+        error = float(np.max(exact - codes)) * LSB
+        codes = codes.astype(np.uint16)
+        codes.flags.writeable = False  # Shared by every table using the cache entry
+        return codes, error
+
+    def _lookup(self, key: str) -> Optional[Tuple[np.ndarray, float]]:
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, f"{key}.npz")
+            if os.path.exists(path):
+                with np.load(path) as data:
+                    codes, error = data["codes"], float(data["error"])
+                codes.flags.writeable = False
+                self._remember(key, (codes, error))
+                return codes, error
+        return None
+
+    def _store(self, key: str, codes: np.ndarray, error: float):
+        self._remember(key, (codes, error))
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            np.savez(os.path.join(self.cache_dir, f"{key}.npz"), codes=codes, error=error)
+
+    def _remember(self, key: str, entry: Tuple[np.ndarray, float]):
+        self._cache[key] = entry
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        """Drop the in-memory cache"""
+        self._cache.clear()
+
+
+class TableUploader:
+    # Defaults
+    WINDOW = 16  # Data packets in flight; each carries TABLE_CHUNK_CODES codes
+
+    def __init__(self, transport, window: int = WINDOW, timeout: float = PipelinedUploader.TIMEOUT):
+        self.transport = transport
+        self.uploader = PipelinedUploader(transport, window=window, timeout=timeout)
+
+        # Statistics of the last upload
+        self.packets_sent = 0
+        self.bytes_sent = 0
+        self.skipped = 0  # Tables the board was already playing
+        self.elapsed = 0.0
+
+    def upload(self, tables: Sequence[WaveformTable], only_changed: bool = True) -> Future:
+        """Stage, fill and commit tables without blocking the caller
+
+        Begin packets go first, then the data packets of every table
+        pipelined together, then the commits. A table that loses a packet
+        is left out of the later phases. With only_changed, tables whose
+        commit the board has already acknowledged are not sent again.
+
+        Returns:
+            Future: Resolves with the sorted zero-based channels whose table
+            was not committed
+        """
+        result: Future = Future()
+        result.set_running_or_notify_cancel()
+        start_time = time.monotonic()
+        self.packets_sent = self.bytes_sent = 0
+
+        commits = [(table.commit_packet(), f"Channel {table.channel + 1} table commit")
+                   for table in tables]
+        pending = list(range(len(tables)))
+        if only_changed:
+            state = self.transport.device_state
+            pending = [i for i in pending if not state.is_current(commits[i][0])]
+        self.skipped = len(tables) - len(pending)
+        failed: List[int] = []
+
+        def run(phase, indices):
+            """Send one phase for the tables at indices, then continue"""
+            packets, owners = [], []
+            for i in indices:
+                for packet, description in phase(i):
+                    packets.append((packet, description))
+                    owners.append(i)
+            self.packets_sent += len(packets)
+            self.bytes_sent += sum(len(packet) for packet, _ in packets)
+            return self.uploader.upload(packets), owners
+
+        def next_phase(phases, indices):
+            if not phases or not indices:
+                self.elapsed = time.monotonic() - start_time
+                log.info("Uploaded %d tables (%d bytes) in %.1f ms", len(indices),
+                         self.bytes_sent, self.elapsed * 1000)
+                result.set_result(sorted(tables[i].channel for i in failed))
+                return
+            future, owners = run(phases[0], indices)
+
+            def on_done(done):
+                lost = {owners[k] for k in done.result()}
+                failed.extend(sorted(lost))
+                next_phase(phases[1:], [i for i in indices if i not in lost])
+
+            future.add_done_callback(on_done)
+
+        def begin(i):
+            table = tables[i]
+            return [(table.begin_packet(), f"Channel {table.channel + 1} table begin")]
+
+        def data(i):
+            table = tables[i]
+            chunk = protocol.TABLE_CHUNK_CODES
+            return [(packet, f"Channel {table.channel + 1} table codes {n * chunk}-"
+                             f"{min(len(table), (n + 1) * chunk) - 1}")
+                    for n, packet in enumerate(table.data_packets())]
+
+        next_phase([begin, data, lambda i: [commits[i]]], pending)
+        return result
+
+
+def load_waveforms(path: str) -> Dict[int, Tuple[Dict[str, Any], bool]]:
+    """Read {"channels": {"1": profile, ...}} from JSON
+
+    Returns zero-based channel -> (profile, hold_end). A profile may carry
+    "hold_end": true to stop on its last sample instead of repeating.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    try:
+        waveforms = {}
+        for channel, profile in data["channels"].items():
+            profile = dict(profile)
+            hold_end = bool(profile.pop("hold_end", False))
+            waveforms[int(channel) - 1] = (profile, hold_end)
+        return waveforms
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f"Invalid waveform file: {e}")
@@ -0,0 +1,138 @@
+"""
+SerialLog - Bounded, batched log view for the serial monitor
+"""
+
+import datetime
+import html
+import time
+from collections import deque
+from typing import Deque, Dict, Tuple
+from PyQt6.QtWidgets import QPlainTextEdit
+from PyQt6.QtCore import QTimer
+
+
+class SerialLog(QPlainTextEdit):
+    # Constants
+    MAX_LINES = 5000  # Oldest lines are discarded beyond this
+    FLUSH_INTERVAL_MS = 100  # Pending messages are written at this rate
+    MAX_PENDING = 1000  # Messages kept between flushes
+
+    # Prefix and colour of each message category
+    CATEGORIES = {
+        "sent": ("TX", "#00ff00"),
+        "received": ("RX", "#00aaff"),
+        "telemetry": ("RX", "#00aaff"),
+        "error": ("ERR", "#ff4444"),
+        "connection": ("CONN", "#ffaa00"),
+        "info": ("INFO", "#ffffff"),
+    }
+
+    # Messages per second allowed for each category; others are unlimited
+    RATE_LIMITS = {
+        "sent": 50.0,
+        "received": 20.0,
+    }
+
+    # Only the latest message of these categories is shown, at most once per interval
+    SAMPLE_INTERVALS = {
+        "telemetry": 1.0,
+    }
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setReadOnly(True)
+        self.setMaximumBlockCount(self.MAX_LINES)
+        self.auto_scroll = True
+
+        self._pending: Deque[str] = deque(maxlen=self.MAX_PENDING)
+        self._tokens: Dict[str, Tuple[float, float]] = {}  # category -> (tokens, last refill)
+        self._samples: Dict[str, str] = {}  # category -> latest message
+        self._last_sample: Dict[str, float] = {}
+        self._suppressed: Dict[str, int] = {}
+
+        # Statistics
+        self.messages_logged = 0
+        self.messages_suppressed = 0
+
+        self._flush_timer = QTimer(self)
+        self._flush_timer.timeout.connect(self.flush)
+        self._flush_timer.start(self.FLUSH_INTERVAL_MS)
+
+    def log(self, message: str, category: str = "info"):
+        """Queue a message; it is shown at the next flush"""
+        if category in self.SAMPLE_INTERVALS:
+            self._samples[category] = message
+            return
+        if not self.allow(category):
+            self.suppress(category)
+            return
+        if len(self._pending) == self.MAX_PENDING:
+            self.messages_suppressed += 1  # The oldest pending message is dropped
+        self._pending.append(self.format_message(message, category))
+
+    def suppress(self, category: str):
+        """Count a message that was dropped by its rate limit"""
+        self._suppressed[category] = self._suppressed.get(category, 0) + 1
+        self.messages_suppressed += 1
+
+    def allow(self, category: str) -> bool:
+        """Take a token from the category's rate limit, if it has one
+
+        Callers can check this before formatting an expensive message.
+        """
+        rate = self.RATE_LIMITS.get(category)
+        if rate is None:
+            return True
+        now = time.monotonic()
+        tokens, last = self._tokens.get(category, (rate, now))
+        tokens = min(rate, tokens + (now - last) * rate)
+        if tokens < 1.0:
+            self._tokens[category] = (tokens, now)
+            return False
+        self._tokens[category] = (tokens - 1.0, now)
+        return True
+
+    def format_message(self, message: str, category: str) -> str:
+        """Build the HTML line for a message"""
+        timestamp = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+        prefix, color = self.CATEGORIES.get(category, self.CATEGORIES["info"])
+        return (f'<span style="color: #888888">[{timestamp}]</span> '
+                f'<span style="color: {color}; font-weight: bold">{prefix}:</span> '
+                f'<span style="color: {color}">{html.escape(message)}</span>')
+
+    def flush(self):
+        """Write pending messages, due samples and suppression notes"""
+        now = time.monotonic()
+        for category, message in list(self._samples.items()):
+            if now - self._last_sample.get(category, 0.0) >= self.SAMPLE_INTERVALS[category]:
+                self._pending.append(self.format_message(message, category))
+                self._last_sample[category] = now
+                del self._samples[category]
+
+        for category, count in self._suppressed.items():
+            prefix, _ = self.CATEGORIES.get(category, self.CATEGORIES["info"])
+            self._pending.append(self.format_message(f"{count} {prefix} messages suppressed", "info"))
+        self._suppressed.clear()
+
+        if not self._pending:
+            return
+
+        # One repaint for the whole batch
+        self.setUpdatesEnabled(False)
+        try:
+            while self._pending:
+                self.appendHtml(self._pending.popleft())
+                self.messages_logged += 1
+        finally:
+            self.setUpdatesEnabled(True)
+
+        if self.auto_scroll:
+            scrollbar = self.verticalScrollBar()
+            scrollbar.setValue(scrollbar.maximum())
+
+    def clear(self):
+        """Clear the view and everything still pending"""
+        super().clear()
+        self._pending.clear()
+        self._samples.clear()
+        self._suppressed.clear()
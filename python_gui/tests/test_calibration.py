@@ -0,0 +1,35 @@
+"""Calibration: fitting the output stages of the simulator and applying the result"""
+
+import numpy as np
+
+from pcc import protocol
+from pcc.calibration import Calibration, calibrate_outputs
+from pcc.simulator import PCCSimulator
+from pcc.transport import SerialTransport
+
+
+def test_calibrated_outputs_hit_the_requested_voltage(tmp_path):
+    gain = np.linspace(0.98, 1.02, protocol.NUM_CHANNELS)
+    offset = np.linspace(-0.1, 0.1, protocol.NUM_CHANNELS)
+    with PCCSimulator(2000, seed=1) as simulator:
+        simulator.gain_error[:] = gain
+        simulator.offset_error[:] = offset
+        transport = SerialTransport()
+        assert transport.connect(simulator.port)
+        try:
+            calibration = calibrate_outputs(transport, (2.0, 15.0, 28.0), samples=50, settle=0.02)
+        finally:
+            transport.disconnect()
+
+    lsb = protocol.MAX_VOLTAGE / protocol.DAC_FULL_SCALE
+    np.testing.assert_allclose(calibration.output_gain, gain, atol=1e-3)
+    np.testing.assert_allclose(calibration.output_offset, offset, atol=2 * lsb)
+
+    # Encoding inverts the fit: the stage then outputs what was asked for
+    path = str(tmp_path / "calibration.json")
+    calibration.save(path)
+    loaded = Calibration.load(path)
+    for channel in (0, protocol.NUM_CHANNELS - 1):
+        code = loaded.dac_code(channel, 10.0)
+        output = code * protocol.MAX_VOLTAGE / protocol.DAC_FULL_SCALE * gain[channel] + offset[channel]
+        assert abs(output - 10.0) < 2 * lsb
@@ -0,0 +1,134 @@
+"""FrameDecoder: frames, command echoes and the frame formats in one stream"""
+
+import struct
+
+import numpy as np
+
+from pcc import protocol
+from pcc.convert import FrameConverter
+from pcc.decoder import FrameDecoder
+
+
+def legacy_frame(codes):
+    return bytes([protocol.START_BYTE]) + struct.pack(f'<{protocol.NUM_CHANNELS}H', *codes) \
+        + bytes([protocol.END_BYTE])
+
+
+def extended_frame(sequence, codes):
+    frame = bytes([protocol.START_BYTE]) + struct.pack('<H', sequence) \
+        + struct.pack(f'<{protocol.NUM_CHANNELS}H', *codes)
+    return frame + struct.pack('>H', protocol.frame_crc(frame + b'\0\0\0')) + bytes([protocol.END_BYTE])
+
+
+def echo_recorder(decoder, packet):
+    echoes = []
+    decoder.expect_echo(bytes(packet), echoes.append)
+    return echoes
+
+
+def test_frame_starting_like_an_echo_is_not_taken_for_it():
+    for packet, ch1 in ((protocol.start_packet(), 0x0204), (protocol.stop_packet(), 0x0804)):
+        # ch1 and the low byte of ch2 spell out the echo after the start marker
+        frame = legacy_frame([ch1, 0x0100] + [1000] * (protocol.NUM_CHANNELS - 2))
+        assert frame.startswith(bytes(packet))
+        decoder = FrameDecoder()
+        echoes = echo_recorder(decoder, packet)
+
+        assert decoder.feed(frame * 3) == [frame] * 3
+        assert echoes == []
+        assert decoder.bytes_dropped == 0
+
+        # The real echo follows; it is held while it could start a frame
+        assert decoder.feed(bytes(packet)) == []
+        assert decoder.feed(b'', idle=True) == []
+        assert echoes == [bytes(packet)]
+        assert decoder.pending_bytes == 0
+
+
+def test_echo_between_frames():
+    frame = legacy_frame(range(protocol.NUM_CHANNELS))
+    decoder = FrameDecoder()
+    echoes = echo_recorder(decoder, protocol.start_packet())
+
+    assert decoder.feed(frame + bytes(protocol.start_packet()) + frame) == [frame, frame]
+    assert echoes == [bytes(protocol.start_packet())]
+    assert decoder.bytes_dropped == 0
+
+
+def test_echo_is_matched_right_away_without_frames():
+    decoder = FrameDecoder()
+    echoes = echo_recorder(decoder, protocol.frequency_packet(1000))
+
+    assert decoder.feed(bytes(protocol.frequency_packet(1000))) == []
+    assert echoes == [bytes(protocol.frequency_packet(1000))]
+
+
+def test_format_echo_alone_does_not_switch():
+    # The firmware echoes the format command but keeps sending legacy frames
+    frame = legacy_frame([3000] * protocol.NUM_CHANNELS)
+    packet = protocol.frame_format_packet(protocol.FRAME_EXTENDED)
+    decoder = FrameDecoder()
+    echoes = echo_recorder(decoder, packet)
+
+    frames = decoder.feed(frame * 2 + bytes(packet) + frame * 5)
+    frames += decoder.feed(b'', idle=True)
+    assert frames == [frame] * 7
+    assert echoes == [bytes(packet)]
+    assert decoder.frame_format == decoder.requested_format == protocol.FRAME_LEGACY
+    assert decoder.bytes_dropped == 0
+
+
+def test_legacy_frames_end_extended_decoding():
+    # A board reset while sending extended frames
+    codes = [3000] * protocol.NUM_CHANNELS
+    decoder = FrameDecoder(protocol.FRAME_EXTENDED)
+
+    extended = b''.join(extended_frame(i, codes) for i in range(3))
+    assert len(decoder.feed(extended)) == 3
+    assert decoder.feed(legacy_frame(codes) * 4) == [legacy_frame(codes)] * 4
+    assert decoder.frame_format == protocol.FRAME_LEGACY
+    assert decoder.bytes_dropped == 0
+
+
+def test_feed_returns_one_frame_size_per_call():
+    # Legacy frames, the format echo and extended frames in one chunk
+    codes = [1000 + i for i in range(protocol.NUM_CHANNELS)]
+    packet = protocol.frame_format_packet(protocol.FRAME_EXTENDED)
+    chunk = (legacy_frame(codes) * 3 + bytes(packet)
+             + extended_frame(0, codes) + extended_frame(1, codes))
+    decoder = FrameDecoder()
+    echo_recorder(decoder, packet)
+
+    legacy = decoder.feed(chunk)
+    assert legacy == [legacy_frame(codes)] * 3
+    assert decoder.frames_pending
+    extended = decoder.feed(b'')
+    assert extended == [extended_frame(0, codes), extended_frame(1, codes)]
+    assert not decoder.frames_pending
+
+    converter = FrameConverter()
+    expected = np.float32(protocol.MAX_VOLTAGE / protocol.DAC_FULL_SCALE) * np.array(codes, dtype=np.float32)
+    for frames in (legacy, extended):
+        np.testing.assert_allclose(converter.convert(frames), np.tile(expected, (len(frames), 1)), rtol=1e-6)
+
+
+def test_table_echo_ending_like_a_frame_is_not_taken_for_one():
+    # Byte 49 of the echo, the low byte of code 21, is the end marker
+    codes = [0x1000 + i for i in range(protocol.TABLE_CHUNK_CODES)]
+    codes[21] = 0x1255
+    packet = bytes(protocol.table_data_packet(0, 0, codes))
+    assert len(packet) > protocol.FRAME_SIZE and packet[protocol.FRAME_SIZE - 1] == protocol.END_BYTE
+    frame = legacy_frame(range(protocol.NUM_CHANNELS))
+
+    # Alone, right after a frame and split before its end
+    for chunks, count in (([packet], 0), ([frame + packet + frame], 2),
+                          ([frame + packet[:55], packet[55:] + frame], 2)):
+        decoder = FrameDecoder()
+        echoes = echo_recorder(decoder, packet)
+        frames = []
+        for chunk in chunks:
+            frames += decoder.feed(chunk)
+        frames += decoder.feed(b'', idle=True)
+        assert echoes == [packet]
+        assert frames == [frame] * count
+        assert decoder.bytes_dropped == 0
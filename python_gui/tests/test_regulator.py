@@ -0,0 +1,56 @@
+"""ClosedLoopRegulator holding channels of a simulated board with gain errors"""
+
+import time
+
+import numpy as np
+
+from pcc import protocol
+from pcc.regulator import ClosedLoopRegulator
+from pcc.simulator import PCCSimulator
+from pcc.transport import SerialTransport
+
+TARGET = 10.0
+CHANNELS = range(4)
+
+
+def regulate(gain, duration=1.5):
+    """Hold CHANNELS at TARGET on a board whose readback is scaled by gain"""
+    with PCCSimulator(2000, seed=1) as simulator:
+        simulator.gain_error[:] = gain
+        transport = SerialTransport()
+        assert transport.connect(simulator.port)
+        try:
+            regulator = ClosedLoopRegulator(transport)
+            regulator.set_targets({channel: TARGET for channel in CHANNELS})
+            for channel in CHANNELS:
+                packet = protocol.channel_config_packet(channel, TARGET, TARGET, 1, True)
+                transport.send_command(packet).result(5)
+            transport.send_command(protocol.start_packet()).result(5)
+            assert regulator.start()
+            time.sleep(duration)
+            regulator.stop(restore=False)
+            transport.send_command(protocol.stop_packet()).result(5)
+            return regulator, simulator.start_codes[list(CHANNELS)].copy()
+        finally:
+            transport.disconnect()
+
+
+def test_converges_within_the_trim_limit():
+    regulator, codes = regulate(0.97)
+    base = protocol.volts_to_dac(TARGET)
+    # Within one LSB of the readback, which reads 3% low
+    lsb = protocol.MAX_VOLTAGE / protocol.DAC_FULL_SCALE
+    assert np.all(np.abs(regulator.error[list(CHANNELS)]) < 2 * lsb)
+    np.testing.assert_allclose(codes, base / 0.97, atol=2)
+    assert np.all(codes - base <= regulator.max_trim)
+    assert regulator.saturated == 0
+    assert regulator.corrections_failed == 0
+
+
+def test_correction_stops_at_the_trim_limit():
+    # 10% low needs about 1.1 V, more than MAX_TRIM
+    regulator, codes = regulate(0.9)
+    base = protocol.volts_to_dac(TARGET)
+    np.testing.assert_allclose(codes, base + regulator.max_trim, atol=1)
+    assert regulator.saturated > 0
+    assert np.all(regulator.error[list(CHANNELS)] > 0)
@@ -0,0 +1,52 @@
+"""SequenceRunner against the simulator"""
+
+import time
+
+from pcc import protocol
+from pcc.sequence import SequenceRunner, SequenceStep
+from pcc.simulator import PCCSimulator
+from pcc.transport import SerialTransport
+
+
+def test_later_step_supersedes_unconfirmed_packets():
+    # Echoes take longer than the uploader's timeout, so the packet of every
+    # step is due for a retransmit after the next step has sent its channel
+    with PCCSimulator(ack_delay=0.35, seed=1) as simulator:
+        transport = SerialTransport()
+        assert transport.connect(simulator.port)
+        try:
+            steps = [SequenceStep(0.02, {0: 5.0}), SequenceStep(0.02, {0: 0.0}),
+                     SequenceStep(0.02, {0: 5.0})]
+            runner = SequenceRunner(transport, steps)
+            runner.start()
+            assert runner.wait(5)
+            deadline = time.monotonic() + 5
+            while None in runner.confirm_ns and time.monotonic() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.5)  # Let the late echoes arrive
+
+            assert runner.failed_steps == []
+            assert [stats.superseded for stats in runner.upload_stats] == [1, 1, 0]
+            assert [stats.retransmissions for stats in runner.upload_stats[:2]] == [0, 0]
+            assert simulator.start_codes[0] == protocol.volts_to_dac(5.0)
+        finally:
+            transport.disconnect()
+
+
+def test_return_to_an_earlier_value_is_sent():
+    # The board still holds step 1's value when step 3 returns to it
+    with PCCSimulator(seed=1) as simulator:
+        transport = SerialTransport()
+        assert transport.connect(simulator.port)
+        try:
+            transport.send_command(protocol.channel_config_packet(0, 5.0, 5.0, 1, True)).result(5)
+            steps = [SequenceStep(0.05, {0: 5.0}), SequenceStep(0.05, {0: 0.0}),
+                     SequenceStep(0.05, {0: 5.0})]
+            runner = SequenceRunner(transport, steps)
+            runner.start()
+            assert runner.wait(5)
+
+            assert [stats.skipped for stats in runner.upload_stats] == [1, 0, 0]
+            assert simulator.start_codes[0] == protocol.volts_to_dac(5.0)
+        finally:
+            transport.disconnect()
@@ -0,0 +1,88 @@
+"""TelemetryServer: requests, subscriptions and the drop policies"""
+
+import asyncio
+import socket
+
+import numpy as np
+import pytest
+
+from pcc import protocol
+from pcc.server import (DISCONNECT, DROP_NEWEST, DROP_OLDEST, Batch, ClientSession,
+                        TelemetryClient, TelemetryServer)
+from pcc.simulator import PCCSimulator
+from pcc.transport import SerialTransport
+
+
+def batch(sequence, rows=1):
+    return Batch(sequence, 0, rows, bytes(2 * protocol.NUM_CHANNELS * rows))
+
+
+async def session(server):
+    """ClientSession on one end of a socket pair, without its loops running"""
+    ours, _theirs = socket.socketpair()
+    reader, writer = await asyncio.open_connection(sock=ours)
+    return ClientSession(server, reader, writer)
+
+
+@pytest.mark.parametrize("policy, kept, dropped", [
+    (DROP_OLDEST, [2, 3], 2),
+    (DROP_NEWEST, [0, 1], 2),
+])
+def test_full_queue_applies_the_drop_policy(policy, kept, dropped):
+    async def run():
+        client = await session(None)
+        client.subscribe(2, policy)
+        for sequence in range(4):
+            client.offer(batch(sequence))
+        assert [b.sequence for b in client.batches] == kept
+        assert client.rows_dropped == dropped
+        client.close()
+
+    asyncio.run(run())
+
+
+def test_full_queue_disconnects_with_that_policy():
+    async def run():
+        client = await session(None)
+        client.subscribe(2, DISCONNECT)
+        for sequence in range(3):
+            client.offer(batch(sequence))
+        assert client.closing
+
+    asyncio.run(run())
+
+
+def test_subscriber_receives_telemetry_and_configures_channels():
+    async def run(transport, simulator):
+        server = TelemetryServer(transport)
+        await server.start("127.0.0.1:0")
+        client = TelemetryClient()
+        await client.connect(server.addresses[0])
+        try:
+            result = await client.request("config", channels=[{"channel": 1, "start": 5.0}])
+            assert result["failed"] == []
+            assert simulator.start_codes[0] == protocol.volts_to_dac(5.0)
+
+            await client.subscribe(policy=DROP_OLDEST)
+            await client.request("start")
+            rows = 0
+            async for received in client.batches():
+                assert received.raw.shape[1] == protocol.NUM_CHANNELS
+                assert np.all(received.raw[:, 0] == protocol.volts_to_dac(5.0))
+                rows += len(received.raw)
+                if rows >= 100:
+                    break
+            await client.request("stop")
+            stats = await client.request("stats")
+            assert stats["subscribers"] == 1 and stats["rows_dropped"] == 0
+        finally:
+            await client.close()
+            await server.close()
+
+    with PCCSimulator(2000, seed=1) as simulator:
+        transport = SerialTransport()
+        assert transport.connect(simulator.port)
+        try:
+            asyncio.run(asyncio.wait_for(run(transport, simulator), 10))
+        finally:
+            transport.disconnect()
@@ -0,0 +1,105 @@
+"""SharedRing and RingReader: publishing, overruns and intact()"""
+
+import multiprocessing
+import struct
+import time
+
+import numpy as np
+import pytest
+
+from pcc import protocol
+from pcc.shared import CLAIM_FIELD, RingReader, SharedRing
+
+CAPACITY = 64
+
+
+def frames(first, count):
+    """Legacy frames whose readings are all their row number"""
+    return [bytes([protocol.START_BYTE]) + struct.pack('<H', row) * protocol.NUM_CHANNELS
+            + bytes([protocol.END_BYTE]) for row in range(first, first + count)]
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRing.create(CAPACITY, lock=multiprocessing.Lock())
+    yield ring
+    ring.close()
+
+
+def test_reader_gets_published_rows(ring):
+    reader = RingReader(ring)
+    ring.write_frames(frames(0, 10), 123)
+
+    times, raw = reader.read()
+    assert len(raw) == 10
+    np.testing.assert_array_equal(raw[:, 0], np.arange(10))
+    np.testing.assert_array_equal(times, 123)
+    assert reader.intact()
+    assert reader.behind == 0
+    assert len(reader.read()[1]) == 0
+
+
+def test_lapped_reader_skips_ahead(ring):
+    reader = RingReader(ring)
+    ring.write_frames(frames(0, 3 * CAPACITY), 0)
+
+    _, raw = reader.read()
+    # Rows the writer may overwrite next are left out as well
+    skip_to = 3 * CAPACITY - CAPACITY + min(RingReader.SLACK, CAPACITY // 2)
+    assert reader.rows_lost == skip_to
+    assert raw[0, 0] == skip_to
+    assert reader.intact()
+    rows = len(raw) + len(reader.read()[1])
+    assert rows == 3 * CAPACITY - skip_to
+    assert reader.rows_read == rows
+
+
+def test_overwritten_rows_are_not_intact(ring):
+    reader = RingReader(ring)
+    ring.write_frames(frames(0, 10), 0)
+    _, raw = reader.read()
+
+    # The writer comes round and reuses the slots of the rows just read
+    ring.write_frames(frames(10, CAPACITY), 0)
+    assert raw[0, 0] == CAPACITY
+    assert not reader.intact()
+    assert reader.rows_lost == 10
+    assert reader.rows_read == 0
+
+
+def test_rows_are_claimed_before_they_are_overwritten(ring):
+    reader = RingReader(ring)
+    ring.write_frames(frames(0, 10), 0)
+    reader.read()
+    # A write in progress: claimed but not yet published
+    ring.header[CLAIM_FIELD] = 10 + CAPACITY
+    assert ring.sequence == 10
+    assert not reader.intact()
+
+
+def test_process_transport_fills_the_ring():
+    from pcc.shared import ProcessTransport
+    from pcc.simulator import PCCSimulator
+
+    with PCCSimulator(2000, seed=1) as simulator:
+        transport = ProcessTransport(capacity=4096)
+        assert transport.connect(simulator.port)
+        try:
+            assert not transport.add_frame_listener(lambda frames, time_ns: None)
+            reader = RingReader(transport.ring)
+            transport.send_command(protocol.channel_config_packet(0, 5.0, 5.0, 1, True)).result(5)
+            transport.send_command(protocol.start_packet()).result(5)
+            rows = []
+            for _ in range(200):
+                _, raw = reader.read()
+                if len(raw):
+                    rows.append(raw[:, 0].copy())
+                    assert reader.intact()
+                if sum(len(r) for r in rows) >= 100:
+                    break
+                time.sleep(0.01)
+            assert sum(len(r) for r in rows) >= 100
+            assert np.concatenate(rows)[-1] == protocol.volts_to_dac(5.0)
+            assert transport.ring.writer_alive()
+        finally:
+            transport.disconnect()
@@ -0,0 +1,37 @@
+"""TableUploader: full-length waveform tables against the simulator"""
+
+import numpy as np
+
+from pcc import protocol
+from pcc.simulator import PCCSimulator
+from pcc.transport import SerialTransport
+from pcc.waveform import TableUploader, WaveformCompiler, WaveformTable
+
+
+def test_full_length_table_upload():
+    profile = {"shape": "sine", "length": protocol.MAX_TABLE_LENGTH, "low": 1.0, "high": 20.0}
+    tables = [WaveformCompiler().compile(channel, profile) for channel in range(2)]
+    # Every data echo of this one has the frame end marker at byte 49
+    codes = np.full(protocol.MAX_TABLE_LENGTH - 1, 0x1255, dtype=np.uint16)
+    tables.append(WaveformTable(2, codes, hold_end=True))
+
+    with PCCSimulator(seed=1) as simulator:
+        transport = SerialTransport()
+        assert transport.connect(simulator.port)
+        try:
+            uploader = TableUploader(transport)
+            assert uploader.upload(tables).result(30) == []
+            assert uploader.uploader.retransmissions == 0
+            # Nothing was streaming, so no echo may have passed as a frame
+            assert transport.decoder.frames_decoded == 0
+
+            assert simulator.table_errors == 0
+            for table in tables:
+                np.testing.assert_array_equal(simulator.tables[table.channel], table.codes)
+            assert simulator.table_hold[2]
+
+            # Committed tables are skipped on the next upload
+            assert uploader.upload(tables).result(5) == []
+            assert uploader.skipped == len(tables)
+        finally:
+            transport.disconnect()
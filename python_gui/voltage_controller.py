@@ -2,32 +2,57 @@
 VoltageController - Main GUI for controlling voltage channels
 """
 
+import math
 import sys
-import struct
-import time
+from concurrent.futures import Future
 from typing import List, Optional
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QGridLayout, QLabel, 
     QPushButton, QSpinBox, QDoubleSpinBox, QCheckBox, QComboBox,
-    QScrollArea, QFrame, QMessageBox, QApplication, QTextEdit,
-    QSplitter, QPushButton
+    QScrollArea, QFrame, QMessageBox, QApplication,
+    QSplitter, QPushButton, QFileDialog
 )
 from PyQt6.QtCore import Qt, QTimer, pyqtSignal
 from PyQt6.QtGui import QFont
 
+from pcc import protocol
+from pcc.sequence import SequenceRunner, channel_staircases
+from pcc.state import load_preset, save_preset
+from pcc.uploader import PipelinedUploader
 from serial_manager import SerialManager
-from voltage_monitor import VoltageMonitor
+from serial_log import SerialLog
+
+# voltage_monitor (numpy, pyqtgraph), pcc.recording and pcc.regulator (numpy)
+# are imported on first use so the main window comes up without the plotting stack
 
 class VoltageController(QWidget):
+    # Signals
+    command_completed = pyqtSignal(object, object)  # handler, future
+    sequence_finished = pyqtSignal(object)  # Timing report of a host-timed sweep
+    
     # Constants
-    MAX_VOLTAGE = 30
-    NUM_CHANNELS = 24
+    MAX_VOLTAGE = protocol.MAX_VOLTAGE
+    NUM_CHANNELS = protocol.NUM_CHANNELS
+    RX_PREVIEW_BYTES = 32  # Bytes of each received chunk shown in the log
     
-    def __init__(self):
+    def __init__(self, acquisition_process: bool = False):
         super().__init__()
-        self.serial_manager = SerialManager()
+        # In process mode the serial port is owned by a child process that
+        # publishes telemetry through shared memory (pcc.shared)
+        self.acquisition_process = acquisition_process
+        if acquisition_process:
+            from pcc.shared import ProcessTransport
+            self.serial_manager = SerialManager(ProcessTransport())
+        else:
+            self.serial_manager = SerialManager()
+        self.uploader = PipelinedUploader(self.serial_manager.transport)
         self.monitor_window = None
         self.is_monitoring = False
+        self.recorder = None
+        self.calibration = None  # pcc.calibration.Calibration, if loaded
+        self.calibration_path = None
+        self.sequence_runner = None
+        self.regulator = None  # pcc.regulator.ClosedLoopRegulator while regulating
         
         # UI Elements lists
         self.start_voltage_fields = []
@@ -102,6 +127,21 @@ class VoltageController(QWidget):
         self.start_button.setFont(start_font)
         self.start_button.clicked.connect(self.toggle_monitoring)
         
+        # Record button
+        self.record_button = QPushButton("Record")
+        self.record_button.setCheckable(True)
+        self.record_button.setMinimumHeight(50)
+        self.record_button.clicked.connect(self.toggle_recording)
+        if self.acquisition_process:
+            # Frames never reach this process, so there is nothing to record
+            self.record_button.setEnabled(False)
+            self.record_button.setToolTip("Recording is not available with a separate acquisition process")
+        
+        # Calibration button
+        self.calibration_button = QPushButton("Load Calibration")
+        self.calibration_button.setMinimumHeight(50)
+        self.calibration_button.clicked.connect(self.load_calibration)
+        
         # Serial port controls
         port_layout = QVBoxLayout()
         port_layout.addWidget(QLabel("Serial Port:"))
@@ -124,6 +164,8 @@ class VoltageController(QWidget):
         
         control_layout.addLayout(port_layout)
         control_layout.addStretch()
+        control_layout.addWidget(self.calibration_button)
+        control_layout.addWidget(self.record_button)
         control_layout.addWidget(self.start_button)
         
         layout.addLayout(control_layout)
@@ -134,14 +176,31 @@ class VoltageController(QWidget):
         
         freq_layout.addWidget(QLabel("Frequency (Hz):"))
         self.frequency_field = QSpinBox()
-        self.frequency_field.setRange(1, 200000)
+        self.frequency_field.setRange(1, protocol.MAX_FREQUENCY)
         self.frequency_field.setValue(1000)
         
         freq_apply_btn = QPushButton("Apply")
-        freq_apply_btn.clicked.connect(self.set_frequency)
+        freq_apply_btn.clicked.connect(lambda: self.set_frequency())
         
         freq_layout.addWidget(self.frequency_field)
         freq_layout.addWidget(freq_apply_btn)
+        
+        # Sequence numbers and CRCs; selected on every start
+        self.extended_frames_cb = QCheckBox("CRC frames")
+        self.extended_frames_cb.setToolTip("Request telemetry frames with sequence numbers and checksums; "
+                                           "only the simulator sends them, boards keep sending plain frames")
+        freq_layout.addWidget(self.extended_frames_cb)
+        
+        # Held channels trimmed from the readback while monitoring
+        self.closed_loop_cb = QCheckBox("Closed loop")
+        self.closed_loop_cb.setToolTip("Correct channels holding a constant voltage (start = end, "
+                                       "hold end) from the measured voltages")
+        self.closed_loop_cb.toggled.connect(self.toggle_closed_loop)
+        if self.acquisition_process:
+            # The loop runs on the acquisition thread, which lives in the child process
+            self.closed_loop_cb.setEnabled(False)
+            self.closed_loop_cb.setToolTip("Closed loop is not available with a separate acquisition process")
+        freq_layout.addWidget(self.closed_loop_cb)
         freq_layout.addStretch()
         
         layout.addLayout(freq_layout)
@@ -249,7 +308,34 @@ class VoltageController(QWidget):
         send_values_btn = QPushButton("Send Values")
         send_values_btn.clicked.connect(self.update_voltages)
         
+        resend_btn = QPushButton("Resend All")
+        resend_btn.setToolTip("Send every channel, even those the board already has")
+        resend_btn.clicked.connect(self.resend_all)
+        
+        save_preset_btn = QPushButton("Save Preset")
+        save_preset_btn.clicked.connect(self.save_preset)
+        
+        load_preset_btn = QPushButton("Load Preset")
+        load_preset_btn.clicked.connect(self.load_preset)
+        
+        # Host-timed sweep through each channel's start/end/steps table
+        self.auto_sweep_btn = QPushButton("Auto Sweep")
+        self.auto_sweep_btn.setCheckable(True)
+        self.auto_sweep_btn.clicked.connect(self.toggle_sweep)
+        
+        self.dwell_field = QDoubleSpinBox()
+        self.dwell_field.setRange(0.001, 3600)
+        self.dwell_field.setDecimals(3)
+        self.dwell_field.setValue(0.1)
+        self.dwell_field.setSuffix(" s")
+        self.dwell_field.setToolTip("Dwell time per sweep step")
+        
         button_layout1.addWidget(send_values_btn)
+        button_layout1.addWidget(resend_btn)
+        button_layout1.addWidget(self.auto_sweep_btn)
+        button_layout1.addWidget(self.dwell_field)
+        button_layout1.addWidget(save_preset_btn)
+        button_layout1.addWidget(load_preset_btn)
     
 
         # Add these two lines to add the button layouts to the main layout
@@ -279,16 +365,18 @@ class VoltageController(QWidget):
         # Auto-scroll checkbox
         self.auto_scroll_cb = QCheckBox("Auto-scroll")
         self.auto_scroll_cb.setChecked(True)
+        self.auto_scroll_cb.toggled.connect(
+            lambda checked: setattr(self.serial_monitor, 'auto_scroll', checked)
+        )
         header_layout.addWidget(self.auto_scroll_cb)
         
         monitor_layout.addLayout(header_layout)
         
-        # Serial output text area
-        self.serial_monitor = QTextEdit()
-        self.serial_monitor.setReadOnly(True)
+        # Serial output log; bounded and flushed at a fixed rate
+        self.serial_monitor = SerialLog()
         self.serial_monitor.setMaximumHeight(200)
         self.serial_monitor.setStyleSheet("""
-            QTextEdit {
+            QPlainTextEdit {
                 background-color: #1e1e1e;
                 color: #ffffff;
                 font-family: 'Courier New', monospace;
@@ -302,34 +390,16 @@ class VoltageController(QWidget):
         
     def log_to_monitor(self, message: str, message_type: str = "info"):
         """Add message to serial monitor"""
-        import datetime
-        timestamp = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
-        
-        # Color coding based on message type
-        if message_type == "sent":
-            color = "#00ff00"  # Green for sent
-            prefix = "TX"
-        elif message_type == "received":
-            color = "#00aaff"  # Blue for received
-            prefix = "RX"
-        elif message_type == "error":
-            color = "#ff4444"  # Red for errors
-            prefix = "ERR"
-        elif message_type == "connection":
-            color = "#ffaa00"  # Orange for connection events
-            prefix = "CONN"
-        else:
-            color = "#ffffff"  # White for info
-            prefix = "INFO"
-            
-        formatted_message = f'<span style="color: #888888">[{timestamp}]</span> <span style="color: {color}; font-weight: bold">{prefix}:</span> <span style="color: {color}">{message}</span>'
+        self.serial_monitor.log(message, message_type)
         
-        self.serial_monitor.append(formatted_message)
-        
-        # Auto-scroll to bottom if enabled
-        if self.auto_scroll_cb.isChecked():
-            scrollbar = self.serial_monitor.verticalScrollBar()
-            scrollbar.setValue(scrollbar.maximum())
+    def log_received_data(self, data: bytes):
+        """Log a raw chunk from the board, within the RX rate limit"""
+        if not self.serial_monitor.allow("received"):
+            self.serial_monitor.suppress("received")
+            return
+        preview = data[:self.RX_PREVIEW_BYTES].hex(' ')
+        more = "..." if len(data) > self.RX_PREVIEW_BYTES else ""
+        self.serial_monitor.log(f"{len(data)} bytes: {preview}{more}", "received")
             
     def clear_serial_monitor(self):
         """Clear the serial monitor"""
@@ -340,13 +410,20 @@ class VoltageController(QWidget):
         """Setup signal connections and initial state"""
         self.refresh_ports()
         
+        # Command futures complete on the acquisition thread; their handlers
+        # are queued back onto the GUI thread
+        self.command_completed.connect(
+            lambda handler, future: handler(future), Qt.ConnectionType.QueuedConnection
+        )
+        self.sequence_finished.connect(
+            self.log_sequence_report, Qt.ConnectionType.QueuedConnection
+        )
+        
         # Connect serial manager signals to monitor
         self.serial_manager.packet_sent.connect(
             lambda msg: self.log_to_monitor(msg, "sent")
         )
-        self.serial_manager.data_received.connect(
-            lambda data: self.log_to_monitor(f"{data.decode('ascii', errors='replace')}", "received")
-        )
+        self.serial_manager.data_received.connect(self.log_received_data)
         self.serial_manager.connection_changed.connect(
             lambda connected, port: self.log_to_monitor(
                 f"{'Connected to' if connected else 'Disconnected from'} {port}", 
@@ -389,31 +466,119 @@ class VoltageController(QWidget):
             self.stop_monitoring()
         else:
             self.start_monitoring()
-    def wait_for_confirmation(self, timeout_ms=2000):
-        """Wait for a confirmation response from device
-        
-        Args:
-            timeout_ms: Maximum time to wait in milliseconds
-            
-        Returns:
-            bool: True if confirmation received, False if timeout
-        """
-        start_time = time.time()
-        timeout_seconds = timeout_ms / 1000
-        
-        # Create a local event loop to wait without freezing the UI
-        while time.time() - start_time < timeout_seconds:
-            # Process events to keep UI responsive
-            QApplication.processEvents()
-            
-            # Check for confirmation in received data
-            if self.serial_manager.has_confirmation():
-                return True
-                
-            time.sleep(0.01)  # Small sleep to avoid CPU hogging
+    def send_command(self, packet: List[int], description: str):
+        """Send a command and log the result once the device echoes it"""
+        future = self.serial_manager.send_command(packet, description)
+        self.when_done(future, lambda f: self.log_command_result(f, description))
+        return future
+        
+    def when_done(self, future: Future, handler):
+        """Run handler(future) on the GUI thread once future completes"""
+        future.add_done_callback(lambda f: self.command_completed.emit(handler, f))
+        
+    def log_command_result(self, future: Future, description: str):
+        """Log whether a command was confirmed"""
+        error = future.exception()
+        if error is None:
+            self.log_to_monitor(f"{description} confirmed", "info")
+        else:
+            self.log_to_monitor(f"No confirmation received for {description}: {error}", "error")
+            
+    def toggle_recording(self):
+        """Start or stop recording telemetry to a binary file"""
+        if self.recorder:
+            self.stop_recording()
+            return
             
-        return False
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Record Telemetry", "telemetry.pccrec", "Telemetry recordings (*.pccrec)"
+        )
+        if not path:
+            self.record_button.setChecked(False)
+            return
             
+        from pcc.recording import TelemetryRecorder
+        
+        try:
+            self.recorder = TelemetryRecorder(
+                path, self.NUM_CHANNELS, self.MAX_VOLTAGE, self.recording_settings()
+            )
+            self.recorder.start()
+        except (OSError, ValueError) as e:
+            self.recorder = None
+            self.record_button.setChecked(False)
+            self.log_to_monitor(f"Could not start recording: {e}", "error")
+            return
+            
+        # The recorder is fed straight from the acquisition thread
+        if not self.serial_manager.transport.add_frame_listener(self.recorder.write_frames):
+            self.recorder.close()
+            self.recorder = None
+            self.record_button.setChecked(False)
+            self.log_to_monitor("Recording is not available with a separate acquisition process",
+                                "error")
+            return
+        self.record_button.setText("Recording")
+        self.log_to_monitor(f"Recording telemetry to {path}", "info")
+        
+    def stop_recording(self):
+        """Stop recording and close the file"""
+        if not self.recorder:
+            return
+            
+        self.serial_manager.transport.remove_frame_listener(self.recorder.write_frames)
+        self.recorder.close()
+        self.log_to_monitor(
+            f"Recorded {self.recorder.records_written} frames to {self.recorder.path}"
+            f" ({self.recorder.batches_dropped} batches dropped)", "info"
+        )
+        self.recorder = None
+        self.record_button.setChecked(False)
+        self.record_button.setText("Record")
+        
+    def load_calibration(self):
+        """Load per-channel corrections used for packets and readback"""
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Load Calibration", "", "Calibration files (*.json)"
+        )
+        if not path:
+            return
+            
+        from pcc.calibration import Calibration
+        
+        try:
+            calibration = Calibration.load(path)
+            if calibration.num_channels != self.NUM_CHANNELS:
+                raise ValueError(f"File has {calibration.num_channels} channels, expected {self.NUM_CHANNELS}")
+        except (OSError, KeyError, ValueError) as e:
+            self.log_to_monitor(f"Could not load calibration: {e}", "error")
+            QMessageBox.warning(self, "Calibration Error", str(e))
+            return
+            
+        self.calibration = calibration
+        self.calibration_path = path
+        if self.monitor_window:
+            self.monitor_window.converter.calibration = calibration
+        self.calibration_button.setText("Calibrated")
+        self.log_to_monitor(f"Loaded calibration from {path}", "info")
+        
+    def recording_settings(self) -> dict:
+        """Current device settings stored in the recording header"""
+        return {
+            "port": self.port_dropdown.currentText(),
+            "frequency": self.frequency_field.value(),
+            "calibration": self.calibration_path,
+            "channels": [
+                {
+                    "start": self.start_voltage_fields[i].value(),
+                    "end": self.end_voltage_fields[i].value(),
+                    "steps": self.step_fields[i].value(),
+                    "hold_end": self.hold_end_checkboxes[i].isChecked(),
+                }
+                for i in range(self.NUM_CHANNELS)
+            ],
+        }
+        
     def start_monitoring(self):
         """Start voltage monitoring"""
         if not self.serial_manager.is_connected():
@@ -426,62 +591,66 @@ class VoltageController(QWidget):
         self.start_button.setText("Running")
         self.log_to_monitor("Starting voltage monitoring", "info")
         
-        # Send start data collection packet
-        start_packet = [170, 4, 2, 0]
-        self.serial_manager.send_packet(start_packet, "Start monitoring")
-
-        # Wait for confirmation (with timeout)
-        self.log_to_monitor(f"Waiting for confirmation from channel", "info")
-        if self.wait_for_confirmation(2000):  # 2-second timeout
-            self.log_to_monitor(f"Channel configuration confirmed", "info")
-        else:
-            self.log_to_monitor(f"No confirmation received for channel", "error")
+        # Send start data collection packet; frames are shown as soon as they
+        # arrive, the confirmation is logged when the echo comes back
+        frame_format = (protocol.FRAME_EXTENDED if self.extended_frames_cb.isChecked()
+                        else protocol.FRAME_LEGACY)
+        self.send_command(protocol.frame_format_packet(frame_format), "Frame format")
+        self.send_command(protocol.start_packet(), "Start monitoring")
+        
+        # Show the monitor window, built once and reused across runs
+        monitor_window = self.create_monitor_window()
+        monitor_window.start_monitoring()
+        monitor_window.show()
+        
+        if self.closed_loop_cb.isChecked():
+            self.start_regulator()
+        
+    def create_monitor_window(self):
+        """Build the monitor window on first use and return it"""
+        if self.monitor_window is None:
+            from voltage_monitor import VoltageMonitor
             
-        time.sleep(0.1)  # Small delay between packets
-        
-        # Open monitor window
-        self.monitor_window = VoltageMonitor(self.serial_manager)
-        self.monitor_window.closed.connect(self.stop_monitoring)
-        
-        # Connect monitor window logging
-        self.monitor_window.data_parsed.connect(
-            lambda voltages: self.log_to_monitor(
-                f"Voltages: {', '.join([f'{v:.2f}V' for v in voltages[:6]])}...", 
-                "received"
+            self.monitor_window = VoltageMonitor(self.serial_manager)
+            self.monitor_window.converter.calibration = self.calibration
+            self.monitor_window.stop_monitoring()
+            self.monitor_window.closed.connect(self.stop_monitoring)
+            
+            # Connect monitor window logging
+            self.monitor_window.data_parsed.connect(
+                lambda voltages: self.log_to_monitor(
+                    f"Voltages: {', '.join([f'{v:.2f}V' for v in voltages[:6]])}...", 
+                    "telemetry"
+                )
             )
-        )
-        
-        self.monitor_window.show()
+        return self.monitor_window
         
     def stop_monitoring(self):
         """Stop voltage monitoring"""
+        if not self.is_monitoring:
+            return  # Re-entered from the monitor window's closed signal
         self.is_monitoring = False
         self.start_button.setText("Start")
         self.log_to_monitor("Stopping voltage monitoring", "info")
+        self.stop_regulator()
         
         # Send stop data collection packet
         if self.serial_manager.is_connected():
-            stop_packet = [170, 4, 8, 0]
-            self.serial_manager.send_packet(stop_packet, "Stop monitoring")
-            # Wait for confirmation (with timeout)
-            self.log_to_monitor(f"Waiting for confirmation from channel", "info")
-            if self.wait_for_confirmation(2000):  # 2-second timeout
-                self.log_to_monitor(f"Channel configuration confirmed", "info")
-            else:
-                self.log_to_monitor(f"No confirmation received for channel", "error")
-            time.sleep(0.1)  # Small delay between packets
+            self.send_command(protocol.stop_packet(), "Stop monitoring")
             
-        # Close monitor window
+        # Hide the monitor window; it is shown again on the next start
         if self.monitor_window:
-            self.monitor_window.close()
-            self.monitor_window = None
+            self.monitor_window.stop_monitoring()
+            self.monitor_window.hide()
             
-    def set_frequency(self):
+    def set_frequency(self, only_changed: bool = False):
         """Set DAC frequency"""
         frequency = self.frequency_field.value()
         
-        if frequency > 200000:
-            error_msg = f"Frequency too high. DACs can handle max 200kHz, you set {frequency} Hz"
+        try:
+            freq_packet = protocol.frequency_packet(frequency)
+        except ValueError as e:
+            error_msg = str(e)
             self.log_to_monitor(error_msg, "error")
             QMessageBox.warning(self, "Value Error", error_msg)
             return
@@ -493,20 +662,9 @@ class VoltageController(QWidget):
                                "Please connect to a serial port first.")
             return
             
-        # Convert frequency to bytes (big-endian, 3 bytes)
-        freq_bytes = struct.pack('>I', frequency)[1:4]  # Take last 3 bytes
-        freq_packet = [170, 7, 8] + list(freq_bytes) + [0]
-        
-        self.serial_manager.send_packet(freq_packet, f"Frequency ({frequency} Hz)")
-
-        # Wait for confirmation (with timeout)
-        self.log_to_monitor(f"Waiting for confirmation from channel", "info")
-        if self.wait_for_confirmation(2000):  # 2-second timeout
-            self.log_to_monitor(f"Channel configuration confirmed", "info")
-        else:
-            self.log_to_monitor(f"No confirmation received for channel", "error")
-            
-        time.sleep(0.1)  # Small delay between packets
+        if only_changed and self.serial_manager.transport.device_state.is_current(freq_packet):
+            return
+        self.send_command(freq_packet, f"Frequency ({frequency} Hz)")
     
         
     def set_all_values(self, field_type):
@@ -533,24 +691,110 @@ class VoltageController(QWidget):
                                "Please connect to a serial port first.")
             return
             
-        self.log_to_monitor("Sending voltage configuration to all channels", "info")
-        
+        packets = []
         for i in range(self.NUM_CHANNELS):
             if not self.validate_channel_values(i):
                 return
-                
-            packet = self.create_voltage_packet(i)
-            self.serial_manager.send_packet(packet, f"Channel {i + 1}")
-
-            # Wait for confirmation (with timeout)
-            self.log_to_monitor(f"Waiting for confirmation from channel", "info")
-            if self.wait_for_confirmation(2000):  # 2-second timeout
-                self.log_to_monitor(f"Channel configuration confirmed", "info")
-            else:
-                self.log_to_monitor(f"No confirmation received for channel", "error")
-                
-            time.sleep(0.1)  # Small delay between packets
+            packets.append((self.create_voltage_packet(i), f"Channel {i + 1}"))
             
+        # Packets are pipelined; each echo is matched to its channel packet.
+        # Channels the board has already acknowledged are skipped
+        changed_targets = {}
+        if self.regulator and self.regulator.running:
+            # Keep the trim of channels whose target stays the same; the
+            # others start from their open loop code once it is confirmed
+            for channel, target in self.regulation_targets().items():
+                current = self.regulator.targets[channel]
+                if target == current or (target is None and math.isnan(current)):
+                    packet = self.regulator.correction_packet(channel)
+                    if packet is not None:
+                        packets[channel] = (packet, f"Channel {channel + 1}")
+                else:
+                    changed_targets[channel] = target
+                    
+            # Stop trimming them until the board holds the new open loop code
+            self.regulator.set_targets({channel: None for channel in changed_targets})
+                    
+        future = self.uploader.upload(packets, only_changed=True)
+        sent = len(packets) - self.uploader.skipped
+        self.log_to_monitor(f"Sending voltage configuration to {sent} changed channel(s)", "info")
+        self.when_done(future, self.log_upload_result)
+        if changed_targets:
+            self.when_done(future, lambda f: self.apply_confirmed_targets(f, changed_targets))
+            
+    def apply_confirmed_targets(self, future: Future, targets: dict):
+        """Regulate the channels whose new open loop code the board confirmed"""
+        failed = set(future.result())
+        confirmed = {channel: target for channel, target in targets.items()
+                     if channel not in failed}
+        if self.regulator and self.regulator.running and confirmed:
+            self.regulator.set_targets(confirmed)
+        
+    def resend_all(self):
+        """Forget the mirrored device state and send every channel"""
+        self.serial_manager.transport.device_state.invalidate()
+        self.update_voltages()
+        
+    def preset_settings(self) -> dict:
+        """Frequency and channel settings as stored in a preset"""
+        settings = self.recording_settings()
+        return {"frequency": settings["frequency"], "channels": settings["channels"]}
+        
+    def save_preset(self):
+        """Save the frequency and channel table to a preset file"""
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Save Preset", "preset.json", "Presets (*.json)"
+        )
+        if not path:
+            return
+        try:
+            save_preset(path, self.preset_settings())
+        except OSError as e:
+            self.log_to_monitor(f"Could not save preset: {e}", "error")
+            return
+        self.log_to_monitor(f"Saved preset to {path}", "info")
+        
+    def load_preset(self):
+        """Fill the table from a preset and send what changed"""
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Load Preset", "", "Presets (*.json)"
+        )
+        if not path:
+            return
+        try:
+            preset = load_preset(path, self.NUM_CHANNELS)
+        except (OSError, ValueError) as e:
+            self.log_to_monitor(f"Could not load preset: {e}", "error")
+            QMessageBox.warning(self, "Preset Error", str(e))
+            return
+            
+        for i, channel in enumerate(preset["channels"]):
+            self.start_voltage_fields[i].setValue(channel["start"])
+            self.end_voltage_fields[i].setValue(channel["end"])
+            self.step_fields[i].setValue(channel["steps"])
+            self.hold_end_checkboxes[i].setChecked(channel["hold_end"])
+        if "frequency" in preset:
+            self.frequency_field.setValue(preset["frequency"])
+        self.log_to_monitor(f"Loaded preset from {path}", "info")
+        
+        if self.serial_manager.is_connected():
+            self.update_voltages()
+            if "frequency" in preset:
+                self.set_frequency(only_changed=True)
+        
+    def log_upload_result(self, future: Future):
+        """Log the outcome of a channel configuration upload"""
+        failed = future.result()
+        elapsed_ms = self.uploader.elapsed * 1000
+        if failed:
+            channels = ', '.join(str(i + 1) for i in failed)
+            self.log_to_monitor(f"No confirmation received for channel(s) {channels}", "error")
+        else:
+            self.log_to_monitor(
+                f"All channel configurations confirmed in {elapsed_ms:.1f} ms "
+                f"({self.uploader.retransmissions} retransmissions, "
+                f"{self.uploader.skipped} unchanged)", "info"
+            )
             
     def validate_channel_values(self, channel_num):
         """Validate voltage and step values for a channel"""
@@ -580,30 +824,130 @@ class VoltageController(QWidget):
         start_val = self.start_voltage_fields[channel_num].value()
         end_val = self.end_voltage_fields[channel_num].value()
         steps_val = self.step_fields[channel_num].value()
-        hold_end_val = 1 if self.hold_end_checkboxes[channel_num].isChecked() else 0
+        hold_end_val = self.hold_end_checkboxes[channel_num].isChecked()
         
-        # Convert voltage to DAC values (16-bit)
-        start_dac = int(start_val * 65535 / self.MAX_VOLTAGE)
-        end_dac = int(end_val * 65535 / self.MAX_VOLTAGE)
+        return protocol.channel_config_packet(
+            channel_num, start_val, end_val, steps_val, hold_end_val, self.calibration
+        )
         
-        # Create packet with big-endian byte order
-        packet = [170, 12, 1, channel_num + 1, hold_end_val]  # channel_num is 1-indexed
-        packet.extend(struct.pack('>H', start_dac))  # Start value (big-endian)
-        packet.extend(struct.pack('>H', end_dac))    # End value (big-endian)
-        packet.extend(struct.pack('>H', steps_val))  # Steps (big-endian)
-        packet.append(0)
+    def regulation_targets(self) -> dict:
+        """Channel -> voltage of every channel holding a constant voltage, None for the others"""
+        targets = {}
+        for i in range(self.NUM_CHANNELS):
+            start_val = self.start_voltage_fields[i].value()
+            held = (self.hold_end_checkboxes[i].isChecked()
+                    and start_val == self.end_voltage_fields[i].value())
+            targets[i] = start_val if held else None
+        return targets
+        
+    def toggle_closed_loop(self, checked: bool):
+        """Start or stop regulation; it only runs while monitoring"""
+        if not self.is_monitoring:
+            return
+        if checked:
+            self.start_regulator()
+        else:
+            self.stop_regulator()
+            
+    def start_regulator(self):
+        """Trim held channels from the readback on the acquisition thread"""
+        from pcc.regulator import ClosedLoopRegulator
+        
+        if self.regulator and self.regulator.running:
+            return
+        targets = self.regulation_targets()
+        regulated = sum(target is not None for target in targets.values())
+        if not regulated:
+            self.log_to_monitor("Closed loop: no channel holds a constant voltage", "error")
+            return
+        self.regulator = ClosedLoopRegulator(self.serial_manager.transport,
+                                             calibration=self.calibration)
+        self.regulator.set_targets(targets)
+        if not self.regulator.start():
+            self.regulator = None
+            self.log_to_monitor("Closed loop: not available with a separate acquisition process",
+                                "error")
+            return
+        self.log_to_monitor(f"Closed loop regulating {regulated} channel(s)", "info")
         
-        return packet
+    def stop_regulator(self):
+        """Stop regulation, restore the open loop codes and log the loop timing"""
+        if not self.regulator or not self.regulator.running:
+            return
+        for future in self.regulator.stop(restore=self.serial_manager.is_connected()):
+            self.when_done(future, lambda f: self.log_command_result(f, "Open loop setpoint"))
+        report = self.regulator.report()
+        self.log_to_monitor(
+            f"Closed loop stopped after {report['updates']} updates: "
+            f"{report['corrections_sent']} corrections, latency p50 {report['latency_p50_us']:.0f} us, "
+            f"p99 {report['latency_p99_us']:.0f} us, {report['overruns']} overruns",
+            "error" if report["corrections_failed"] or report["overruns"] else "info"
+        )
         
     def toggle_sweep(self):
         """Toggle auto sweep mode"""
         if self.auto_sweep_btn.isChecked():
-            self.auto_sweep_btn.setText("Stop Sweep")
+            self.start_sweep()
         else:
-            self.auto_sweep_btn.setText("Auto Sweep")
+            self.stop_sweep()
+            
+    def start_sweep(self):
+        """Step every channel from start to end on a host-timed schedule"""
+        if not self.serial_manager.is_connected():
+            self.auto_sweep_btn.setChecked(False)
+            self.log_to_monitor("Cannot sweep: not connected", "error")
+            QMessageBox.warning(self, "Connection Error", 
+                               "Please connect to a serial port first.")
+            return
+            
+        program = channel_staircases(
+            [field.value() for field in self.start_voltage_fields],
+            [field.value() for field in self.end_voltage_fields],
+            [field.value() for field in self.step_fields],
+            self.dwell_field.value()
+        )
+        self.sequence_runner = SequenceRunner(
+            self.serial_manager.transport, program, calibration=self.calibration
+        )
+        # The report arrives on the runner thread
+        self.sequence_runner.on_finished = self.sequence_finished.emit
+        try:
+            self.sequence_runner.start()
+        except ValueError as e:
+            self.sequence_runner = None
+            self.auto_sweep_btn.setChecked(False)
+            self.log_to_monitor(str(e), "error")
+            QMessageBox.warning(self, "Value Error", str(e))
+            return
+            
+        self.auto_sweep_btn.setText("Stop Sweep")
+        self.log_to_monitor(
+            f"Sweeping {len(program)} steps, {self.dwell_field.value():.3f} s each", "info"
+        )
+        
+    def stop_sweep(self):
+        """Abort a running sweep"""
+        if self.sequence_runner:
+            self.sequence_runner.stop()
+            
+    def log_sequence_report(self, report: dict):
+        """Log the timing of a finished or aborted sweep"""
+        self.sequence_runner = None
+        self.auto_sweep_btn.setChecked(False)
+        self.auto_sweep_btn.setText("Auto Sweep")
+        self.log_to_monitor(
+            f"Sweep ended after {report['steps']} steps: lateness mean "
+            f"{report['lateness_mean_us']:.0f} us, max {report['lateness_max_us']:.0f} us",
+            "error" if report["failed_steps"] else "info"
+        )
+        if report["failed_steps"]:
+            self.log_to_monitor(f"Unconfirmed steps: {report['failed_steps']}", "error")
             
     def closeEvent(self, event):
         """Handle application close event"""
+        self.stop_sweep()
+        self.stop_recording()
+        self.stop_monitoring()
         if self.monitor_window:
             self.monitor_window.close()
         self.serial_manager.disconnect()
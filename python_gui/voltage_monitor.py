@@ -2,34 +2,96 @@
 VoltageMonitor - Real-time voltage monitoring window
 """
 
-import struct
+import logging
+import time
 import numpy as np
 from typing import List, Optional
-from PyQt6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel
-from PyQt6.QtCore import QTimer, pyqtSignal, Qt
+from PyQt6.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QLineEdit,
+    QDoubleSpinBox, QSpinBox, QStackedWidget, QPushButton, QFileDialog,
+    QTableWidget, QTableWidgetItem, QHeaderView
+)
+from PyQt6.QtCore import pyqtSignal, Qt, QTimer
 from PyQt6.QtGui import QFont
 import pyqtgraph as pg
 
+from pcc import protocol
+from pcc.convert import FrameConverter
+from pcc.decoder import FrameDecoder
+from pcc.history import HistoryBuffer, minmax_decimate
+from pcc.spectrum import RippleAnalyzer
+from pcc.stats import AlarmEngine, ChannelStats, format_event, load_alarms
 from serial_manager import SerialManager
 
+log = logging.getLogger("pcc.gui")
+
 class VoltageMonitor(QWidget):
     # Signals
     closed = pyqtSignal()
-    data_parsed = pyqtSignal(object)  # Emits voltage data array
+    data_parsed = pyqtSignal(object)  # Emits latest voltage data array
+    block_parsed = pyqtSignal(object)  # Emits (N, NUM_CHANNELS) block per batch
+    alarms_changed = pyqtSignal(object)  # Emits the AlarmEvents of a batch
     
     # Constants
-    PACKET_SIZE = 50  # Expected packet size: 2*24 channels + start/stop bytes
-    NUM_CHANNELS = 24
-    MAX_VOLTAGE = 30
+    PACKET_SIZE = FrameDecoder.FRAME_SIZE  # 2*24 channels + start/stop bytes
+    NUM_CHANNELS = protocol.NUM_CHANNELS
+    MAX_VOLTAGE = protocol.MAX_VOLTAGE
+    HISTORY_LEN = HistoryBuffer.HISTORY_LEN
+    MAX_FPS = 60  # Display refreshes per second, independent of the data rate
+    LABEL_CHANNELS = 12  # Channels shown in the text display
+    DISPLAY_DECIMALS = 2  # Precision of the text display
+    STATS_COLUMNS = ["Mean", "Std", "Min", "Max", "RMS", "Ripple", "Peak Hz", "Peak V", "Alarm"]
+    SPECTRUM_FPS = 4  # Spectrum view refreshes per second; averages change slowly
     
-    def __init__(self, serial_manager: SerialManager):
+    def __init__(self, serial_manager: SerialManager, history_len: int = HISTORY_LEN,
+                 max_fps: int = MAX_FPS):
         super().__init__()
         self.serial_manager = serial_manager
         self.voltage_data = np.zeros(self.NUM_CHANNELS)
         
-        # Timer for reading serial data
-        self.read_timer = QTimer()
-        self.read_timer.timeout.connect(self.read_serial_data)
+        # Batches only mark the display dirty; a timer renders the latest
+        # state at most max_fps times per second
+        self.max_fps = max_fps
+        self.last_render_time = 0.0
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.timeout.connect(self.render_pending)
+        self.shown_bars: Optional[np.ndarray] = None
+        self.shown_label: Optional[np.ndarray] = None
+        
+        # Display statistics
+        self.renders = 0
+        self.renders_coalesced = 0  # Batches merged into an already scheduled render
+        self.bar_updates_skipped = 0
+        self.label_updates_skipped = 0
+        
+        # Rolling per-channel history for the strip chart
+        self.history = HistoryBuffer(history_len, self.NUM_CHANNELS)
+        self.last_batch_time: Optional[float] = None
+        self.strip_channels = [0]
+        self.strip_curves = []
+        
+        # Running statistics and threshold alarms over every batch
+        self.stats = ChannelStats(self.NUM_CHANNELS)
+        self.alarms = AlarmEngine(self.NUM_CHANNELS)
+        self.last_alarm_text = ""
+        self.shown_alarm_bars: Optional[np.ndarray] = None
+        self.ripple = RippleAnalyzer(self.NUM_CHANNELS)
+        self.spectrum_curves = []
+        self.last_spectrum_time = 0.0
+        
+        # The window is reused across start/stop cycles
+        self.is_monitoring = False
+        self.start_time: Optional[float] = None
+        self.first_frame_latency: Optional[float] = None  # Start to first render (s)
+        
+        # With a separate acquisition process, rows are read from its shared
+        # ring on a timer instead of arriving as frames
+        self.ring_reader = None
+        self.ring_timer = QTimer(self)
+        self.ring_timer.timeout.connect(self.read_ring)
+        self.rows_overwritten = 0  # Ring rows the writer reused before they were drawn
+        self.converter = FrameConverter(self.NUM_CHANNELS, self.MAX_VOLTAGE)
         
         self.init_ui()
         self.start_monitoring()
@@ -62,7 +124,18 @@ class VoltageMonitor(QWidget):
         # Create bar chart
         self.create_bar_chart()
         
-        layout.addWidget(self.plot_widget)
+        # View selection
+        self.create_view_controls(layout)
+        
+        self.plot_stack = QStackedWidget()
+        self.plot_stack.addWidget(self.plot_widget)
+        self.create_strip_chart()
+        self.plot_stack.addWidget(self.strip_widget)
+        self.create_stats_table()
+        self.plot_stack.addWidget(self.stats_table)
+        self.create_spectrum_plot()
+        self.plot_stack.addWidget(self.spectrum_widget)
+        layout.addWidget(self.plot_stack)
         
         # Status label
         self.status_label = QLabel("Status: Monitoring...")
@@ -85,6 +158,146 @@ class VoltageMonitor(QWidget):
         )
         self.plot_widget.addItem(self.bar_chart)
         
+    def create_view_controls(self, layout):
+        """Create the bar/strip chart selection controls"""
+        view_layout = QHBoxLayout()
+        
+        view_layout.addWidget(QLabel("View:"))
+        self.view_selector = QComboBox()
+        self.view_selector.addItems(["Bar chart", "Strip chart", "Statistics", "Spectrum"])
+        self.view_selector.currentIndexChanged.connect(self.change_view)
+        view_layout.addWidget(self.view_selector)
+        
+        view_layout.addWidget(QLabel("Channels:"))
+        self.strip_channel_field = QLineEdit("1")
+        self.strip_channel_field.setPlaceholderText("e.g. 1-4, 7")
+        self.strip_channel_field.setMaximumWidth(150)
+        self.strip_channel_field.editingFinished.connect(self.set_strip_channels)
+        view_layout.addWidget(self.strip_channel_field)
+        
+        view_layout.addWidget(QLabel("Window (s):"))
+        self.strip_window_field = QDoubleSpinBox()
+        self.strip_window_field.setRange(0.1, 3600)
+        self.strip_window_field.setValue(10)
+        view_layout.addWidget(self.strip_window_field)
+        
+        view_layout.addWidget(QLabel("Max FPS:"))
+        self.fps_field = QSpinBox()
+        self.fps_field.setRange(1, 240)
+        self.fps_field.setValue(self.max_fps)
+        self.fps_field.valueChanged.connect(self.set_max_fps)
+        view_layout.addWidget(self.fps_field)
+        
+        view_layout.addStretch()
+        self.alarms_button = QPushButton("Alarms...")
+        self.alarms_button.setToolTip("Load per-channel alarm limits from a JSON file")
+        self.alarms_button.clicked.connect(self.load_alarm_file)
+        view_layout.addWidget(self.alarms_button)
+        self.reset_stats_button = QPushButton("Reset Stats")
+        self.reset_stats_button.clicked.connect(self.reset_statistics)
+        view_layout.addWidget(self.reset_stats_button)
+        layout.addLayout(view_layout)
+        
+    def set_max_fps(self, fps: int):
+        """Change the display refresh cap"""
+        self.max_fps = max(1, fps)
+        self.ring_timer.setInterval(1000 // self.max_fps)
+        
+    def create_strip_chart(self):
+        """Create the plot showing selected channels over time"""
+        self.strip_widget = pg.PlotWidget()
+        self.strip_widget.setLabel('left', 'Voltage (V)')
+        self.strip_widget.setLabel('bottom', 'Time (s)')
+        self.strip_widget.setTitle('Voltage History')
+        self.strip_widget.setYRange(0, self.MAX_VOLTAGE)
+        self.strip_widget.showGrid(x=True, y=True)
+        self.strip_widget.addLegend()
+        self.create_strip_curves()
+        
+    def create_strip_curves(self):
+        """Create one curve per selected strip chart channel"""
+        for curve in self.strip_curves:
+            self.strip_widget.removeItem(curve)
+        self.strip_curves = [
+            self.strip_widget.plot(
+                pen=pg.intColor(channel, hues=self.NUM_CHANNELS),
+                name=f"Ch{channel + 1}"
+            )
+            for channel in self.strip_channels
+        ]
+        self.create_spectrum_curves()
+        
+    def create_stats_table(self):
+        """Create the table of per-channel statistics"""
+        self.stats_table = QTableWidget(self.NUM_CHANNELS, len(self.STATS_COLUMNS))
+        self.stats_table.setHorizontalHeaderLabels(self.STATS_COLUMNS)
+        self.stats_table.setVerticalHeaderLabels([f"Ch{i + 1}" for i in range(self.NUM_CHANNELS)])
+        self.stats_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.stats_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.stats_table.setStyleSheet("font-family: monospace;")
+        for row in range(self.NUM_CHANNELS):
+            for column in range(len(self.STATS_COLUMNS)):
+                self.stats_table.setItem(row, column, QTableWidgetItem(""))
+                
+    def create_spectrum_plot(self):
+        """Create the plot of the averaged ripple spectrum of the selected channels"""
+        self.spectrum_widget = pg.PlotWidget()
+        self.spectrum_widget.setLabel('left', 'Amplitude (V)')
+        self.spectrum_widget.setLabel('bottom', 'Frequency (Hz)')
+        self.spectrum_widget.setTitle('Ripple Spectrum')
+        self.spectrum_widget.setLogMode(y=True)
+        self.spectrum_widget.showGrid(x=True, y=True)
+        self.spectrum_widget.addLegend()
+        self.create_spectrum_curves()
+        
+    def create_spectrum_curves(self):
+        """Create one spectrum curve per selected channel"""
+        if not hasattr(self, 'spectrum_widget'):
+            return  # Strip curves are created first
+        for curve in self.spectrum_curves:
+            self.spectrum_widget.removeItem(curve)
+        self.spectrum_curves = [
+            self.spectrum_widget.plot(
+                pen=pg.intColor(channel, hues=self.NUM_CHANNELS),
+                name=f"Ch{channel + 1}"
+            )
+            for channel in self.strip_channels
+        ]
+        self.last_spectrum_time = 0.0
+        
+    def change_view(self, index: int):
+        """Switch between the bar chart, the strip chart, the statistics and the spectrum"""
+        self.plot_stack.setCurrentIndex(index)
+        self.update_strip_chart()
+        self.update_stats_table()
+        self.last_spectrum_time = 0.0
+        self.update_spectrum()
+        
+    def set_strip_channels(self):
+        """Parse the channel selection, e.g. '1-4, 7'"""
+        channels = []
+        try:
+            for part in self.strip_channel_field.text().split(','):
+                part = part.strip()
+                if not part:
+                    continue
+                if '-' in part:
+                    first, last = (int(value) for value in part.split('-', 1))
+                    channels.extend(range(first - 1, last))
+                else:
+                    channels.append(int(part) - 1)
+        except ValueError:
+            channels = []
+            
+        channels = [c for c in dict.fromkeys(channels) if 0 <= c < self.NUM_CHANNELS]
+        if not channels:
+            self.status_label.setText("Status: Invalid channel selection")
+            return
+            
+        self.strip_channels = channels
+        self.create_strip_curves()
+        self.update_strip_chart()
+        
     def create_voltage_labels(self, layout):
         """Create text labels showing current voltages"""
         voltage_layout = QHBoxLayout()
@@ -97,87 +310,280 @@ class VoltageMonitor(QWidget):
         layout.addLayout(voltage_layout)
         
     def start_monitoring(self):
-        """Start monitoring serial data"""
-        # Start reading timer (read every 50ms)
-        self.read_timer.start(50)
-        
-    def read_serial_data(self):
-        """Read and process serial data"""
-        if not self.serial_manager.is_connected():
-            self.status_label.setText("Status: Not connected")
+        """Start monitoring serial data with a cleared display"""
+        if self.is_monitoring:
+            return
+        self.is_monitoring = True
+        self.reset_display()
+        self.start_time = time.monotonic()
+        self.first_frame_latency = None
+        
+        self.ring_reader = self.serial_manager.open_ring_reader()
+        if self.ring_reader is not None:
+            self.ring_timer.start(1000 // self.max_fps)
             return
             
-        data = self.serial_manager.read_available_data()
-        if data:
-            self.process_received_data(data)
+        # The acquisition thread hands over decoded frames as they arrive
+        self.serial_manager.frames_received.connect(
+            self.process_frames, Qt.ConnectionType.QueuedConnection
+        )
+        
+    def stop_monitoring(self):
+        """Stop monitoring serial data; the window can be started again"""
+        if not self.is_monitoring:
+            return
+        self.is_monitoring = False
+        if self.ring_reader is not None:
+            self.ring_timer.stop()
+            self.ring_reader = None
+        else:
+            try:
+                self.serial_manager.frames_received.disconnect(self.process_frames)
+            except TypeError:
+                pass  # Already disconnected
+        self.render_timer.stop()
+        
+    def reset_display(self):
+        """Forget the data of a previous run"""
+        self.voltage_data = np.zeros(self.NUM_CHANNELS)
+        self.history.clear()
+        self.last_batch_time = None
+        self.shown_bars = None
+        self.shown_label = None
+        self.bar_chart.setOpts(height=self.voltage_data)
+        for curve in self.strip_curves:
+            curve.setData([], [])
+        self.voltage_display.setText("Waiting for data...")
+        self.status_label.setText("Status: Monitoring...")
+        self.reset_statistics()
+        
+    def read_ring(self):
+        """Timer slot: convert every row the acquisition process published"""
+        reader = self.ring_reader
+        if reader is None or reader.ring.raw is None:
+            return
+        received = False
+        while True:
+            # Zero-copy views into shared memory, valid until the writer laps them
+            times, raw = reader.read()
+            if len(raw) == 0:
+                break
+            block = self.converter.convert_raw(raw)
+            if not reader.intact():
+                continue
+            self.voltage_data = block[-1].copy()
+            seconds = times / 1e9
+            self.history.extend(block, seconds)
+            self.update_statistics(block, seconds)
+            self.block_parsed.emit(block)
+            received = True
+        self.rows_overwritten = reader.rows_lost
+        if received:
+            self.data_parsed.emit(self.voltage_data)
+            self.schedule_display()
             
-    def process_received_data(self, data: bytes):
-        """Process received data and extract voltage information"""
-        try:
-            # Look for complete packets in the data
-            data_len = len(data)
-            
-            # Search for packet start (0xAA) and end (0x55) markers
-            for i in range(data_len - self.PACKET_SIZE + 1):
-                if (i + self.PACKET_SIZE <= data_len and 
-                    data[i] == 0xAA and 
-                    data[i + self.PACKET_SIZE - 1] == 0x55):
-                    
-                    packet = data[i:i + self.PACKET_SIZE]
-                    self.parse_voltage_packet(packet)
-                    break
-                    
-        except Exception as e:
-            print(f"Error processing data: {e}")
+    def process_frames(self, frames: List[bytes]):
+        """Parse every complete telemetry frame"""
+        if frames:
+            self.parse_voltage_packets(frames)
             
     def parse_voltage_packet(self, packet: bytes):
         """Parse voltage data from packet"""
+        self.parse_voltage_packets([packet])
+        
+    def parse_voltage_packets(self, packets: List[bytes]):
+        """Parse a batch of packets in one vectorized conversion"""
         try:
-            # Extract voltage bytes (exclude start and end markers)
-            voltage_bytes = packet[1:-1]  # Skip first and last byte
+            # Block is only valid until the next batch is converted
+            block = self.converter.convert(packets)
+            self.voltage_data = block[-1].copy()
+            timestamps = self.record_history(block)
+            self.update_statistics(block, timestamps)
             
-            # Convert pairs of bytes to 16-bit values (little-endian)
-            num_voltage_values = len(voltage_bytes) // 2
-            voltage_raw = struct.unpack(f'<{num_voltage_values}H', voltage_bytes)
+            # Emit signals once per batch rather than once per frame
+            self.block_parsed.emit(block)
+            self.data_parsed.emit(self.voltage_data)
             
-            # Convert to actual voltages
-            if len(voltage_raw) >= self.NUM_CHANNELS:
-                voltage_data = np.array(voltage_raw[:self.NUM_CHANNELS])
-                self.voltage_data = voltage_data * self.MAX_VOLTAGE / 65535.0
-                
-                # Emit signal for main window logging
-                self.data_parsed.emit(self.voltage_data)
-                
-                # Update display
-                self.update_display()
-                
-                # Log data (optional - can be removed for performance)
-                #hex_packet = ' '.join([f'{b:02X}' for b in packet])
-                #print(f"Raw packet: {hex_packet}")
-                #voltage_str = ', '.join([f'{v:.2f}V' for v in self.voltage_data[:8]])  # Show first 8
-                #print(f"Voltages (first 8): {voltage_str}")
-                
-        except Exception as e:
-            print(f"Error parsing voltage packet: {e}")
+            # Render at the display rate, not the data rate
+            self.schedule_display()
+            
+        except Exception:
+            log.exception("Error parsing voltage packet")
+            
+    def schedule_display(self):
+        """Render the latest state once the frame interval has passed"""
+        if self.render_timer.isActive():
+            self.renders_coalesced += 1
+            return
+        interval = 1.0 / self.max_fps
+        wait = interval - (time.monotonic() - self.last_render_time)
+        self.render_timer.start(max(0, int(wait * 1000)))
+        
+    def render_pending(self):
+        """Timer slot: draw everything received since the last render"""
+        self.last_render_time = time.monotonic()
+        self.renders += 1
+        self.update_display()
+        if self.first_frame_latency is None and self.start_time is not None:
+            self.first_frame_latency = time.monotonic() - self.start_time
+            log.info("First frame drawn %.1f ms after start", self.first_frame_latency * 1000)
+            
+    def record_history(self, block: np.ndarray) -> np.ndarray:
+        """Append a batch to the history, spreading it over its arrival time"""
+        now = time.monotonic()
+        if self.last_batch_time is None or now - self.last_batch_time > 1.0:
+            timestamps = np.full(len(block), now)
+        else:
+            timestamps = np.linspace(self.last_batch_time, now, len(block) + 1)[1:]
+        self.last_batch_time = now
+        self.history.extend(block, timestamps)
+        return timestamps
+        
+    def update_statistics(self, block: np.ndarray, timestamps: np.ndarray):
+        """Fold a batch into the statistics and check it against the alarm limits"""
+        self.stats.update(block)
+        self.ripple.update(block, timestamps)
+        if not self.alarms.enabled:
+            return
+        events = self.alarms.evaluate(block, timestamps, self.stats)
+        if events:
+            for event in events:
+                log.warning("Alarm: %s", format_event(event))
+            self.last_alarm_text = format_event(events[-1])
+            self.alarms_changed.emit(events)
+            
+    def reset_statistics(self):
+        """Restart the statistics and clear every alarm"""
+        self.stats.reset()
+        self.ripple.reset()
+        self.alarms.reset()
+        self.last_alarm_text = ""
+        self.update_stats_table()
+        
+    def load_alarm_file(self):
+        """Ask for an alarm file and apply its limits (see pcc.stats.load_alarms)"""
+        path, _ = QFileDialog.getOpenFileName(self, "Load Alarm Limits", "", "JSON files (*.json)")
+        if not path:
+            return
+        try:
+            config = load_alarms(path, self.NUM_CHANNELS)
+        except (OSError, ValueError) as e:
+            self.status_label.setText(f"Status: Could not load alarms: {e}")
+            return
+        self.alarms = config["engine"]
+        if config["window"] is not None:
+            self.stats = ChannelStats(self.NUM_CHANNELS, config["window"])
+        self.reset_statistics()
+        
+    def update_stats_table(self):
+        """Refresh the statistics table if it is shown"""
+        if self.plot_stack.currentWidget() is not self.stats_table:
+            return
+        stats = self.stats
+        report = self.ripple.report()
+        columns = [stats.mean, stats.std, stats.minimum, stats.maximum, stats.rms, stats.ripple,
+                   report.frequency, report.amplitude]
+        alarms = {}
+        for channel, kind in self.alarms.active_alarms():
+            alarms.setdefault(channel, []).append(kind)
+        for row in range(self.NUM_CHANNELS):
+            for column, values in enumerate(columns):
+                value = values[row]
+                text = f"{value:.4f}" if stats.count and np.isfinite(value) else ""
+                self.stats_table.item(row, column).setText(text)
+            self.stats_table.item(row, len(columns)).setText(", ".join(alarms.get(row, [])))
+            
+    def update_spectrum(self):
+        """Redraw the ripple spectrum, at most SPECTRUM_FPS times per second"""
+        if self.plot_stack.currentWidget() is not self.spectrum_widget:
+            return
+        now = time.monotonic()
+        if now - self.last_spectrum_time < 1.0 / self.SPECTRUM_FPS or self.ripple.segments == 0:
+            return
+        self.last_spectrum_time = now
+        
+        # Skip DC, which the per-segment mean removal leaves near zero
+        frequencies = self.ripple.frequencies()[1:]
+        spectrum = self.ripple.amplitude_spectrum()[:, 1:]
+        # Log axes can't show exact zeros, e.g. of a constant channel
+        np.maximum(spectrum, 1e-9, out=spectrum)
+        for channel, curve in zip(self.strip_channels, self.spectrum_curves):
+            curve.setData(frequencies, spectrum[channel])
+        
+    def update_alarm_bars(self):
+        """Draw the bars of channels with a raised alarm in red"""
+        alarmed = np.zeros(self.NUM_CHANNELS, dtype=bool)
+        for channel, _ in self.alarms.active_alarms():
+            alarmed[channel] = True
+        if self.shown_alarm_bars is not None and np.array_equal(alarmed, self.shown_alarm_bars):
+            return
+        self.bar_chart.setOpts(brushes=['red' if alarm else 'skyblue' for alarm in alarmed])
+        self.shown_alarm_bars = alarmed
+        
+    def alarm_status(self) -> str:
+        """Raised alarms and the latest alarm event, if any"""
+        active = self.alarms.active_alarms()
+        if not active:
+            return f" - last alarm: {self.last_alarm_text}" if self.last_alarm_text else ""
+        names = ", ".join(f"Ch{channel + 1} {kind}" for channel, kind in active[:6])
+        more = f" (+{len(active) - 6})" if len(active) > 6 else ""
+        return f" - ALARM: {names}{more}"
+        
+    def update_strip_chart(self):
+        """Redraw the strip chart from a min/max-decimated history window"""
+        if self.plot_stack.currentWidget() is not self.strip_widget:
+            return
+            
+        times, data = self.history.window(self.strip_window_field.value(), self.strip_channels)
+        if len(times) == 0:
+            return
+            
+        # Two points (min and max) per horizontal pixel is all that can be seen
+        max_points = max(200, 2 * self.strip_widget.width())
+        times, data = minmax_decimate(times - times[-1], data, max_points)
+        for i, curve in enumerate(self.strip_curves):
+            curve.setData(times, data[:, i])
             
     def update_display(self):
         """Update the visual display with new voltage data"""
         try:
-            # Update bar chart
-            self.bar_chart.setOpts(height=self.voltage_data)
+            # Skip redraws that wouldn't change a pixel or a digit
+            rounded = np.round(self.voltage_data, self.DISPLAY_DECIMALS)
+            if self.shown_bars is None or not np.array_equal(rounded, self.shown_bars):
+                self.bar_chart.setOpts(height=self.voltage_data)
+                self.shown_bars = rounded
+            else:
+                self.bar_updates_skipped += 1
+            self.update_strip_chart()
+            self.update_stats_table()
+            self.update_spectrum()
+            self.update_alarm_bars()
             
             # Update text display (show first 12 channels)
-            voltage_text = ""
-            for i in range(min(12, self.NUM_CHANNELS)):
-                if i % 6 == 0 and i > 0:
-                    voltage_text += "\n"
-                voltage_text += f"Ch{i+1:2d}: {self.voltage_data[i]:5.2f}V  "
-                
-            self.voltage_display.setText(voltage_text)
-            self.status_label.setText("Status: Monitoring... (Data received)")
+            label_values = rounded[:self.LABEL_CHANNELS]
+            if self.shown_label is None or not np.array_equal(label_values, self.shown_label):
+                voltage_text = ""
+                for i in range(min(self.LABEL_CHANNELS, self.NUM_CHANNELS)):
+                    if i % 6 == 0 and i > 0:
+                        voltage_text += "\n"
+                    voltage_text += f"Ch{i+1:2d}: {self.voltage_data[i]:5.2f}V  "
+                self.voltage_display.setText(voltage_text)
+                self.shown_label = label_values
+            else:
+                self.label_updates_skipped += 1
+            self.status_label.setText(f"Status: Monitoring... (Data received)"
+                                      f"{self.integrity_status()}{self.alarm_status()}")
+            
+        except Exception:
+            log.exception("Error updating display")
             
-        except Exception as e:
-            print(f"Error updating display: {e}")
+    def integrity_status(self) -> str:
+        """Loss and corruption counts of the acquisition decoder, if any"""
+        decoder = self.serial_manager.decoder
+        if not (decoder.frames_dropped or decoder.crc_failures or decoder.resyncs):
+            return ""
+        return (f" - lost {decoder.frames_dropped}, CRC errors {decoder.crc_failures}, "
+                f"resyncs {decoder.resyncs}")
             
     def send_stop_packet(self):
         """Send stop monitoring packet"""
@@ -186,11 +592,13 @@ class VoltageMonitor(QWidget):
                 stop_packet = [170, 4, 6, 0]
                 self.serial_manager.send_packet(stop_packet, "Stop monitoring")
             except Exception as e:
-                print(f"Warning: Could not send stop packet: {e}")
+                log.warning("Could not send stop packet: %s", e)
                 
     def closeEvent(self, event):
         """Handle window close event"""
-        self.read_timer.stop()
-        self.send_stop_packet()
+        was_monitoring = self.is_monitoring
+        self.stop_monitoring()
+        if was_monitoring:
+            self.send_stop_packet()
         self.closed.emit()
         event.accept()
\ No newline at end of file